@@ -0,0 +1,77 @@
+"""
+The same game workload against each storage backend: playing games turn by turn (waiting for each write to be durable),
+undoing and branching, and the reads the cli and web ui make between turns
+
+    python -m benchmarks.backends --games 4 --turns 200
+"""
+
+import argparse
+import os
+import tempfile
+from typing import Dict, List
+
+from benchmarks.common import mean_ms, synthetic_game, timed
+from texty import database
+from texty.storage import MemoryBackend, SQLiteBackend, StorageBackend
+
+OPERATIONS = [
+    "insert",
+    "get_active_node",
+    "get_node",
+    "list_children",
+    "list_games",
+    "search",
+]
+
+
+def workload(storage: StorageBackend, games: int, turns: int) -> Dict[str, List[float]]:
+    samples: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+    for game in range(games):
+        nodes = []
+        for parent, node in synthetic_game(turns, rng_seed=game):
+            scenario_id = node.scenario_id()
+            with timed(samples["insert"]):
+                storage.insert_time_node(node, parent=parent).result()
+            nodes.append(node)
+            with timed(samples["get_active_node"]):
+                storage.get_active_node(scenario_id)
+            with timed(samples["list_games"]):
+                storage.list_games(limit=20)
+            if len(nodes) % 10 == 0:
+                # an undo, looking at the branches off of the node undone to
+                with timed(samples["get_node"]):
+                    storage.get_node(node.previous[-1], scenario_id)
+                with timed(samples["list_children"]):
+                    storage.list_children(node.previous[-1], scenario_id)
+                with timed(samples["search"]):
+                    storage.search(scenario_id, node.event_log[-2].text.split()[0])
+    return samples
+
+
+def run(label: str, storage: StorageBackend, games: int, turns: int):
+    samples = workload(storage, games, turns)
+    print(
+        f"{label:<8} "
+        + " ".join(f"{mean_ms(samples[op]):>{len(op)}.3f}" for op in OPERATIONS)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--games", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{args.games} games of {args.turns} turns, mean ms per operation")
+    print(f"{'backend':<8} " + " ".join(OPERATIONS))
+    with tempfile.TemporaryDirectory() as dir:
+        database.open_database(os.path.join(dir, "bench.db"))
+        storage = SQLiteBackend()
+        storage.init()
+        run("sqlite", storage, args.games, args.turns)
+        database.close_database()
+    run("memory", MemoryBackend(), args.games, args.turns)
+
+
+if __name__ == "__main__":
+    main()
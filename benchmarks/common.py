@@ -0,0 +1,120 @@
+"""
+Shared helpers for the benchmarks. Run them from the repository root, e.g. `python -m benchmarks.storage`
+"""
+
+import json
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+from texty.gametypes import (
+    AddGameElement,
+    GameElementUpdate,
+    LogItem,
+    PastPresentFuture,
+    TimeNode,
+    UpdateGameElement,
+)
+
+SEEDS_DIR = os.path.join(os.path.dirname(__file__), "..", "texty", "seeds")
+
+
+def load_seed(name: str = "zantar") -> TimeNode:
+    # read directly, texty.seeds pulls in the prompt templates
+    with open(os.path.join(SEEDS_DIR, f"{name}.json")) as f:
+        seed = json.load(f)
+    return TimeNode(
+        id=str(uuid.uuid4()),
+        summary="(Game not yet begun)",
+        premise=seed["premise"],
+        game_elements=seed["game_elements"],
+    )
+
+
+class TextGenerator:
+    """
+    Produces prose-like text from the words of a seed, so it compresses roughly like real game text
+    """
+
+    def __init__(self, seed: TimeNode, rng: random.Random):
+        self.rng = rng
+        self.words = " ".join(
+            [seed.premise]
+            + [
+                text
+                for el in seed.game_elements
+                for text in el.past + el.present + el.future
+            ]
+        ).split()
+
+    def sentence(self) -> str:
+        words = self.rng.choices(self.words, k=self.rng.randint(8, 24))
+        return " ".join(words).capitalize().rstrip(".,") + "."
+
+    def paragraph(self, sentences: int) -> str:
+        return " ".join(self.sentence() for _ in range(sentences))
+
+
+def synthetic_game(
+    turns: int, seed: str = "zantar", rng_seed: int = 0
+) -> Iterator[Tuple[TimeNode, TimeNode]]:
+    """
+    Play a synthetic game, the way game.advance_time would, yielding (parent, node) for every turn
+    """
+    rng = random.Random(rng_seed)
+    node = load_seed(seed)
+    text = TextGenerator(node, rng)
+    for turn in range(turns):
+        parent = node
+        node = parent.child(str(uuid.UUID(int=rng.getrandbits(128))))
+        node.timestep += 1
+        events = [
+            UpdateGameElement(
+                type="update_game_element",
+                element_id=rng.choice(node.game_elements).element_id,
+                add=PastPresentFuture(present=[text.sentence()]),
+            )
+            for _ in range(rng.randint(1, 3))
+        ]
+        if rng.random() < 0.2:
+            events.append(
+                AddGameElement(
+                    type="add_game_element",
+                    element_id=f"element-{turn}",
+                    name=" ".join(text.sentence().split()[:2]),
+                    element_type=rng.choice(["character", "object", "place"]),
+                    present=[text.sentence()],
+                    future=[text.sentence()],
+                )
+            )
+        update = GameElementUpdate(
+            response_plan=text.paragraph(3), events=events, summary=text.sentence()
+        )
+        node.summary = update.summary
+        node.apply_update(update)
+        node.event_log = node.event_log + [
+            LogItem(
+                role="player", type="act", text=text.sentence(), timestep=node.timestep
+            ),
+            LogItem(
+                role="game",
+                type="game-response",
+                text=text.paragraph(rng.randint(4, 10)),
+                timestep=node.timestep,
+            ),
+        ]
+        yield parent, node
+
+
+@contextmanager
+def timed(samples: List[float]):
+    start = time.perf_counter()
+    yield
+    samples.append(time.perf_counter() - start)
+
+
+def mean_ms(samples: List[float]) -> float:
+    return 1000 * sum(samples) / len(samples) if samples else 0.0
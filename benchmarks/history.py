@@ -0,0 +1,46 @@
+"""
+Size of the event history sent with every planning and narration prompt, as a game gets longer: the whole event log,
+against the last turns verbatim after a rolling summary (settings.summarize_history). The summary is a stand-in of
+the length the summarizing prompt asks for, so this measures the prompt, not the summarizer
+
+    python -m benchmarks.history --turns 1000
+"""
+
+import argparse
+
+from benchmarks.common import synthetic_game
+from texty import prompts
+from texty.gametypes import HistorySummary
+from texty.settings import settings
+
+# the summarizing prompt asks for at most 300 words
+SUMMARY = " ".join(["word"] * 300)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'turns':>8} {'full KiB':>10} {'summarized KiB':>15}")
+    checkpoints = {10, 50, 100, 250, 500, args.turns}
+    summary = None
+    for turn, (_, node) in enumerate(synthetic_game(args.turns), start=1):
+        node.history_summary = summary
+        through = node.history_fold_point(
+            settings.history_verbatim_turns, settings.history_fold_turns
+        )
+        if through is not None:
+            summary = node.history_summary = HistorySummary(
+                text=SUMMARY, through=through
+            )
+        if turn in checkpoints:
+            full = len(
+                prompts.dump_events(node.model_copy(update={"history_summary": None}))
+            )
+            summarized = len(prompts.dump_events(node))
+            print(f"{turn:>8} {full / 1024:>10.1f} {summarized / 1024:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Per-stage latency of a turn of advance_time: sequential, with speculative planning, single pass (narration and
+plan in one call), and with a streamed plan (narration starting once the plan's response_plan is written). The models
+are simulated with fixed delays, so this measures how the stages overlap, not the providers. "first text" is the time
+until the player sees the first narration, "commit" the time spent applying the turn's update after the narration
+
+    python -m benchmarks.pipeline --turns 20 --miss-rate 0.2
+"""
+
+import argparse
+import random
+import time
+from typing import Dict, Iterator, List, Type
+
+from pydantic import BaseModel
+
+from benchmarks.common import load_seed, mean_ms
+from texty import game
+from texty.game import StatusUpdate, TextResponse, advance_time
+from texty.gametypes import GameElementUpdate
+from texty.parsing import Partial
+from texty.prompts import GAME_UPDATE_MARKER, IntentDetection
+from texty.settings import settings
+
+# the status updates that start and end each stage
+STAGES = {
+    "intent": ("loading-intent", "loaded-intent"),
+    "plan": ("running-simulation", "ran-simulation"),
+    "respond": ("generate-response", "generated-response"),
+    # applying the update, which the ui doesn't wait for when it's committed in the background
+    "commit": ("committing", "done"),
+}
+COLUMNS = [*STAGES, "first text", "turn"]
+
+
+class SimulatedModel:
+    """
+    Answers after a fixed delay, detecting "inspect" rather than the guessed "act" for miss_rate of turns
+    """
+
+    def __init__(self, args: argparse.Namespace, rng: random.Random):
+        self.args = args
+        self.rng = rng
+
+    def text(self, prompt: str) -> str:
+        time.sleep(self.args.respond_ms / 1000)
+        return "The rain keeps falling."
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        time.sleep(self.args.respond_ms / 1000)
+        yield from ["The rain ", "keeps ", "falling."]
+        if settings.single_pass_turns:
+            # the update's tokens come after the narration's
+            time.sleep(self.args.trailer_ms / 1000)
+            update = GameElementUpdate(response_plan="", events=[], summary="It rains")
+            yield f"\n{GAME_UPDATE_MARKER}{update.model_dump_json()}"
+
+    def json_stream(self, prompt: str, schema: Type[BaseModel]) -> Iterator[Partial]:
+        # the response_plan comes first, the events and summary after it
+        time.sleep(self.args.plan_ms * self.args.response_plan_share / 1000)
+        update = GameElementUpdate(response_plan="", events=[], summary="It rains")
+        yield Partial(value=update, complete=frozenset({"response_plan"}))
+        time.sleep(self.args.plan_ms * (1 - self.args.response_plan_share) / 1000)
+        yield Partial(value=update, complete=frozenset(GameElementUpdate.model_fields))
+
+    def json(self, prompt: str, schema: Type[BaseModel]) -> BaseModel:
+        if schema is IntentDetection:
+            time.sleep(self.args.intent_ms / 1000)
+            miss = self.rng.random() < self.args.miss_rate
+            return IntentDetection(thought="", intent="inspect" if miss else "act")
+        time.sleep(self.args.plan_ms / 1000)
+        return GameElementUpdate(response_plan="", events=[], summary="It rains")
+
+
+def run(label: str, args: argparse.Namespace):
+    settings.speculative_planning = label == "speculative"
+    settings.single_pass_turns = label == "single pass"
+    settings.stream_planning = label == "streamed plan"
+    # every input should reach the (simulated) intent model
+    settings.intent_classifier = False
+    model = SimulatedModel(args, random.Random(0))
+    game.get_stage_client = lambda stage: model
+    samples: Dict[str, List[float]] = {stage: [] for stage in COLUMNS}
+    node = load_seed()
+    for _ in range(args.turns):
+        started: Dict[str, float] = {}
+        turn_start = time.perf_counter()
+        first_text = None
+        for event in advance_time("look around", node):
+            now = time.perf_counter()
+            if isinstance(event, TextResponse) and first_text is None:
+                first_text = now - turn_start
+            if not isinstance(event, StatusUpdate):
+                continue
+            for stage, (start, end) in STAGES.items():
+                if event.status == start:
+                    started[stage] = now
+                elif event.status == end:
+                    samples[stage].append(now - started[stage])
+        samples["first text"].append(first_text)
+        samples["turn"].append(time.perf_counter() - turn_start)
+    print(
+        f"{label:<14} "
+        + " ".join(f"{mean_ms(samples[column]):>10.0f}" for column in COLUMNS)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--intent-ms", type=float, default=800)
+    parser.add_argument("--plan-ms", type=float, default=2500)
+    parser.add_argument("--respond-ms", type=float, default=600)
+    # how much of the planning call goes to writing its response_plan, which a streamed plan narrates from
+    parser.add_argument("--response-plan-share", type=float, default=0.4)
+    # how long a single pass response takes to write the game update after its narration
+    parser.add_argument("--trailer-ms", type=float, default=1500)
+    # how often the speculative guess is wrong
+    parser.add_argument("--miss-rate", type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f"{args.turns} turns, mean ms per stage")
+    print(f"{'mode':<14} " + " ".join(f"{column:>10}" for column in COLUMNS))
+    for label in ["sequential", "speculative", "single pass", "streamed plan"]:
+        run(label, args)
+
+
+if __name__ == "__main__":
+    main()
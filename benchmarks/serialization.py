@@ -0,0 +1,115 @@
+"""
+Time spent turning stored rows back into time nodes, for a long (1k turn) game. Compares the ways of building the
+models, so that the load path in texty.database can stay on the fastest one
+
+    python -m benchmarks.serialization --turns 1000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from typing import Callable, List
+
+from benchmarks.common import mean_ms, synthetic_game, timed
+from texty import database
+from texty.gametypes import LogItem, TimeNode
+
+
+def measure(fn: Callable[[], object], repeat: int) -> float:
+    samples: List[float] = []
+    for _ in range(repeat):
+        with timed(samples):
+            fn()
+    return mean_ms(samples)
+
+
+def cold_get_node(id: str):
+    database.node_cache.clear()
+    database.get_node(id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    game = list(synthetic_game(args.turns))
+    parent, node = game[-1]
+    checkpoint = node.model_dump_json(exclude={"event_log"})
+    delta = database.diff_node(node, parent)
+    rows = [(x.role, x.type, x.text, x.timestep) for x in node.event_log]
+    log_dicts = [x.model_dump() for x in node.event_log]
+
+    cases = [
+        (
+            "checkpoint validate_json",
+            lambda: TimeNode.model_validate_json(checkpoint),
+        ),
+        (
+            "checkpoint json.loads+validate",
+            lambda: TimeNode.model_validate(json.loads(checkpoint)),
+        ),
+        (
+            "log LogItem() per row",
+            lambda: [
+                LogItem(role=r, type=t, text=x, timestep=s) for r, t, x, s in rows
+            ],
+        ),
+        (
+            "log model_construct per row",
+            lambda: [LogItem.model_construct(**d) for d in log_dicts],
+        ),
+        (
+            "log TypeAdapter",
+            lambda: database.LogItemList.validate_python(
+                [
+                    {"role": r, "type": t, "text": x, "timestep": s}
+                    for r, t, x, s in rows
+                ]
+            ),
+        ),
+        (
+            "elements deep copy",
+            lambda: [el.model_copy(deep=True) for el in parent.game_elements],
+        ),
+        (
+            "delta apply",
+            lambda: delta.apply(node.id, parent),
+        ),
+        (
+            "node deep copy",
+            lambda: node.model_copy(deep=True),
+        ),
+        (
+            "node child (shared) copy",
+            lambda: node.child("next"),
+        ),
+        (
+            "node dump+validate",
+            lambda: TimeNode.model_validate(node.model_dump()),
+        ),
+    ]
+
+    print(
+        f"node after {args.turns} turns: {len(node.event_log)} log items, "
+        f"{len(node.game_elements)} elements, {len(checkpoint) / 1024:.0f} KiB checkpoint"
+    )
+    print(f"{'case':<32} {'ms':>8}")
+    for label, fn in cases:
+        print(f"{label:<32} {measure(fn, args.repeat):>8.2f}")
+
+    with tempfile.TemporaryDirectory() as dir:
+        database.open_database(os.path.join(dir, "bench.db"))
+        database.init_db()
+        for parent, node in game:
+            database.insert_time_node(node, parent=parent)
+        database.db_writer.flush()
+        ms = measure(lambda: cold_get_node(node.id), args.repeat)
+        database.close_database()
+    print(f"{'get_node, uncached':<32} {ms:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
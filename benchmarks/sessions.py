@@ -0,0 +1,123 @@
+"""
+Turns completed by many concurrent players: each player on a worker thread running advance_time (as a threaded server
+like gradio's runs them), against every player on one event loop running advance_time_async. The models are simulated
+with fixed delays, so this measures how waiting on them is scheduled, not the providers
+
+    python -m benchmarks.sessions --sessions 200 --workers 40
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import AsyncIterator, Iterator, Type
+
+from pydantic import BaseModel
+
+from benchmarks.common import load_seed, mean_ms
+from texty import async_game, game
+from texty.async_game import advance_time_async
+from texty.game import advance_time
+from texty.gametypes import GameElementUpdate
+from texty.prompts import IntentDetection
+from texty.settings import settings
+
+
+def answer(schema: Type[BaseModel]) -> BaseModel:
+    if schema is IntentDetection:
+        return IntentDetection(thought="", intent="act")
+    return GameElementUpdate(response_plan="", events=[], summary="It rains")
+
+
+class SimulatedModel:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        time.sleep(self.args.respond_ms / 1000)
+        yield from ["The rain ", "keeps ", "falling."]
+
+    def json(self, prompt: str, schema: Type[BaseModel]) -> BaseModel:
+        time.sleep(self.args.plan_ms / 1000)
+        return answer(schema)
+
+
+class SimulatedAsyncModel:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.args.respond_ms / 1000)
+        for chunk in ["The rain ", "keeps ", "falling."]:
+            yield chunk
+
+    async def json(self, prompt: str, schema: Type[BaseModel]) -> BaseModel:
+        await asyncio.sleep(self.args.plan_ms / 1000)
+        return answer(schema)
+
+
+def report(label: str, turns: list, elapsed: float):
+    print(
+        f"{label:<8} {len(turns) / elapsed:>12.1f} {mean_ms(turns):>12.0f} {elapsed:>10.2f}"
+    )
+
+
+def run_threads(args: argparse.Namespace):
+    model = SimulatedModel(args)
+    game.get_stage_client = lambda stage: model
+    node = load_seed()
+
+    def play() -> float:
+        start = time.perf_counter()
+        for _ in advance_time("open the door", node):
+            pass
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        turns = list(pool.map(lambda _: play(), range(args.sessions)))
+    report("threads", turns, time.perf_counter() - start)
+
+
+def run_asyncio(args: argparse.Namespace):
+    model = SimulatedAsyncModel(args)
+    async_game.get_async_stage_client = lambda stage: model
+    node = load_seed()
+
+    async def play() -> float:
+        start = time.perf_counter()
+        async for _ in advance_time_async("open the door", node):
+            pass
+        return time.perf_counter() - start
+
+    async def main() -> list:
+        return await asyncio.gather(*(play() for _ in range(args.sessions)))
+
+    start = time.perf_counter()
+    turns = asyncio.run(main())
+    report("asyncio", turns, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=200)
+    # the threads serving players, e.g. gradio's default concurrency
+    parser.add_argument("--workers", type=int, default=40)
+    parser.add_argument("--plan-ms", type=float, default=2500)
+    parser.add_argument("--respond-ms", type=float, default=600)
+    args = parser.parse_args()
+    # one turn per player, of the default stages: an intent (detected by the model, as the local classifier
+    # isn't trained), a plan and a narration
+    settings.speculative_planning = False
+    settings.single_pass_turns = False
+    settings.stream_planning = False
+    settings.intent_classifier = True
+
+    print(f"{args.sessions} players taking a turn each at once")
+    print(f"{'engine':<8} {'turns/s':>12} {'mean turn ms':>12} {'total s':>10}")
+    run_threads(args)
+    run_asyncio(args)
+
+
+if __name__ == "__main__":
+    main()
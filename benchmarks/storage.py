@@ -0,0 +1,69 @@
+"""
+Bytes on disk and load time of stored time nodes, for each node storage format
+
+    python -m benchmarks.storage --turns 300
+"""
+
+import argparse
+import os
+import tempfile
+from typing import List
+
+from benchmarks.common import mean_ms, synthetic_game, timed
+from texty import database
+from texty.settings import settings
+
+FORMATS = [
+    # (label, node_storage, node_compression)
+    ("full json", "full", "none"),
+    ("delta json", "delta", "none"),
+    ("delta zlib", "delta", "zlib"),
+    ("delta zlib-dict", "delta", "zlib-dict"),
+]
+
+
+def run(turns: int, label: str, node_storage: str, node_compression: str):
+    settings.node_storage = node_storage
+    settings.node_compression = node_compression
+    with tempfile.TemporaryDirectory() as dir:
+        path = os.path.join(dir, "bench.db")
+        database.open_database(path)
+        database.init_db()
+        ids = []
+        for parent, node in synthetic_game(turns):
+            database.insert_time_node(node, parent=parent)
+            ids.append(node.id)
+        database.db_writer.flush()
+
+        with database.db_pool.connection() as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            (data_bytes,) = conn.execute(
+                "SELECT sum(length(data)) FROM time_nodes"
+            ).fetchone()
+        file_bytes = os.path.getsize(path)
+
+        database.node_cache.clear()
+        samples: List[float] = []
+        for id in ids:
+            with timed(samples):
+                database.get_node(id)
+        database.close_database()
+
+    print(
+        f"{label:<18} {file_bytes / 1024:>10.0f} {data_bytes / 1024:>10.0f} {mean_ms(samples):>12.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"{args.turns} turns")
+    print(f"{'format':<18} {'file KiB':>10} {'data KiB':>10} {'load ms/node':>12}")
+    for format in FORMATS:
+        run(args.turns, *format)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,166 @@
-from texty import database
+import argparse
+import sys
+
+from texty import database, intent
 from texty.cli import run_scenario
+from texty.settings import settings
+
+
+def compact(args: argparse.Namespace):
+    database.init_db()
+    result = database.compact(
+        keep_branches=args.keep_branches,
+        batch_size=args.batch_size,
+        time_budget=args.time_budget,
+    )
+    print(
+        f"deleted {result.nodes_deleted} time nodes and {result.log_items_deleted} log items, "
+        f"freed {result.pages_freed} pages"
+        + ("" if result.complete else " (stopped at the time budget)")
+    )
+    if args.vacuum:
+        database.vacuum()
+        print("vacuumed")
+
+
+def export(args: argparse.Namespace):
+    database.init_db()
+    if args.output == "-":
+        stats = database.export_scenario(args.scenario_id, sys.stdout)
+    else:
+        with open(args.output, "w") as out:
+            stats = database.export_scenario(args.scenario_id, out)
+    print(f"exported {stats}", file=sys.stderr)
+
+
+def import_(args: argparse.Namespace):
+    database.init_db()
+    if args.input == "-":
+        stats = database.import_scenario(
+            sys.stdin, overwrite=args.overwrite, batch_size=args.batch_size
+        )
+    else:
+        with open(args.input) as input:
+            stats = database.import_scenario(
+                input, overwrite=args.overwrite, batch_size=args.batch_size
+            )
+    print(f"imported {stats}", file=sys.stderr)
+
+
+def train_intent(args: argparse.Namespace):
+    database.init_db()
+    examples = database.list_player_actions()
+    train, test = intent.split(examples, args.holdout)
+    classifier = intent.IntentClassifier()
+    classifier.train(train, epochs=args.epochs)
+    classifier.save(args.output)
+    print(f"trained on {len(train)} player inputs, saved to {args.output}")
+    if test:
+        print_evaluation(intent.evaluate(classifier, test, args.threshold))
+
+
+def evaluate_intent(args: argparse.Namespace):
+    database.init_db()
+    classifier = intent.get_classifier(args.model)
+    print_evaluation(
+        intent.evaluate(classifier, database.list_player_actions(), args.threshold)
+    )
+
+
+def print_evaluation(evaluation: intent.Evaluation):
+    print(
+        f"{evaluation.examples} player inputs: {evaluation.accuracy:.1%} agree with the LLM, "
+        f"{evaluation.coverage:.1%} confident enough to skip it, of which {evaluation.confident_accuracy:.1%} agree. "
+        f"{evaluation.mean_microseconds:.1f}us per input"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="texty")
+    commands = parser.add_subparsers(dest="command")
+
+    play = commands.add_parser("play", help="play a game in the terminal (default)")
+    play.add_argument("scenario_id", nargs="?", default="llama70b-5")
+
+    compact_parser = commands.add_parser(
+        "compact",
+        help="delete branches that no active game can reach, and shrink the database file",
+    )
+    compact_parser.add_argument(
+        "--keep-branches",
+        type=int,
+        default=0,
+        help="abandoned branches to keep per game, most recent first",
+    )
+    compact_parser.add_argument("--batch-size", type=int, default=200)
+    compact_parser.add_argument(
+        "--time-budget", type=float, default=None, help="seconds to spend at most"
+    )
+    compact_parser.add_argument(
+        "--vacuum",
+        action="store_true",
+        help="also rebuild the whole file. Needed once for databases created before incremental vacuuming",
+    )
+
+    export_parser = commands.add_parser(
+        "export", help="write a game, with all of its branches, as ndjson"
+    )
+    export_parser.add_argument("scenario_id")
+    export_parser.add_argument(
+        "-o", "--output", default="-", help="file to write to, stdout by default"
+    )
+
+    import_parser = commands.add_parser("import", help="load a game written by export")
+    import_parser.add_argument(
+        "input", nargs="?", default="-", help="file to read, stdin by default"
+    )
+    import_parser.add_argument(
+        "--overwrite", action="store_true", help="replace the game if it exists"
+    )
+    import_parser.add_argument("--batch-size", type=int, default=100)
+
+    train_parser = commands.add_parser(
+        "train-intent",
+        help="train the local intent classifier on the intents the LLM detected for logged player inputs",
+    )
+    train_parser.add_argument("-o", "--output", default=settings.intent_model_path)
+    train_parser.add_argument("--epochs", type=int, default=20)
+    train_parser.add_argument(
+        "--holdout",
+        type=float,
+        default=0.2,
+        help="fraction of inputs held out to evaluate on",
+    )
+    train_parser.add_argument(
+        "--threshold", type=float, default=settings.intent_classifier_threshold
+    )
+
+    eval_parser = commands.add_parser(
+        "eval-intent",
+        help="compare the local intent classifier against the LLM's intents for logged player inputs",
+    )
+    eval_parser.add_argument("--model", default=settings.intent_model_path)
+    eval_parser.add_argument(
+        "--threshold", type=float, default=settings.intent_classifier_threshold
+    )
+
+    args = parser.parse_args()
+    if args.command == "compact":
+        compact(args)
+    elif args.command == "export":
+        export(args)
+    elif args.command == "import":
+        import_(args)
+    elif args.command == "train-intent":
+        train_intent(args)
+    elif args.command == "eval-intent":
+        evaluate_intent(args)
+    else:
+        run_scenario(getattr(args, "scenario_id", "llama70b-5"))
 
 
 if __name__ == "__main__":
     try:
-        database.init_db()
-        run_scenario("llama70b-5")
+        main()
     except KeyboardInterrupt:
         print("Interrupted...")
@@ -0,0 +1,340 @@
+"""
+The game loop on asyncio: the same turn as texty.game, with model calls awaited on AsyncOpenAI / AsyncAnthropic
+rather than blocking a thread each, so one event loop can serve many concurrent players
+"""
+
+import asyncio
+from concurrent.futures import Future
+from typing import AsyncIterator, List, Optional, Tuple
+
+from texty import seeds
+from texty.database import NodeListing
+from texty.game import (
+    AdvanceTimeProgress,
+    Game,
+    SinglePassNarration,
+    StatusUpdate,
+    StreamedEvents,
+    TextResponse,
+    begin_turn,
+    clarification,
+    commit_executor,
+    commit_turn,
+    guess_intent,
+    intent_prompt,
+    local_intent,
+    next_time_node,
+    plan_and_narrate_prompt,
+    pending_commits,
+    pending_commits_lock,
+    plan_prompt,
+    respond_prompt,
+    valid_plan,
+)
+from texty.gametypes import GameElementUpdate, TimeNode
+from texty.models.model import get_async_stage_client
+from texty.parsing import Partial
+from texty.prompts import Intent, IntentDetection
+from texty.settings import settings
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGame(Game):
+    """
+    A Game whose start_if_not_started and step are async iterators, and whose undo, redo, jump and children are
+    coroutines. Reading `node` while a turn is being committed blocks, so the event loop should await current_node
+    instead
+    """
+
+    async def current_node(self) -> Optional[TimeNode]:
+        await wait_for_commit_async(self.scenario_id)
+        return self._node
+
+    async def undo(self) -> bool:
+        # a turn still being committed would make its node current after the undo
+        await wait_for_commit_async(self.scenario_id)
+        node_ids = self._node.previous[-2:]
+        previous = (
+            await self.storage.get_node_async(node_ids[-1], self.scenario_id)
+            if len(node_ids) > 1
+            else None
+        )
+        preprevious = (
+            await self.storage.get_node_async(node_ids[-2], self.scenario_id)
+            if len(node_ids) > 2
+            else None
+        )
+        if not previous:
+            return False
+        self.node = previous
+        self.last_node = preprevious
+        await self.storage.set_active_node_async(self.scenario_id, previous.id)
+        return True
+
+    async def children(self) -> List[NodeListing]:
+        node = await self.current_node()
+        assert node is not None
+        return await self.storage.list_children_async(node.id, self.scenario_id)
+
+    async def jump(self, node_id: str) -> bool:
+        await wait_for_commit_async(self.scenario_id)
+        node = await self.storage.get_node_async(node_id, self.scenario_id)
+        if not node or node.scenario_id() != self.scenario_id:
+            return False
+        self.node = node
+        self.last_node = (
+            await self.storage.get_node_async(node.previous[-1], self.scenario_id)
+            if len(node.previous) > 1
+            else None
+        )
+        await self.storage.set_active_node_async(self.scenario_id, node.id)
+        return True
+
+    async def redo(self) -> bool:
+        children = await self.children()
+        return len(children) > 0 and await self.jump(children[0].node_id)
+
+    async def start_if_not_started(
+        self, seed: TimeNode = seeds.zantar
+    ) -> AsyncIterator[AdvanceTimeProgress]:
+        await wait_for_commit_async(self.scenario_id)
+        self.node = await self.storage.get_active_node_async(self.scenario_id)
+        if not self.node:
+            node = seed.model_copy(update={"id": self.scenario_id})
+            async for event in advance_time_async(
+                "(the player has entered. Set the scene for them, imagine a starting scene, and introduce the character and the story)",
+                node,
+                is_initialization=True,
+            ):
+                if type(event) == StatusUpdate and event.updated_time_node:
+                    node = event.updated_time_node
+                yield event
+            self.last_node = self.node
+            self.node = node
+            await asyncio.wrap_future(self.storage.insert_time_node(self.node))
+
+    async def step(self, player_action: str) -> AsyncIterator[AdvanceTimeProgress]:
+        previous = await self.current_node()
+        assert previous is not None
+        updated = None
+        write: Optional[Future] = None
+        turn = advance_time_async(player_action, previous)
+        async for event in turn:
+            if (
+                type(event) == StatusUpdate
+                and event.commit is not None
+                and settings.background_commit
+            ):
+                self.commit_in_background(event.commit, previous)
+                await turn.aclose()
+                yield event
+                return
+            if type(event) == StatusUpdate and event.updated_time_node:
+                updated = event.updated_time_node
+                self.last_node = previous
+                self.node = updated
+                write = self.storage.insert_time_node(updated, parent=previous)
+            yield event
+        if updated is None:
+            logger.warn("something's wrong, no node updated")
+        # once the turn is shown, and before the caller moves on, so that reads see it
+        if write is not None:
+            await asyncio.wrap_future(write)
+
+
+async def advance_time_async(
+    player_action: str, time_node: TimeNode, is_initialization: bool = False
+) -> AsyncIterator[AdvanceTimeProgress]:
+    """
+    An iteration of the game loop, as advance_time
+    """
+    time_node = next_time_node(time_node)
+
+    detected_intent: Optional[IntentDetection] = None
+    speculation: Optional[Tuple[Intent, "asyncio.Task[GameElementUpdate]"]] = None
+    # the rest of a streamed plan, being applied to time_node while the narration streams
+    applying: Optional["asyncio.Task[GameElementUpdate]"] = None
+    try:
+        if not is_initialization:
+            if settings.speculative_planning and not settings.single_pass_turns:
+                guess = guess_intent(time_node)
+                speculation = (
+                    guess,
+                    asyncio.create_task(
+                        plan_update_async(plan_prompt(player_action, guess, time_node))
+                    ),
+                )
+            yield StatusUpdate(status="loading-intent")
+            detected_intent = await detect_intent_async(player_action, time_node)
+            yield StatusUpdate(
+                status="loaded-intent",
+                debug=f"{detected_intent.intent}: {detected_intent.thought}",
+            )
+
+        intent: Intent = detected_intent.intent if detected_intent else "act"
+        if speculation is not None and speculation[0] != intent:
+            # unlike a thread, the wrong guess's request is actually stopped
+            speculation[1].cancel()
+        events = begin_turn(player_action, intent, time_node, detected_intent)
+        # whether the update's events were applied to time_node as they streamed in
+        events_applied = False
+        update: Optional[GameElementUpdate] = None
+        response = ""
+        if intent == "ambiguous":
+            response = clarification(detected_intent)
+            yield TextResponse(full_text=response, delta=response)
+        elif settings.single_pass_turns:
+            yield StatusUpdate(status="generate-response")
+            narration = SinglePassNarration()
+            prompt = plan_and_narrate_prompt(player_action, intent, time_node)
+            async for chunk in get_async_stage_client("respond").stream(prompt):
+                text = narration.feed(chunk)
+                if text:
+                    yield text
+            text = narration.close()
+            if text:
+                yield text
+            response = narration.response.strip()
+            yield StatusUpdate(status="generated-response")
+            yield StatusUpdate(status="running-simulation")
+            update = narration.update()
+            if update is None:
+                update = await plan_update_async(
+                    plan_prompt(player_action, intent, time_node)
+                )
+            yield StatusUpdate(status="ran-simulation")
+        elif settings.stream_planning and (
+            speculation is None or speculation[0] != intent
+        ):
+            # as narrate_while_planning
+            yield StatusUpdate(status="running-simulation")
+            partials = aiter(
+                get_async_stage_client("plan").json_stream(
+                    plan_prompt(player_action, intent, time_node), GameElementUpdate
+                )
+            )
+            planned = await first_whole_plan_async(partials)
+            if planned is None:
+                logger.warning(
+                    "the streamed plan has no whole response_plan, replanning"
+                )
+                planned = await plan_update_async(
+                    plan_prompt(player_action, intent, time_node)
+                )
+            yield StatusUpdate(status="planned-response")
+            prompt = respond_prompt(
+                player_action,
+                intent,
+                time_node,
+                planned,
+                include={"response_plan", "events"},
+            )
+            # time_node is only changed from here on, once the narration prompt has been written
+            applying = asyncio.create_task(
+                apply_streamed_events_async(partials, planned, time_node)
+            )
+            yield StatusUpdate(status="generate-response")
+            async for chunk in get_async_stage_client("respond").stream(prompt):
+                response += chunk
+                yield TextResponse(full_text=response, delta=chunk)
+            yield StatusUpdate(status="generated-response")
+            update = await applying
+            events_applied = True
+            yield StatusUpdate(status="ran-simulation")
+        else:
+            yield StatusUpdate(status="running-simulation")
+            if speculation is not None and speculation[0] == intent:
+                update = await speculation[1]
+            else:
+                update = await plan_update_async(
+                    plan_prompt(player_action, intent, time_node)
+                )
+            yield StatusUpdate(status="ran-simulation")
+            yield StatusUpdate(status="generate-response")
+            prompt = respond_prompt(player_action, intent, time_node, update)
+            async for chunk in get_async_stage_client("respond").stream(prompt):
+                response += chunk
+                yield TextResponse(full_text=response, delta=chunk)
+            yield StatusUpdate(status="generated-response")
+    finally:
+        # a turn that failed or was abandoned mustn't leave its speculative plan running
+        if speculation is not None:
+            speculation[1].cancel()
+        if applying is not None:
+            applying.cancel()
+    commit = commit_executor.submit(
+        commit_turn,
+        time_node,
+        events,
+        update,
+        response,
+        is_initialization,
+        events_applied,
+    )
+    yield StatusUpdate(status="committing", commit=commit)
+    yield StatusUpdate(
+        status="done", updated_time_node=await asyncio.wrap_future(commit)
+    )
+
+
+async def detect_intent_async(
+    player_action: str, time_node: TimeNode
+) -> IntentDetection:
+    local = local_intent(player_action)
+    if local is not None:
+        return local
+    return await get_async_stage_client("intent").json(
+        intent_prompt(player_action, time_node), IntentDetection
+    )
+
+
+async def plan_update_async(plan_prompt: str) -> GameElementUpdate:
+    return await get_async_stage_client("plan").json(plan_prompt, GameElementUpdate)
+
+
+async def first_whole_plan_async(
+    partials: AsyncIterator[Partial[GameElementUpdate]],
+) -> Optional[GameElementUpdate]:
+    """
+    first_whole_plan, for a plan streamed by an asyncio client
+    """
+    last = None
+    try:
+        async for partial in partials:
+            if "response_plan" in partial.complete:
+                return partial.value
+            last = partial.value
+    except ValueError as e:
+        logger.warning(f"could not read the streamed plan: {e}")
+        return None
+    return valid_plan(last)
+
+
+async def apply_streamed_events_async(
+    partials: AsyncIterator[Partial[GameElementUpdate]],
+    planned: GameElementUpdate,
+    time_node: TimeNode,
+) -> GameElementUpdate:
+    """
+    apply_streamed_events, for a plan streamed by an asyncio client
+    """
+    events = StreamedEvents(planned, time_node)
+    try:
+        async for partial in partials:
+            events.add(partial)
+    except ValueError as e:
+        return events.cut_short(e)
+    return events.update()
+
+
+async def wait_for_commit_async(scenario_id: str):
+    """
+    wait_for_commit, without blocking the event loop
+    """
+    with pending_commits_lock:
+        commit = pending_commits.get(scenario_id)
+    if commit is not None:
+        await asyncio.wait([asyncio.wrap_future(commit)])
@@ -1,6 +1,6 @@
 from textwrap import dedent
 from typing import Iterator, Optional
-from texty import database, seeds
+from texty import seeds
 from texty.game import AdvanceTimeProgress, Game, StatusUpdate, TextResponse
 from texty.gametypes import TimeNode
 from texty.io import RichInterface
@@ -8,8 +8,8 @@ from texty.io import RichInterface
 
 def run_scenario(scenario_id: str, seed: TimeNode = seeds.zantar) -> TimeNode:
 
-    database.init_db()
     game = Game(scenario_id=scenario_id)
+    game.storage.init()
     io = RichInterface()
 
     def print_game_response(
@@ -43,13 +43,42 @@ def run_scenario(scenario_id: str, seed: TimeNode = seeds.zantar) -> TimeNode:
                     io.write_output("Can't go back. No parent node found")
                 else:
                     io.write_output("Loaded " + game.node.id + ": " + game.node.summary)
+            elif action == "/redo":
+                if not game.redo():
+                    io.write_output("Can't go forward. Nothing to redo")
+                else:
+                    io.write_output("Loaded " + game.node.id + ": " + game.node.summary)
+            elif action == "/branches":
+                children = game.children()
+                if not children:
+                    io.write_output("No branches from here")
+                for child in children:
+                    io.write_output(
+                        f"{child.node_id} ({child.timestep}): {child.summary}"
+                    )
+            elif action.startswith("/jump "):
+                node_id = action.split(" ", 1)[1].strip()
+                if not game.jump(node_id):
+                    io.write_output("No node " + node_id + " in this game")
+                else:
+                    io.write_output("Loaded " + game.node.id + ": " + game.node.summary)
+            elif action.startswith("/search "):
+                results = game.storage.search(game.scenario_id, action.split(" ", 1)[1])
+                if not results:
+                    io.write_output("No matches")
+                for result in results:
+                    io.write_output(
+                        f"{result.node_id} ({result.timestep}) {result.label}: {result.snippet}"
+                    )
             elif action.startswith("/history"):
                 io.write_output("## Game history")
                 maxlen = 400
                 parts = action.split(" ")
                 if len(parts) > 1:
                     maxlen = int(parts[1])
-                for event_log in game.node.event_log:
+                for event_log in game.storage.get_event_log(
+                    game.node.id, game.scenario_id
+                ):
                     prefix = f"> {event_log.role}({event_log.type}): "
                     start = int(maxlen / 2 - 5)
                     end = int((-1 * maxlen / 2))
@@ -66,8 +95,12 @@ def run_scenario(scenario_id: str, seed: TimeNode = seeds.zantar) -> TimeNode:
                         Available commands:
                         - /quit: Exit the game
                         - /undo: Undo the last command
+                        - /redo: Go forward to the most recently played branch
+                        - /branches: List the branches continuing from here
+                        - /jump <node id>: Go to any point in the game
                         - /help: Show this help message
                         - /history: Show the game's history
+                        - /search <words>: Find where something happened. /jump to a result's node to go there
                         - <text>: Interact with the game by one timestep"""
                     ).strip()
                 )
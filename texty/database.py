@@ -2,159 +2,1951 @@
 ## data persistence (sqlite) ##
 ###############################
 
-from contextlib import contextmanager
+import asyncio
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
 import datetime
+from functools import lru_cache
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
 from queue import Queue
 import sqlite3 as sql
-from typing import List, Optional
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    TextIO,
+    TypeVar,
+    Union,
+)
+import uuid
+import zlib
 
-from texty.gametypes import TimeNode
+from pydantic import BaseModel, Field, TypeAdapter
+
+from texty.gametypes import GameElementUpdate, HistorySummary, LogItem, TimeNode
+from texty.settings import settings
 
 import threading
+import time
 from functools import wraps
 
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
 
 def init_db():
     """
-    Initialize the database
+    Initialize the database, bringing its schema up to date. With sharding, that's the catalog, shards are brought up to date as they're opened
     """
     with db_pool.connection() as conn:
-        conn.execute(
-            """CREATE TABLE IF NOT EXISTS time_nodes (
+        run_migrations(conn, CATALOG_MIGRATIONS if sharding != "none" else MIGRATIONS)
+
+
+#######################
+## node delta coding ##
+#######################
+
+# time_nodes.kind values. A checkpoint stores the full TimeNode json, a delta stores a NodeDelta against parent_id.
+# Neither stores the event log, which lives in log_items, ending at time_nodes.log_head
+CHECKPOINT = "checkpoint"
+DELTA = "delta"
+
+
+class NodeDelta(BaseModel):
+    """
+    The changes a time node makes on top of its parent node. Stored instead of the full node for all non-checkpoint nodes, so that a turn costs the size of what changed, rather than the size of the whole game
+    """
+
+    timestep: int
+    summary: str
+    response_plan: Optional[str] = None
+    update: Optional[GameElementUpdate] = Field(
+        default=None,
+        description="The update applied to the parent's game elements, if any",
+    )
+    history_summary: Optional[HistorySummary] = Field(
+        default=None,
+        description="The node's history summary, if it differs from the parent's",
+    )
+
+    def apply(self, node_id: str, parent: TimeNode) -> TimeNode:
+        """
+        Rebuild the node from its parent. The event log is left empty, it's loaded separately from log_items
+        """
+        node = parent.model_copy(
+            update={
+                "id": node_id,
+                "previous": parent.previous + [parent.id],
+                "timestep": self.timestep,
+                "summary": self.summary,
+                "response_plan": self.response_plan,
+                "event_log": [],
+                "game_elements": list(parent.game_elements),
+                "retired_game_elements": list(parent.retired_game_elements),
+            }
+        )
+        if self.update is not None:
+            node.apply_update(self.update.model_copy(deep=True))
+        if self.history_summary is not None:
+            node.history_summary = self.history_summary
+        return node
+
+
+def diff_node(time_node: TimeNode, parent: TimeNode) -> Optional[NodeDelta]:
+    """
+    Compute the delta from parent to time_node. Returns None if the node can't be reproduced from its parent by a delta
+    """
+    if time_node.previous != parent.previous + [parent.id]:
+        return None
+    delta = NodeDelta(
+        timestep=time_node.timestep,
+        summary=time_node.summary,
+        response_plan=time_node.response_plan,
+        update=(
+            time_node.last_update
+            if time_node.last_update != parent.last_update
+            else None
+        ),
+        history_summary=(
+            time_node.history_summary
+            if time_node.history_summary != parent.history_summary
+            else None
+        ),
+    )
+    # the delta is only as good as the replay. Verify it, and fall back to a checkpoint if it diverges
+    try:
+        rebuilt = delta.apply(time_node.id, parent)
+    except Exception:
+        logger.warning("could not replay delta for %s", time_node.id, exc_info=True)
+        return None
+    if rebuilt.model_dump(exclude={"event_log"}) != time_node.model_dump(
+        exclude={"event_log"}
+    ):
+        logger.warning("delta for %s does not reproduce the node", time_node.id)
+        return None
+    return delta
+
+
+def encode_node(time_node: TimeNode, parent: Optional[TimeNode]) -> tuple[str, str]:
+    """
+    Encode a time node for storage. Returns the (kind, data) to store. Nodes are stored as a delta against their parent, with a full checkpoint every `settings.node_checkpoint_interval` nodes, or whenever there is no stored parent to apply the delta to
+    """
+    if _stores_delta(time_node, parent):
+        delta = diff_node(time_node, parent)
+        if delta is not None:
+            return DELTA, delta.model_dump_json()
+    return CHECKPOINT, time_node.model_dump_json(exclude={"event_log"})
+
+
+def _stores_delta(time_node: TimeNode, parent: Optional[TimeNode]) -> bool:
+    return (
+        settings.node_storage == "delta"
+        and parent is not None
+        and len(time_node.previous) % settings.node_checkpoint_interval != 0
+    )
+
+
+def decode_node(rows: List[tuple[str, str, str]]) -> TimeNode:
+    """
+    Rebuild a time node from its (id, kind, data) chain, ordered from the nearest checkpoint to the node itself. The event log is not included
+    """
+    node: Optional[TimeNode] = None
+    for id, kind, data in rows:
+        node = decode_row(id, kind, data, node)
+    return node
+
+
+def decode_row(
+    id: str, kind: str, data: Union[str, bytes], parent: Optional[TimeNode]
+) -> TimeNode:
+    """
+    Decode a single stored node on top of its (already decoded) parent
+    """
+    if kind == DELTA:
+        if parent is None:
+            raise ValueError(f"Time node {id} has no checkpoint to apply to")
+        return NodeDelta.model_validate_json(data).apply(id, parent)
+    return TimeNode.model_validate_json(data)
+
+
+def _load_node(conn: sql.Connection, id: str) -> Optional[TimeNode]:
+    node = node_cache.get(id)
+    if node is None:
+        node = _read_node(conn, id)
+        if node is not None:
+            node_cache.put(node)
+    return node
+
+
+def _read_node(conn: sql.Connection, id: str) -> Optional[TimeNode]:
+    rows = conn.execute(
+        """WITH RECURSIVE chain(id, parent_id, kind, data, log_head, n) AS (
+    SELECT id, parent_id, kind, data, log_head, 0 FROM time_nodes WHERE id = ?
+    UNION ALL
+    SELECT tn.id, tn.parent_id, tn.kind, tn.data, tn.log_head, chain.n + 1
+    FROM time_nodes AS tn INNER JOIN chain ON tn.id = chain.parent_id
+    WHERE chain.kind = 'delta'
+)
+SELECT id, kind, data, log_head FROM chain ORDER BY n DESC""",
+        (id,),
+    ).fetchall()
+    if not rows:
+        return None
+    node = decode_node(
+        [(id, kind, decompress_node_data(conn, data)) for id, kind, data, _ in rows]
+    )
+    node.event_log = _load_event_log(conn, rows[-1][3])
+    return node
+
+
+##########################
+## node data compression ##
+##########################
+# Node json is very repetitive: the same field names, element ids and premise appear in every row.
+# Compressed data is stored as a BLOB starting with a codec tag, uncompressed data as TEXT, so rows
+# written with any node_compression setting stay readable
+
+ZLIB = b"z"
+ZLIB_DICT = b"d"
+SEEDS_DIR = os.path.join(os.path.dirname(__file__), "seeds")
+# zlib only looks back 32KB, so that's all of a dictionary that can be used
+MAX_DICTIONARY_SIZE = 32 * 1024
+DICTIONARY_DIGEST_SIZE = 8
+
+# compression dictionaries by digest. They're content addressed, so safe to share between databases
+_dictionaries: Dict[bytes, bytes] = {}
+
+
+@lru_cache(maxsize=None)
+def seed_dictionary() -> bytes:
+    """
+    A compression dictionary made from the shipped seeds, encoded the way nodes are stored
+    """
+    samples = []
+    for name in sorted(os.listdir(SEEDS_DIR)):
+        with open(os.path.join(SEEDS_DIR, name)) as f:
+            seed = json.load(f)
+        node = TimeNode(
+            id=str(uuid.UUID(int=0)),
+            premise=seed["premise"],
+            game_elements=seed["game_elements"],
+        )
+        samples.append(node.model_dump_json(exclude={"event_log"}))
+    return "".join(samples).encode()[-MAX_DICTIONARY_SIZE:]
+
+
+def compress_node_data(conn: sql.Connection, data: str) -> Union[str, bytes]:
+    """
+    Compress node json according to `settings.node_compression`
+    """
+    if settings.node_compression == "none":
+        return data
+    if settings.node_compression == "zlib":
+        return ZLIB + zlib.compress(data.encode())
+    dictionary = seed_dictionary()
+    digest = hashlib.sha256(dictionary).digest()[:DICTIONARY_DIGEST_SIZE]
+    conn.execute(
+        "INSERT OR IGNORE INTO compression_dicts (digest, data) VALUES (?, ?)",
+        (digest, dictionary),
+    )
+    _dictionaries[digest] = dictionary
+    compressor = zlib.compressobj(zdict=dictionary)
+    return ZLIB_DICT + digest + compressor.compress(data.encode()) + compressor.flush()
+
+
+def decompress_node_data(conn: sql.Connection, data: Union[str, bytes]) -> str:
+    if isinstance(data, str):
+        return data
+    codec = data[:1]
+    if codec == ZLIB:
+        return zlib.decompress(data[1:]).decode()
+    if codec == ZLIB_DICT:
+        digest = data[1 : 1 + DICTIONARY_DIGEST_SIZE]
+        if digest not in _dictionaries:
+            row = conn.execute(
+                "SELECT data FROM compression_dicts WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Unknown compression dictionary {digest.hex()}")
+            _dictionaries[digest] = row[0]
+        decompressor = zlib.decompressobj(zdict=_dictionaries[digest])
+        return (
+            decompressor.decompress(data[1 + DICTIONARY_DIGEST_SIZE :])
+            + decompressor.flush()
+        ).decode()
+    raise ValueError(f"Unknown node data codec {codec!r}")
+
+
+###########################
+## append-only event log ##
+###########################
+
+
+def _load_event_log(conn: sql.Connection, log_head: Optional[int]) -> List[LogItem]:
+    """
+    Walk the log_items chain back from log_head, returning the log in chronological order
+    """
+    return _log_items_since(conn, log_head, None)
+
+
+def _log_items_since(
+    conn: sql.Connection, log_head: Optional[int], since: Optional[int]
+) -> List[LogItem]:
+    """
+    The items of the log chain ending at log_head that come after the item `since`, or the whole log if `since` isn't on the chain
+    """
+    if log_head is None:
+        return []
+    rows = conn.execute(
+        """WITH RECURSIVE chain(id, parent_id, role, type, text, timestep, source, n) AS (
+    SELECT id, parent_id, role, type, text, timestep, source, 0 FROM log_items WHERE id = ?
+    UNION ALL
+    SELECT li.id, li.parent_id, li.role, li.type, li.text, li.timestep, li.source, chain.n + 1
+    FROM log_items AS li INNER JOIN chain ON li.id = chain.parent_id
+    WHERE li.id IS NOT ?
+)
+SELECT role, type, text, timestep, source FROM chain WHERE id IS NOT ? ORDER BY n DESC""",
+        (log_head, since, since),
+    ).fetchall()
+    # one call into the compiled validator is much cheaper than a LogItem(...) per row
+    return LogItemList.validate_python(
+        [
+            {
+                "role": role,
+                "type": type,
+                "text": text,
+                "timestep": timestep,
+                "source": source,
+            }
+            for role, type, text, timestep, source in rows
+        ]
+    )
+
+
+def _append_event_log(
+    conn: sql.Connection, log_head: Optional[int], items: List[LogItem]
+) -> Optional[int]:
+    """
+    Append items to the log chain ending at log_head, returning the new head
+    """
+    for item in items:
+        log_head = conn.execute(
+            "INSERT INTO log_items (parent_id, role, type, text, timestep, source) VALUES (?, ?, ?, ?, ?, ?)",
+            (log_head, item.role, item.type, item.text, item.timestep, item.source),
+        ).lastrowid
+    return log_head
+
+
+def _extends_log(time_node: TimeNode, parent: TimeNode) -> bool:
+    # event logs are append only, so checking the last shared item is enough to know the child continues the parent's log
+    shared = len(parent.event_log)
+    return len(time_node.event_log) >= shared and (
+        shared == 0 or time_node.event_log[shared - 1] == parent.event_log[-1]
+    )
+
+
+def new_log_items(time_node: TimeNode, parent: Optional[TimeNode]) -> List[LogItem]:
+    """
+    The items a node adds to its parent's log, or its whole log if it doesn't continue its parent's
+    """
+    if parent is not None and _extends_log(time_node, parent):
+        return time_node.event_log[len(parent.event_log) :]
+    return time_node.event_log
+
+
+def _node_row(
+    conn: sql.Connection,
+    time_node: TimeNode,
+    parent: Optional[TimeNode],
+    parent_log_head: Optional[int],
+    compress: bool = True,
+) -> Dict[str, Any]:
+    """
+    Encode a time node and append its new log items, returning the time_nodes columns to store. `parent` is the stored parent node, or None if the parent isn't stored
+    """
+    kind, data = encode_node(time_node, parent)
+    if compress:
+        data = compress_node_data(conn, data)
+    if parent is not None and _extends_log(time_node, parent):
+        log_head = _append_event_log(
+            conn, parent_log_head, time_node.event_log[len(parent.event_log) :]
+        )
+    else:
+        log_head = _append_event_log(conn, None, time_node.event_log)
+    return {
+        "id": time_node.id,
+        "scenario_id": time_node.scenario_id(),
+        "summary": time_node.summary,
+        "parent_id": time_node.previous[-1] if time_node.previous else None,
+        "kind": kind,
+        "data": data,
+        "log_head": log_head,
+    }
+
+
+def _insert_row(conn: sql.Connection, table: str, row: Dict[str, Any]):
+    columns = ", ".join(row.keys())
+    placeholders = ", ".join("?" for _ in row)
+    conn.execute(
+        f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({placeholders})",
+        tuple(row.values()),
+    )
+
+
+#######################
+## schema migrations ##
+#######################
+
+LogItemList = TypeAdapter(List[LogItem])
+
+
+def run_migrations(
+    conn: sql.Connection,
+    migrations: Optional[List[Callable[[sql.Connection], None]]] = None,
+):
+    """
+    Apply any `migrations` (by default MIGRATIONS) newer than the database's schema version, each in its own transaction
+    """
+    migrations = MIGRATIONS if migrations is None else migrations
+    conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    conn.commit()
+    row = conn.execute("SELECT version FROM schema_version").fetchone()
+    version = row[0] if row else 0
+    for number, migration in enumerate(migrations[version:], start=version + 1):
+        logger.info("migrating database to version %d (%s)", number, migration.__name__)
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute("DELETE FROM schema_version")
+            conn.execute("INSERT INTO schema_version (version) VALUES (?)", (number,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def create_base_tables(conn: sql.Connection):
+    """
+    The original schema. Databases created before schema versioning start here, so every migration must tolerate the changes it makes being already applied
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS time_nodes (
     id TEXT PRIMARY KEY,
     scenario_id TEXT,
     summary TEXT,
     data TEXT)"""
-        )
-        conn.execute(
-            """CREATE TABLE IF NOT EXISTS active_node (
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS active_node (
     scenario_id TEXT PRIMARY KEY,
     node_id TEXT NOT NULL REFERENCES time_nodes(id),
     last_updated TEXT
 )"""
+    )
+
+
+def migrate_node_storage(conn: sql.Connection):
+    """
+    Bring time_nodes up to the current storage format. Rows written by older versions, either as full json or as deltas carrying their own log items, are re-encoded with their event logs moved to log_items
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS log_items (
+    id INTEGER PRIMARY KEY,
+    parent_id INTEGER REFERENCES log_items(id),
+    role TEXT,
+    type TEXT,
+    text TEXT,
+    timestep INTEGER
+)"""
+    )
+    # the log helpers used below, and by later migrations, write and read today's columns
+    add_log_item_sources(conn)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(time_nodes)")}
+    for column, type in [("parent_id", "TEXT"), ("kind", "TEXT")]:
+        if column not in columns:
+            conn.execute(f"ALTER TABLE time_nodes ADD COLUMN {column} {type}")
+    if "log_head" in columns:
+        return
+    conn.execute(
+        "ALTER TABLE time_nodes ADD COLUMN log_head INTEGER REFERENCES log_items(id)"
+    )
+
+    # every row is in a legacy format, with its event log inline. Migrate parents before their children,
+    # so that each node can be rebuilt on top of its parent, and share its parent's log items
+    edges = conn.execute(
+        "SELECT id, coalesce(parent_id, json_extract(data, '$.previous[#-1]')) FROM time_nodes"
+    ).fetchall()
+    parents = dict(edges)
+    children: Dict[Optional[str], List[str]] = {}
+    for id, parent_id in edges:
+        children.setdefault(parent_id, []).append(id)
+    queue = [id for id, parent_id in edges if parent_id not in parents]
+    migrated: Dict[str, TimeNode] = {}
+    for id in queue:
+        kind, data = conn.execute(
+            "SELECT kind, data FROM time_nodes WHERE id = ?", (id,)
+        ).fetchone()
+        parent_id = parents[id]
+        parent = migrated.get(parent_id)
+        if kind == DELTA:
+            if parent is None:
+                logger.warning("skipping time node %s with no parent", id)
+                continue
+            payload = json.loads(data)
+            time_node = NodeDelta.model_validate(payload).apply(id, parent)
+            time_node.event_log = parent.event_log + LogItemList.validate_python(
+                payload.get("events", [])
+            )
+        else:
+            time_node = TimeNode.model_validate_json(data)
+
+        parent_log_head = (
+            conn.execute(
+                "SELECT log_head FROM time_nodes WHERE id = ?", (parent_id,)
+            ).fetchone()[0]
+            if parent is not None
+            else None
         )
-        conn.commit()
+        # left uncompressed, later migrations read these rows with sqlite's json functions
+        _insert_row(
+            conn,
+            "time_nodes",
+            _node_row(conn, time_node, parent, parent_log_head, compress=False),
+        )
+
+        # only hold on to nodes whose children are still to be migrated
+        if id in children:
+            migrated[id] = time_node
+            queue.extend(children[id])
+        if parent_id in migrated and id == children[parent_id][-1]:
+            del migrated[parent_id]
+    if edges:
+        logger.info("migrated %d time nodes to log_items storage", len(edges))
+
+
+def backfill_scenario_ids(conn: sql.Connection):
+    """
+    Older versions never wrote time_nodes.scenario_id. Checkpoints know theirs from `previous`, deltas inherit it from their parent
+    """
+    conn.execute(
+        "UPDATE time_nodes SET scenario_id = coalesce(json_extract(data, '$.previous[0]'), id) WHERE scenario_id IS NULL AND kind IS NOT 'delta'"
+    )
+    # each pass reaches one node further down the delta chains
+    while (
+        conn.execute(
+            """UPDATE time_nodes SET scenario_id = (
+    SELECT parent.scenario_id FROM time_nodes AS parent WHERE parent.id = time_nodes.parent_id
+)
+WHERE scenario_id IS NULL AND kind = 'delta' AND parent_id IN (SELECT id FROM time_nodes WHERE scenario_id IS NOT NULL)"""
+        ).rowcount
+        > 0
+    ):
+        pass
+
+
+def add_lookup_indexes(conn: sql.Connection):
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS time_nodes_scenario_id ON time_nodes(scenario_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS active_node_last_updated ON active_node(last_updated)"
+    )
+
+
+def add_listing_columns(conn: sql.Connection):
+    """
+    Keep what the game list shows in real columns, so listing games doesn't have to rebuild any nodes
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(time_nodes)")}
+    if "timestep" not in columns:
+        conn.execute("ALTER TABLE time_nodes ADD COLUMN timestep INTEGER")
+        conn.execute("ALTER TABLE time_nodes ADD COLUMN updated_at TEXT")
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(active_node)")}
+    if "timestep" not in columns:
+        conn.execute("ALTER TABLE active_node ADD COLUMN timestep INTEGER")
+        conn.execute("ALTER TABLE active_node ADD COLUMN summary TEXT")
+    # checkpoints and deltas both store the node's timestep
+    conn.execute(
+        "UPDATE time_nodes SET timestep = json_extract(data, '$.timestep') WHERE timestep IS NULL"
+    )
+    conn.execute(
+        """UPDATE time_nodes SET updated_at = (
+    SELECT last_updated FROM active_node WHERE active_node.node_id = time_nodes.id
+) WHERE updated_at IS NULL"""
+    )
+    conn.execute(
+        """UPDATE active_node SET
+    timestep = (SELECT timestep FROM time_nodes WHERE id = active_node.node_id),
+    summary = (SELECT summary FROM time_nodes WHERE id = active_node.node_id)"""
+    )
+    # ordered the same way as list_games pages through it
+    conn.execute("DROP INDEX IF EXISTS active_node_last_updated")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS active_node_last_updated ON active_node(last_updated, scenario_id)"
+    )
+
+
+def add_compression_dicts(conn: sql.Connection):
+    """
+    Compression dictionaries, kept in the database so rows stay readable if the shipped seeds change.
+    Note: node data may be compressed from here on, so later migrations can't use json functions on it
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS compression_dicts (
+    digest BLOB PRIMARY KEY,
+    data BLOB NOT NULL
+) WITHOUT ROWID"""
+    )
+
+
+def add_parent_indexes(conn: sql.Connection):
+    """
+    Index the parent links of nodes and log items, and which nodes point at a log item, so that branches can be walked and pruned without scanning
+    """
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS time_nodes_parent_id ON time_nodes(parent_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS time_nodes_log_head ON time_nodes(log_head)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS log_items_parent_id ON log_items(parent_id)"
+    )
+
+
+def add_search_index(conn: sql.Connection):
+    """
+    Full text search over event logs and game element descriptions. search_entries holds each piece of text with the node that introduced it, search_index is its fts5 index, kept in sync by triggers
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS search_entries (
+    id INTEGER PRIMARY KEY,
+    scenario_id TEXT NOT NULL,
+    node_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    label TEXT,
+    timestep INTEGER,
+    text TEXT NOT NULL
+)"""
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS search_entries_scenario_id ON search_entries(scenario_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS search_entries_node_id ON search_entries(node_id)"
+    )
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(text, content='search_entries', content_rowid='id')"
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS search_entries_insert AFTER INSERT ON search_entries BEGIN
+    INSERT INTO search_index (rowid, text) VALUES (new.id, new.text);
+END"""
+    )
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS search_entries_delete AFTER DELETE ON search_entries BEGIN
+    INSERT INTO search_index (search_index, rowid, text) VALUES ('delete', old.id, old.text);
+END"""
+    )
+    if conn.execute("SELECT 1 FROM search_entries LIMIT 1").fetchone():
+        return
+
+    # index the existing nodes, parents before children so each node can be compared to its parent
+    rows = {
+        row[0]: row
+        for row in conn.execute(
+            "SELECT id, parent_id, kind, data, log_head FROM time_nodes"
+        )
+    }
+    children: Dict[Optional[str], List[str]] = {}
+    for id, parent_id, _, _, _ in rows.values():
+        children.setdefault(parent_id, []).append(id)
+    queue = [id for id, row in rows.items() if row[1] not in rows]
+    indexed: Dict[str, TimeNode] = {}
+    for id in queue:
+        _, parent_id, kind, data, log_head = rows[id]
+        parent = indexed.get(parent_id)
+        try:
+            time_node = decode_row(id, kind, decompress_node_data(conn, data), parent)
+        except Exception:
+            logger.warning("not indexing unreadable time node %s", id, exc_info=True)
+            continue
+        parent_log_head = rows[parent_id][4] if parent_id in rows else None
+        _index_node(
+            conn, time_node, parent, _log_items_since(conn, log_head, parent_log_head)
+        )
+        if id in children:
+            indexed[id] = time_node
+            queue.extend(children[id])
+        if parent_id in indexed and id == children[parent_id][-1]:
+            del indexed[parent_id]
+    logger.info("indexed %d time nodes for search", len(rows))
+
+
+def add_log_item_sources(conn: sql.Connection):
+    """
+    Record what detected the intent of each player input, the LLM or the local classifier. Inputs logged before this have none
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(log_items)")}
+    if "source" not in columns:
+        conn.execute("ALTER TABLE log_items ADD COLUMN source TEXT")
+
+
+# ordered schema migrations. Append new ones to the end, never reorder or remove them
+MIGRATIONS: List[Callable[[sql.Connection], None]] = [
+    create_base_tables,
+    migrate_node_storage,
+    backfill_scenario_ids,
+    add_lookup_indexes,
+    add_listing_columns,
+    add_compression_dicts,
+    add_parent_indexes,
+    add_search_index,
+    add_log_item_sources,
+]
+
+
+def create_catalog_tables(conn: sql.Connection):
+    """
+    The catalog of a sharded database lists every game, in the same shape as a shard's active_node table, so list_games reads it the same way
+    """
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS active_node (
+    scenario_id TEXT PRIMARY KEY,
+    node_id TEXT,
+    last_updated TEXT,
+    timestep INTEGER,
+    summary TEXT
+)"""
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS active_node_last_updated ON active_node(last_updated, scenario_id)"
+    )
+
+
+# schema migrations of the catalog database, when sharded
+CATALOG_MIGRATIONS: List[Callable[[sql.Connection], None]] = [
+    create_catalog_tables,
+]
+
+
+################
+## node cache ##
+################
+
+
+def approximate_size(time_node: TimeNode) -> int:
+    """
+    Roughly the bytes of text a node holds, without paying for serializing it
+    """
+    return _own_size(time_node) + sum(size for _, size in _shared_parts(time_node))
+
+
+def _own_size(time_node: TimeNode) -> int:
+    # the node's text, and a pointer for each item of its lists
+    lists = (
+        time_node.event_log,
+        time_node.game_elements,
+        time_node.retired_game_elements,
+    )
+    return (
+        len(time_node.premise)
+        + len(time_node.summary)
+        + 8 * sum(len(items) for items in lists)
+    )
+
+
+def _shared_parts(time_node: TimeNode) -> Iterator[tuple[BaseModel, int]]:
+    # the parts of a node that its children share rather than copy (see TimeNode.child), with their sizes
+    for item in time_node.event_log:
+        yield item, len(item.text)
+    for el in time_node.game_elements + time_node.retired_game_elements:
+        yield el, len(el.name) + sum(
+            len(text) for text in el.past + el.present + el.future
+        )
+
+
+@dataclass
+class CacheStats:
+    entries: int
+    size_bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class NodeCache:
+    """
+    A size bounded LRU cache of time nodes by id, in front of the database. Cached nodes are shared between callers, so they must not be mutated (advance_time plays on a TimeNode.child). Elements and log items shared by cached nodes are only counted once, so a node costs about what its turn changed
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nodes: OrderedDict[str, tuple[TimeNode, int]] = OrderedDict()
+        self.size_bytes = 0
+        # the elements and log items of cached nodes by object id: the object, how many cached nodes hold it, and its size
+        self.parts: Dict[int, list] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, id: str) -> Optional[TimeNode]:
+        with self.lock:
+            entry = self.nodes.get(id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.nodes.move_to_end(id)
+            return entry[0]
+
+    def put(self, time_node: TimeNode):
+        size = approximate_size(time_node)
+        if size > self.max_bytes:
+            # too big to cache, and an older version mustn't be left in its place
+            self.invalidate(time_node.id)
+            return
+        with self.lock:
+            self._remove(time_node.id)
+            own = _own_size(time_node)
+            self.nodes[time_node.id] = (time_node, own)
+            self.size_bytes += own
+            for part, part_size in _shared_parts(time_node):
+                entry = self.parts.get(id(part))
+                if entry is None:
+                    self.parts[id(part)] = [part, 1, part_size]
+                    self.size_bytes += part_size
+                else:
+                    entry[1] += 1
+            while self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self.nodes)))
+                self.evictions += 1
+
+    def invalidate(self, id: str):
+        with self.lock:
+            self._remove(id)
+
+    def invalidate_scenario(self, scenario_id: str):
+        with self.lock:
+            for id in [
+                id
+                for id, (node, _) in self.nodes.items()
+                if node.scenario_id() == scenario_id
+            ]:
+                self._remove(id)
+
+    def clear(self):
+        with self.lock:
+            self.nodes.clear()
+            self.parts.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self.lock:
+            return CacheStats(
+                entries=len(self.nodes),
+                size_bytes=self.size_bytes,
+                max_bytes=self.max_bytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+            )
+
+    def _remove(self, node_id: str):
+        entry = self.nodes.pop(node_id, None)
+        if entry is None:
+            return
+        time_node, own = entry
+        self.size_bytes -= own
+        for part, _ in _shared_parts(time_node):
+            shared = self.parts.get(id(part))
+            if shared is None:
+                continue
+            shared[1] -= 1
+            if shared[1] == 0:
+                del self.parts[id(part)]
+                self.size_bytes -= shared[2]
+
+
+###########################
+## time node persistence ##
+###########################
 
 
 def get_active_node(scenario_id: str) -> Optional[TimeNode]:
     """
     Get the active node
     """
-    with db_pool.connection() as conn:
-        result = conn.execute(
-            "SELECT data FROM time_nodes WHERE id = (SELECT node_id FROM active_node WHERE scenario_id = ?)",
-            (scenario_id,),
-        ).fetchone()
+    with scenario_shard(scenario_id) as shard, shard.pool.connection() as conn:
+        return _get_active_node(conn, scenario_id)
+
+
+def _get_active_node(conn: sql.Connection, scenario_id: str) -> Optional[TimeNode]:
+    result = conn.execute(
+        "SELECT node_id FROM active_node WHERE scenario_id = ?",
+        (scenario_id,),
+    ).fetchone()
+    return _load_node(conn, result[0]) if result else None
+
+
+@dataclass
+class GameListing:
+    """
+    A row of the game list: a scenario and a summary of its active node
+    """
 
-    return TimeNode.model_validate_json(result[0]) if result else None
+    scenario_id: str
+    node_id: str
+    timestep: int
+    summary: str
+    last_updated: datetime.datetime
 
 
-def list_games() -> List[tuple[datetime.datetime, TimeNode]]:
+def list_games(
+    limit: int = 50, after: Optional[GameListing] = None
+) -> List[GameListing]:
+    """
+    List games, most recently played first. Pass the last listing of a page as `after` to get the next page. With sharding, games are listed from the catalog
+    """
     with db_pool.connection() as conn:
+        return _list_games(conn, limit, after)
+
+
+def _list_games(
+    conn: sql.Connection, limit: int, after: Optional[GameListing]
+) -> List[GameListing]:
+    if after is None:
         rows = conn.execute(
-            "SELECT an.last_updated, tn.data, tn.id, tn.scenario_id FROM active_node as an INNER JOIN time_nodes as tn ON tn.id = an.node_id ORDER BY an.last_updated DESC"
+            "SELECT scenario_id, node_id, timestep, summary, last_updated FROM active_node ORDER BY last_updated DESC, scenario_id DESC LIMIT ?",
+            (limit,),
         ).fetchall()
-        response = []
-        for row in rows:
-            data = row[1]
-            parsed = TimeNode.model_validate_json(data)
-            time = datetime.datetime.fromisoformat(row[0])
-            response.append((time, parsed))
-        return response
+    else:
+        rows = conn.execute(
+            "SELECT scenario_id, node_id, timestep, summary, last_updated FROM active_node WHERE (last_updated, scenario_id) < (?, ?) ORDER BY last_updated DESC, scenario_id DESC LIMIT ?",
+            (
+                after.last_updated.isoformat(timespec="seconds"),
+                after.scenario_id,
+                limit,
+            ),
+        ).fetchall()
+    return [
+        GameListing(
+            scenario_id=scenario_id,
+            node_id=node_id,
+            timestep=timestep or 0,
+            summary=summary or "",
+            last_updated=datetime.datetime.fromisoformat(last_updated),
+        )
+        for scenario_id, node_id, timestep, summary, last_updated in rows
+    ]
 
 
-def delete_game(scenario_id: str):
-    with db_pool.connection() as conn:
+def delete_game(scenario_id: str) -> "Future[None]":
+    def delete(conn: sql.Connection):
         conn.execute("DELETE FROM active_node WHERE scenario_id = ?", (scenario_id,))
+        # log chains are never shared between scenarios, so everything reachable from the scenario's nodes goes
+        conn.execute(
+            """WITH RECURSIVE items(id) AS (
+    SELECT log_head FROM time_nodes WHERE scenario_id = ? AND log_head IS NOT NULL
+    UNION
+    SELECT li.parent_id FROM log_items AS li INNER JOIN items ON li.id = items.id
+    WHERE li.parent_id IS NOT NULL
+)
+DELETE FROM log_items WHERE id IN items""",
+            (scenario_id,),
+        )
         conn.execute("DELETE FROM time_nodes WHERE scenario_id = ?", (scenario_id,))
-        conn.commit()
+        conn.execute("DELETE FROM search_entries WHERE scenario_id = ?", (scenario_id,))
 
+    with scenario_shard(scenario_id) as shard:
+        deleted = shard.writer.submit(delete)
+    # once committed, as reads until then still find the nodes, and would cache them again
+    deleted.add_done_callback(lambda _: node_cache.invalidate_scenario(scenario_id))
+    return _then_catalog(
+        deleted,
+        lambda _, conn: conn.execute(
+            "DELETE FROM active_node WHERE scenario_id = ?", (scenario_id,)
+        ),
+    )
 
-def get_node(id: str) -> Optional[TimeNode]:
+
+def get_node(id: str, scenario_id: Optional[str] = None) -> Optional[TimeNode]:
     """
-    Get a time node by id
+    Get a time node by id. The node's scenario_id is needed to find it when the database is sharded
     """
-    with db_pool.connection() as conn:
+    with _node_shard(scenario_id) as shard, shard.pool.connection() as conn:
+        return _load_node(conn, id)
+
+
+@dataclass
+class NodeListing:
+    """
+    A node of a game's branch tree, without its contents. Nodes link to their parent through time_nodes.parent_id, so a node's children are a lookup on that index
+    """
+
+    node_id: str
+    parent_id: str
+    timestep: int
+    summary: str
+    # unknown for nodes written before it was recorded
+    updated_at: Optional[datetime.datetime]
+
+
+def list_children(node_id: str, scenario_id: Optional[str] = None) -> List[NodeListing]:
+    """
+    List the nodes branching off of node_id, most recently written first. Pass the scenario id as node_id to list the game's first nodes
+    """
+    with _node_shard(scenario_id) as shard, shard.pool.connection() as conn:
+        return _list_children(conn, node_id)
+
+
+def _list_children(conn: sql.Connection, node_id: str) -> List[NodeListing]:
+    rows = conn.execute(
+        "SELECT id, parent_id, timestep, summary, updated_at FROM time_nodes WHERE parent_id = ? ORDER BY updated_at DESC, rowid DESC",
+        (node_id,),
+    ).fetchall()
+    return [
+        NodeListing(
+            node_id=id,
+            parent_id=parent_id,
+            timestep=timestep or 0,
+            summary=summary or "",
+            updated_at=(
+                datetime.datetime.fromisoformat(updated_at) if updated_at else None
+            ),
+        )
+        for id, parent_id, timestep, summary, updated_at in rows
+    ]
+
+
+def get_event_log(node_id: str, scenario_id: Optional[str] = None) -> List[LogItem]:
+    """
+    Get the history of a time node, by walking its log_items chain
+    """
+    with _node_shard(scenario_id) as shard, shard.pool.connection() as conn:
         result = conn.execute(
-            "SELECT data FROM time_nodes WHERE id = ?", (id,)
+            "SELECT log_head FROM time_nodes WHERE id = ?", (node_id,)
         ).fetchone()
-    return TimeNode.model_validate_json(result[0]) if result else None
+        return _load_event_log(conn, result[0]) if result else []
 
 
 def insert_time_node(
     time_node: TimeNode,
-    now: datetime.datetime = datetime.datetime.now(datetime.timezone.utc),
-):
+    now: Optional[datetime.datetime] = None,
+    parent: Optional[TimeNode] = None,
+) -> "Future[None]":
     """
-    Insert a time node into the database
+    Queue a time node to be inserted into the database. `parent` may be passed in if the caller already has the parent node loaded, to save rebuilding it for the delta encoding. Wait on the returned future if the node needs to be durable before continuing
     """
-    with db_pool.connection() as conn:
-
-        conn.execute(
-            "INSERT INTO time_nodes (id, summary, data) VALUES (?, ?, ?)",
-            (time_node.id, time_node.summary, time_node.model_dump_json()),
+    updated_at = _timestamp(now)
+    # cached up front, so the node reads back while its write is still queued
+    node_cache.put(time_node)
+    listing = (
+        time_node.scenario_id(),
+        time_node.id,
+        time_node.timestep,
+        time_node.summary,
+        updated_at,
+    )
+    with scenario_shard(time_node.scenario_id()) as shard:
+        future = _then_catalog(
+            shard.writer.submit(
+                lambda conn: _insert_time_node(conn, time_node, parent, updated_at)
+            ),
+            lambda _, conn: _update_catalog(conn, listing),
         )
+
+    def uncache_if_failed(future: Future):
+        if future.exception() is not None:
+            node_cache.invalidate(time_node.id)
+
+    future.add_done_callback(uncache_if_failed)
+    return future
+
+
+def _insert_time_node(
+    conn: sql.Connection,
+    time_node: TimeNode,
+    parent: Optional[TimeNode],
+    updated_at: str,
+):
+    parent_id = time_node.previous[-1] if time_node.previous else None
+    parent_row = (
         conn.execute(
-            "INSERT OR REPLACE INTO active_node (scenario_id, node_id, last_updated) VALUES (?, ?, ?)",
-            (time_node.scenario_id(), time_node.id, now.isoformat(timespec="seconds")),
-        )
-        conn.commit()
+            "SELECT log_head FROM time_nodes WHERE id = ?", (parent_id,)
+        ).fetchone()
+        if parent_id is not None
+        else None
+    )
+    if parent_row is None:
+        parent = None
+    elif parent is None or parent.id != parent_id:
+        parent = _load_node(conn, parent_id)
+    row = _node_row(conn, time_node, parent, parent_row[0] if parent_row else None)
+    row["timestep"] = time_node.timestep
+    row["updated_at"] = updated_at
+    _insert_row(conn, "time_nodes", row)
+    _index_node(conn, time_node, parent, new_log_items(time_node, parent))
+    _insert_row(
+        conn,
+        "active_node",
+        {
+            "scenario_id": time_node.scenario_id(),
+            "node_id": time_node.id,
+            "timestep": time_node.timestep,
+            "summary": time_node.summary,
+            "last_updated": updated_at,
+        },
+    )
 
 
 def set_active_node(
     scenario_id: str,
     node_id: str,
-    now: datetime.datetime = datetime.datetime.now(datetime.timezone.utc),
-):
+    now: Optional[datetime.datetime] = None,
+) -> "Future[None]":
     """
-    Set the active node
+    Queue setting the active node
     """
-    with db_pool.connection() as conn:
+    updated_at = _timestamp(now)
+
+    def set_active(conn: sql.Connection):
         conn.execute(
-            "INSERT OR REPLACE INTO active_node (scenario_id, node_id, last_updated) VALUES (?, ?, ?)",
-            (scenario_id, node_id, now.isoformat(timespec="seconds")),
+            "INSERT OR REPLACE INTO active_node (scenario_id, node_id, timestep, summary, last_updated) SELECT ?, id, timestep, summary, ? FROM time_nodes WHERE id = ?",
+            (scenario_id, updated_at, node_id),
+        )
+        return conn.execute(
+            "SELECT scenario_id, node_id, timestep, summary, last_updated FROM active_node WHERE scenario_id = ?",
+            (scenario_id,),
+        ).fetchone()
+
+    with scenario_shard(scenario_id) as shard:
+        return _then_catalog(
+            shard.writer.submit(set_active),
+            lambda listing, conn: listing and _update_catalog(conn, listing),
         )
-        conn.commit()
+
+
+def _timestamp(now: Optional[datetime.datetime] = None) -> str:
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return now.isoformat(timespec="seconds")
 
 
 def list_all_time_nodes(scenario_id: str) -> List[TimeNode]:
     """
     List all time nodes in the database
     """
-    with db_pool.connection() as conn:
+    with scenario_shard(scenario_id) as shard, shard.pool.connection() as conn:
+        rows = conn.execute(
+            "SELECT id, parent_id, kind, data, log_head FROM time_nodes WHERE scenario_id = ?",
+            (scenario_id,),
+        ).fetchall()
+        by_id = {row[0]: row for row in rows}
+        nodes: Dict[str, TimeNode] = {}
+
+        # rebuild each delta chain once, sharing the work between nodes of the same branch
+        for row in rows:
+            chain = []
+            id = row[0]
+            while id not in nodes and id in by_id:
+                chain.append(by_id[id])
+                if by_id[id][2] != DELTA:
+                    break
+                id = by_id[id][1]
+            if not chain:
+                continue
+            last = chain[-1]
+            if last[2] == DELTA:
+                base = nodes.get(last[1]) or _load_node(conn, last[1])
+                if base is None:
+                    raise ValueError(f"Time node {last[0]} has no checkpoint")
+            else:
+                base = None
+            for id, parent_id, kind, data, log_head in reversed(chain):
+                base = decode_row(id, kind, decompress_node_data(conn, data), base)
+                nodes[id] = base
+
+        response = []
+        for row in rows:
+            node = nodes[row[0]].model_copy()
+            node.event_log = _load_event_log(conn, row[4])
+            response.append(node)
+        return response
+
+
+def list_player_actions() -> List[tuple[str, str]]:
+    """
+    Every distinct player input in the event logs of all games whose intent the LLM detected, with that intent. Inputs
+    the local classifier settled, or logged before sources were recorded, are left out, so the classifier isn't trained
+    or evaluated on its own guesses
+    """
+    actions: Dict[tuple[str, str], None] = {}
+    for shard in all_shards():
+        with shard.pool.connection() as conn:
+            for text, type in conn.execute(
+                "SELECT DISTINCT text, type FROM log_items WHERE role = 'player' AND source = 'llm'"
+            ):
+                actions[(text, type)] = None
+    return list(actions)
+
+
+######################
+## full text search ##
+######################
+
+
+@dataclass
+class SearchResult:
+    """
+    A piece of game text matching a search, and the node where it first appeared
+    """
+
+    node_id: str
+    timestep: int
+    # "log" for event log items, "element" for game element descriptions
+    source: str
+    # the role of a log item, or the name of a game element
+    label: str
+    text: str
+    # the matching part of the text, with matches in [brackets]
+    snippet: str
+
+
+def search(scenario_id: str, query: str, limit: int = 20) -> List[SearchResult]:
+    """
+    Search a game's event log and game element descriptions, best matches first. Every word of the query must match; double quote words to search for a phrase. A query without any words matches nothing
+    """
+    if not search_terms(query):
+        # fts5 rejects an empty match expression
+        return []
+    with scenario_shard(scenario_id) as shard, shard.pool.connection() as conn:
+        rows = conn.execute(
+            """SELECT e.node_id, e.timestep, e.source, e.label, e.text,
+    snippet(search_index, 0, '[', ']', '...', 16)
+FROM search_index INNER JOIN search_entries AS e ON e.id = search_index.rowid
+WHERE search_index MATCH ? AND e.scenario_id = ?
+ORDER BY search_index.rank LIMIT ?""",
+            (_match_expression(query), scenario_id, limit),
+        ).fetchall()
+    return [
+        SearchResult(
+            node_id=node_id,
+            timestep=timestep,
+            source=source,
+            label=label,
+            text=text,
+            snippet=snippet,
+        )
+        for node_id, timestep, source, label, text, snippet in rows
+    ]
+
+
+def search_terms(query: str) -> List[str]:
+    """
+    The words and "quoted phrases" of a search query
+    """
+    phrases = re.findall(r'"([^"]*)"|(\S+)', query)
+    terms = [(phrase or word).replace('"', "") for phrase, word in phrases]
+    return [term for term in terms if term]
+
 
-        return [
-            TimeNode.model_validate_json(row[0])
-            for row in conn.execute(
-                "SELECT data FROM time_nodes WHERE scenario_id = ?", (scenario_id,)
+def _match_expression(query: str) -> str:
+    # quote every term, so that player text can't be misread as fts5 query syntax
+    return " ".join('"' + term + '"' for term in search_terms(query))
+
+
+def _index_node(
+    conn: sql.Connection,
+    time_node: TimeNode,
+    parent: Optional[TimeNode],
+    log_items: List[LogItem],
+):
+    """
+    Add the text a node introduces to the search index
+    """
+    scenario_id = time_node.scenario_id()
+    conn.execute("DELETE FROM search_entries WHERE node_id = ?", (time_node.id,))
+    conn.executemany(
+        "INSERT INTO search_entries (scenario_id, node_id, source, label, timestep, text) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (scenario_id, time_node.id, *entry)
+            for entry in new_search_text(time_node, parent, log_items)
+        ],
+    )
+
+
+def new_search_text(
+    time_node: TimeNode,
+    parent: Optional[TimeNode],
+    log_items: List[LogItem],
+) -> List[tuple[str, str, int, str]]:
+    """
+    The (source, label, timestep, text) a node adds to the search index: its new log items, and any game element descriptions its parent didn't have
+    """
+    entries = [("log", item.role, item.timestep, item.text) for item in log_items]
+    seen = (
+        {
+            (el.element_id, text)
+            for el in parent.game_elements + parent.retired_game_elements
+            for text in el.past + el.present + el.future
+        }
+        if parent is not None
+        else set()
+    )
+    for el in time_node.game_elements + time_node.retired_game_elements:
+        for text in el.past + el.present + el.future:
+            if (el.element_id, text) not in seen:
+                seen.add((el.element_id, text))
+                entries.append(("element", el.name, time_node.timestep, text))
+    return entries
+
+
+############################
+## scenario export/import ##
+############################
+
+EXPORT_FORMAT = "texty-scenario"
+EXPORT_VERSION = 1
+
+
+@dataclass
+class TransferStats:
+    nodes: int = 0
+    log_items: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    def __str__(self) -> str:
+        seconds = self.seconds or 1e-9
+        return (
+            f"{self.nodes} nodes, {self.log_items} log items, {self.bytes / 1e6:.1f} MB in {self.seconds:.2f}s "
+            f"({self.nodes / seconds:.0f} nodes/s, {self.bytes / 1e6 / seconds:.1f} MB/s)"
+        )
+
+
+def export_scenario(scenario_id: str, out: TextIO) -> TransferStats:
+    """
+    Write a scenario to `out` as NDJSON: a header line, then a line per time node with parents before their children. Each node line carries the node as stored (a checkpoint, or a delta against its parent) and the log items it added, so lines stay small however long the game is, and nodes are streamed from the database rather than held in memory
+    """
+    stats = TransferStats()
+    start = time.perf_counter()
+    with scenario_shard(scenario_id) as shard, shard.pool.connection() as conn:
+        active = conn.execute(
+            "SELECT node_id, last_updated FROM active_node WHERE scenario_id = ?",
+            (scenario_id,),
+        ).fetchone()
+        header = {
+            "format": EXPORT_FORMAT,
+            "version": EXPORT_VERSION,
+            "scenario_id": scenario_id,
+            "active_node_id": active[0] if active else None,
+            "last_updated": active[1] if active else None,
+        }
+        stats.bytes += out.write(json.dumps(header) + "\n")
+        # without an ORDER BY, sqlite walks the tree breadth first, so only the frontier is held at once
+        rows = conn.execute(
+            """WITH RECURSIVE tree(id, parent_id, kind, data, log_head, parent_log_head, timestep, summary, updated_at) AS (
+    SELECT id, parent_id, kind, data, log_head, NULL, timestep, summary, updated_at
+    FROM time_nodes
+    WHERE scenario_id = ? AND (parent_id IS NULL OR parent_id NOT IN (SELECT id FROM time_nodes))
+    UNION ALL
+    SELECT tn.id, tn.parent_id, tn.kind, tn.data, tn.log_head, tree.log_head, tn.timestep, tn.summary, tn.updated_at
+    FROM time_nodes AS tn INNER JOIN tree ON tn.parent_id = tree.id
+)
+SELECT * FROM tree""",
+            (scenario_id,),
+        )
+        for (
+            id,
+            parent_id,
+            kind,
+            data,
+            log_head,
+            parent_log_head,
+            timestep,
+            summary,
+            updated_at,
+        ) in rows:
+            log = _log_items_since(conn, log_head, parent_log_head)
+            line = {
+                "id": id,
+                "parent_id": parent_id,
+                "kind": kind,
+                "timestep": timestep,
+                "summary": summary,
+                "updated_at": updated_at,
+                "node": json.loads(decompress_node_data(conn, data)),
+                # source is left out of a log item's dumps, which are for prompts
+                "log": [{**item.model_dump(), "source": item.source} for item in log],
+            }
+            stats.bytes += out.write(json.dumps(line) + "\n")
+            stats.nodes += 1
+            stats.log_items += len(log)
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def import_scenario(
+    lines: Iterable[str], overwrite: bool = False, batch_size: int = 100
+) -> TransferStats:
+    """
+    Load a scenario written by export_scenario. Nodes are re-encoded with this database's storage settings and written through the writer, `batch_size` nodes a transaction. Only the nodes that may still have children to come are held in memory, which relies on nodes coming breadth first, as export_scenario writes them.
+    Raises ValueError if the scenario already exists, unless `overwrite` is set, in which case it's replaced, or if the nodes are out of order
+    """
+    stats = TransferStats()
+    start = time.perf_counter()
+    lines = iter(lines)
+    header_line = next(lines, "")
+    stats.bytes += len(header_line)
+    header = json.loads(header_line) if header_line.strip() else {}
+    if header.get("format") != EXPORT_FORMAT:
+        raise ValueError("Not a texty scenario export")
+    if header["version"] > EXPORT_VERSION:
+        raise ValueError(f"Unsupported scenario export version {header['version']}")
+    scenario_id = header["scenario_id"]
+    if get_active_node(scenario_id) is not None:
+        if not overwrite:
+            raise ValueError(f"Scenario {scenario_id} already exists")
+        delete_game(scenario_id).result()
+
+    # pinned for the whole import, so the shard isn't closed under its writes
+    with scenario_shard(scenario_id) as shard:
+        writer = shard.writer
+        # the nodes that children may still be applied to. Lines come breadth first, so nodes two levels
+        # above the current one can't have any children left
+        nodes: Dict[str, tuple[TimeNode, int]] = {}
+        # the depth of the last node, which breadth first never goes back up from
+        deepest = 0
+        batch: List[
+            tuple[TimeNode, Optional[TimeNode], str, str, List[LogItem], str]
+        ] = []
+        pending: Optional[Future] = None
+        for line in lines:
+            stats.bytes += len(line)
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            parent, depth = nodes.get(entry["parent_id"], (None, -1))
+            if entry["kind"] == DELTA and parent is None:
+                raise ValueError(
+                    f"Time node {entry['id']} comes before its parent, or too long after it: nodes must be breadth first, as export_scenario writes them"
+                )
+            if depth + 1 < deepest:
+                raise ValueError(
+                    f"Time node {entry['id']} is out of order: nodes must be breadth first, as export_scenario writes them"
+                )
+            deepest = depth + 1
+            if entry["kind"] == DELTA:
+                delta = NodeDelta.model_validate(entry["node"])
+                time_node = delta.apply(entry["id"], parent)
+            else:
+                time_node = TimeNode.model_validate(entry["node"])
+            log = LogItemList.validate_python(entry["log"])
+            if entry["kind"] == DELTA and _stores_delta(time_node, parent):
+                # it was just applied, so there's no need for encode_node to verify it again
+                kind, data = DELTA, delta.model_dump_json()
+            else:
+                kind, data = encode_node(time_node, parent)
+            batch.append((time_node, parent, kind, data, log, entry["updated_at"]))
+            nodes[time_node.id] = (time_node, depth + 1)
+            for id in [id for id, (_, d) in nodes.items() if d < depth]:
+                del nodes[id]
+            stats.nodes += 1
+            stats.log_items += len(log)
+            if len(batch) >= batch_size:
+                # keep one batch committing while the next is parsed
+                if pending is not None:
+                    pending.result()
+                pending = writer.submit(
+                    lambda conn, batch=batch: _import_nodes(conn, batch)
+                )
+                batch = []
+        if pending is not None:
+            pending.result()
+        writer.submit(lambda conn: _import_nodes(conn, batch)).result()
+
+    if header["active_node_id"] is not None:
+        last_updated = header["last_updated"]
+        set_active_node(
+            scenario_id,
+            header["active_node_id"],
+            now=datetime.datetime.fromisoformat(last_updated) if last_updated else None,
+        ).result()
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def _import_nodes(
+    conn: sql.Connection,
+    batch: List[tuple[TimeNode, Optional[TimeNode], str, str, List[LogItem], str]],
+):
+    for time_node, parent, kind, data, log, updated_at in batch:
+        parent_row = conn.execute(
+            "SELECT log_head FROM time_nodes WHERE id = ?", (time_node.previous[-1],)
+        ).fetchone()
+        log_head = _append_event_log(conn, parent_row[0] if parent_row else None, log)
+        _insert_row(
+            conn,
+            "time_nodes",
+            {
+                "id": time_node.id,
+                "scenario_id": time_node.scenario_id(),
+                "summary": time_node.summary,
+                "parent_id": time_node.previous[-1],
+                "kind": kind,
+                "data": compress_node_data(conn, data),
+                "log_head": log_head,
+                "timestep": time_node.timestep,
+                "updated_at": updated_at,
+            },
+        )
+        _index_node(conn, time_node, parent, log)
+
+
+###############################
+## branch garbage collection ##
+###############################
+
+
+@dataclass
+class CompactionResult:
+    nodes_deleted: int = 0
+    log_items_deleted: int = 0
+    pages_freed: int = 0
+    # false if the time budget ran out before all garbage was collected
+    complete: bool = True
+
+
+# the nodes that must survive compaction: every active node, and all of their ancestors
+LIVE_NODES_SQL = """WITH RECURSIVE live(id) AS (
+    SELECT node_id FROM active_node
+    UNION
+    SELECT tn.parent_id FROM time_nodes AS tn INNER JOIN live ON tn.id = live.id
+    WHERE tn.parent_id IS NOT NULL
+)
+SELECT id FROM live"""
+
+# nodes no active node can reach, other than the newest `?` abandoned branches of each game.
+# Leaves that aren't an active node are the tips of abandoned branches
+GARBAGE_NODES_SQL = """WITH RECURSIVE kept(id) AS (
+    SELECT node_id FROM active_node
+    UNION
+    SELECT id FROM (
+        SELECT tn.id, row_number() OVER (
+            PARTITION BY tn.scenario_id ORDER BY tn.updated_at DESC
+        ) AS n
+        FROM time_nodes AS tn
+        WHERE NOT EXISTS (SELECT 1 FROM time_nodes AS c WHERE c.parent_id = tn.id)
+        AND tn.id NOT IN (SELECT node_id FROM active_node)
+    ) WHERE n <= ?
+    UNION
+    SELECT tn.parent_id FROM time_nodes AS tn INNER JOIN kept ON tn.id = kept.id
+    WHERE tn.parent_id IS NOT NULL
+)
+SELECT id FROM time_nodes WHERE id NOT IN kept"""
+
+
+def compact(
+    keep_branches: int = 0,
+    batch_size: int = 200,
+    time_budget: Optional[float] = None,
+    vacuum_pages: int = 1000,
+) -> CompactionResult:
+    """
+    Delete the time nodes (and their log items) that no active node can reach, e.g. the branches left behind by an undo followed by a new action. The `keep_branches` most recently written abandoned branches of each game are kept, so they can still be jumped back to.
+    Deletes go through the writer in batches of `batch_size`, so games keep saving while compaction runs, and the freed pages are returned to the OS `vacuum_pages` at a time with an incremental vacuum. Stops early (with complete=False) once `time_budget` seconds have passed
+    """
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    result = CompactionResult()
+    for shard in all_shards():
+        _compact_shard(shard, result, keep_branches, batch_size, deadline, vacuum_pages)
+        if not result.complete:
+            break
+    return result
+
+
+def _compact_shard(
+    shard: "Shard",
+    result: CompactionResult,
+    keep_branches: int,
+    batch_size: int,
+    deadline: Optional[float],
+    vacuum_pages: int,
+):
+    with shard.pool.connection() as conn:
+        garbage = [row[0] for row in conn.execute(GARBAGE_NODES_SQL, (keep_branches,))]
+
+    for start in range(0, len(garbage), batch_size):
+        if deadline is not None and time.monotonic() > deadline:
+            result.complete = False
+            return
+        batch = garbage[start : start + batch_size]
+        nodes, log_items = shard.writer.submit(
+            lambda conn: _delete_nodes(conn, batch)
+        ).result()
+        result.nodes_deleted += nodes
+        result.log_items_deleted += log_items
+        for id in batch:
+            node_cache.invalidate(id)
+
+    with shard.pool.connection() as conn:
+        (auto_vacuum,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+    if auto_vacuum != 2:
+        logger.info(
+            "%s isn't in incremental auto_vacuum mode, run `python -m texty compact --vacuum` to switch it",
+            shard.database,
+        )
+        return
+    while deadline is None or time.monotonic() < deadline:
+        freed = shard.writer.submit(
+            lambda conn: _incremental_vacuum(conn, vacuum_pages)
+        ).result()
+        result.pages_freed += freed
+        if freed < vacuum_pages:
+            return
+    result.complete = False
+
+
+def vacuum():
+    """
+    Rebuild the whole database file (every shard, when sharded), switching it to incremental auto_vacuum if it isn't already. Blocks writes for the duration, so it's meant for maintenance windows
+    """
+    for shard in all_shards():
+        shard.writer.flush()
+        with shard.pool.connection() as conn:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+
+
+def _delete_nodes(conn: sql.Connection, ids: List[str]) -> tuple[int, int]:
+    """
+    Delete the given nodes, unless they've become reachable since they were picked, followed by any log items left with neither a child item nor a node pointing at them
+    """
+    placeholders = ",".join("?" * len(ids))
+    heads = [
+        row[0]
+        for row in conn.execute(
+            f"SELECT log_head FROM time_nodes WHERE id IN ({placeholders}) AND log_head IS NOT NULL",
+            ids,
+        )
+    ]
+    nodes = conn.execute(
+        f"DELETE FROM time_nodes WHERE id IN ({placeholders}) AND id NOT IN ({LIVE_NODES_SQL})",
+        ids,
+    ).rowcount
+    conn.execute(
+        f"DELETE FROM search_entries WHERE node_id IN ({placeholders}) AND node_id NOT IN (SELECT id FROM time_nodes)",
+        ids,
+    )
+
+    # prune the log tree from the deleted heads towards the root, stopping at items still in use
+    log_items = 0
+    frontier = set(heads)
+    while frontier:
+        parents = set()
+        for id in frontier:
+            row = conn.execute(
+                """SELECT parent_id FROM log_items AS li WHERE id = ?
+AND NOT EXISTS (SELECT 1 FROM log_items WHERE parent_id = li.id)
+AND NOT EXISTS (SELECT 1 FROM time_nodes WHERE log_head = li.id)""",
+                (id,),
+            ).fetchone()
+            if row is None:
+                continue
+            conn.execute("DELETE FROM log_items WHERE id = ?", (id,))
+            log_items += 1
+            if row[0] is not None:
+                parents.add(row[0])
+        frontier = parents
+    return nodes, log_items
+
+
+def _incremental_vacuum(conn: sql.Connection, pages: int) -> int:
+    (free,) = conn.execute("PRAGMA freelist_count").fetchone()
+    pages = min(pages, free)
+    # the sqlite3 module only steps a pragma once, and incremental_vacuum frees a page per step
+    for _ in range(pages):
+        conn.execute("PRAGMA incremental_vacuum(1)")
+    return pages
+
+
+class BackgroundCompactor:
+    """
+    Runs compact every `interval` seconds on a daemon thread, within `time_budget` seconds a run
+    """
+
+    def __init__(self, interval: float, time_budget: float, keep_branches: int):
+        self.interval = interval
+        self.time_budget = time_budget
+        self.keep_branches = keep_branches
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name="texty-db-compactor", daemon=True
             )
-        ]
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                result = compact(
+                    keep_branches=self.keep_branches, time_budget=self.time_budget
+                )
+                logger.info("compacted database: %s", result)
+            except Exception:
+                logger.exception("database compaction failed")
+
+
+def start_background_compaction() -> Optional[BackgroundCompactor]:
+    """
+    Start compacting the database in the background, as configured by settings.db_compaction_*
+    """
+    if settings.db_compaction_interval <= 0:
+        return None
+    compactor = BackgroundCompactor(
+        interval=settings.db_compaction_interval,
+        time_budget=settings.db_compaction_time_budget,
+        keep_branches=settings.db_keep_branches,
+    )
+    compactor.start()
+    return compactor
+
+
+#####################
+## async interface ##
+#####################
+# For asyncio game loops. Reads run on a dedicated executor, each of its threads with its own connection,
+# so they never compete with the blocking API for pool connections. Writes go through the same writer as
+# the blocking API, and complete once they are committed
+
+
+async def _run_async(
+    shard_context: ContextManager["Shard"], read: Callable[..., T], *args
+) -> T:
+    # the shard stays pinned until the read is done
+    with shard_context as shard:
+
+        def run():
+            with shard.async_pool.connection() as conn:
+                return read(conn, *args)
+
+        return await asyncio.get_running_loop().run_in_executor(async_executor, run)
+
+
+async def get_active_node_async(scenario_id: str) -> Optional[TimeNode]:
+    return await _run_async(scenario_shard(scenario_id), _get_active_node, scenario_id)
+
+
+async def get_node_async(
+    id: str, scenario_id: Optional[str] = None
+) -> Optional[TimeNode]:
+    return await _run_async(_node_shard(scenario_id), _load_node, id)
+
+
+async def list_children_async(
+    node_id: str, scenario_id: Optional[str] = None
+) -> List[NodeListing]:
+    return await _run_async(_node_shard(scenario_id), _list_children, node_id)
+
+
+async def list_games_async(
+    limit: int = 50, after: Optional[GameListing] = None
+) -> List[GameListing]:
+    return await _run_async(nullcontext(main_shard), _list_games, limit, after)
+
+
+async def insert_time_node_async(
+    time_node: TimeNode,
+    now: Optional[datetime.datetime] = None,
+    parent: Optional[TimeNode] = None,
+):
+    await asyncio.wrap_future(insert_time_node(time_node, now=now, parent=parent))
+
+
+async def set_active_node_async(
+    scenario_id: str,
+    node_id: str,
+    now: Optional[datetime.datetime] = None,
+):
+    await asyncio.wrap_future(set_active_node(scenario_id, node_id, now=now))
+
+
+def connect(database: str) -> sql.Connection:
+    """
+    Open a connection with texty's pragmas. WAL lets readers carry on while the writer commits,
+    and with WAL, synchronous=NORMAL only risks the last commits on power loss, never corruption
+    """
+    conn = sql.connect(database, check_same_thread=False)
+    # only takes effect for new databases, existing ones need a VACUUM to switch (see compact)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-16000")
+    return conn
+
+
+class PoolTimeout(TimeoutError):
+    pass
+
+
+class PoolClosed(RuntimeError):
+    pass
+
+
+@dataclass
+class PoolStats:
+    """
+    A snapshot of a connection pool's counters
+    """
+
+    max_connections: int
+    # connections currently open, including per-thread connections
+    open: int
+    in_use: int
+    idle: int
+    peak_in_use: int
+    checkouts: int
+    # checkouts that found no idle connection and had to wait for one
+    waits: int
+    timeouts: int
+    # connections that failed their checkout health check and were reopened
+    replaced: int
+    total_wait_seconds: float
+    max_wait_seconds: float
 
 
 class SQLiteConnectionPool:
-    def __init__(self, database, max_connections=5):
+    """
+    A bounded pool of sqlite connections. Checkouts wait at most `timeout` seconds for a connection, and connections are health checked before being handed out. With `per_thread`, each thread instead keeps one connection of its own for its lifetime
+    """
+
+    def __init__(
+        self,
+        database,
+        max_connections=5,
+        timeout: Optional[float] = 10.0,
+        per_thread: bool = False,
+    ):
         self.database = database
         self.max_connections = max_connections
-        self.connections = Queue(maxsize=max_connections)
+        self.timeout = timeout
+        self.per_thread = per_thread
+        self.idle: List[sql.Connection] = []
+        self.thread_connections: List[sql.Connection] = []
+        self.local = threading.local()
         self.connection_count = 0
-        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.closed = False
 
-    def get_connection(self):
-        if self.connections.qsize() > 0:
-            return self.connections.get()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.replaced = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
 
-        with self.lock:
-            if self.connection_count < self.max_connections:
-                self.connection_count += 1
-                return sql.connect(self.database, check_same_thread=False)
+    def get_connection(self, timeout: Optional[float] = None) -> sql.Connection:
+        """
+        Check out a connection, waiting up to `timeout` (default: the pool's timeout) seconds for one to be free. Raises PoolTimeout if none is, and PoolClosed once the pool is closed
+        """
+        if self.closed:
+            raise PoolClosed(f"The connection pool for {self.database} is closed")
+        if self.per_thread:
+            return self._get_thread_connection()
 
-        return self.connections.get()
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        waited = False
+        conn = None
+        with self.condition:
+            while True:
+                if self.idle:
+                    conn = self.idle.pop()
+                    break
+                if self.connection_count < self.max_connections:
+                    # reserve the slot, and connect outside of the lock
+                    self.connection_count += 1
+                    break
+                remaining = (
+                    None if timeout is None else start + timeout - time.monotonic()
+                )
+                if remaining is not None and remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f"Timed out after {timeout}s waiting for a connection to {self.database}"
+                    )
+                waited = True
+                self.condition.wait(remaining)
+            self._record_checkout(time.monotonic() - start if waited else None)
 
-    def return_connection(self, connection):
-        if self.connections.qsize() < self.max_connections:
-            self.connections.put(connection)
-        else:
-            connection.close()
+        try:
+            if conn is None:
+                return connect(self.database)
+            return self._checked(conn)
+        except BaseException:
+            with self.condition:
+                self.connection_count -= 1
+                self.in_use -= 1
+                self.condition.notify()
+            raise
+
+    def return_connection(self, connection: sql.Connection):
+        if self.per_thread:
+            # the connection stays with its thread
+            with self.condition:
+                self.in_use -= 1
+            return
+        try:
+            if connection.in_transaction:
+                # don't hand the next user someone else's half finished transaction
+                connection.rollback()
+        except sql.Error:
+            # unusable, let its slot be reconnected on the next checkout
+            with self.condition:
+                self.in_use -= 1
+                self.connection_count -= 1
+                self.replaced += 1
+                self.condition.notify()
+            return
+        with self.condition:
+            self.in_use -= 1
+            if not self.closed:
+                self.idle.append(connection)
+                self.condition.notify()
+                return
+            self.connection_count -= 1
+        # checked out when the pool was closed, and there's nothing to hand it back to
+        connection.close()
 
     @contextmanager
     def connection(self):
@@ -164,6 +1956,470 @@ class SQLiteConnectionPool:
         finally:
             self.return_connection(conn)
 
+    def stats(self) -> PoolStats:
+        with self.condition:
+            return PoolStats(
+                max_connections=self.max_connections,
+                open=self.connection_count + len(self.thread_connections),
+                in_use=self.in_use,
+                idle=len(self.idle),
+                peak_in_use=self.peak_in_use,
+                checkouts=self.checkouts,
+                waits=self.waits,
+                timeouts=self.timeouts,
+                replaced=self.replaced,
+                total_wait_seconds=self.total_wait_seconds,
+                max_wait_seconds=self.max_wait_seconds,
+            )
+
+    def close(self):
+        """
+        Close every idle and per-thread connection. Connections still checked out are closed as they're returned, and no more are handed out
+        """
+        with self.condition:
+            self.closed = True
+            connections = self.idle + self.thread_connections
+            self.connection_count -= len(self.idle)
+            self.idle = []
+            self.thread_connections = []
+            self.local = threading.local()
+        for conn in connections:
+            conn.close()
+
+    def _get_thread_connection(self) -> sql.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = connect(self.database)
+            self.local.conn = conn
+            with self.condition:
+                self.thread_connections.append(conn)
+        else:
+            checked = self._checked(conn)
+            if checked is not conn:
+                self.local.conn = checked
+                with self.condition:
+                    self.thread_connections.remove(conn)
+                    self.thread_connections.append(checked)
+                conn = checked
+        with self.condition:
+            self._record_checkout(None)
+        return conn
+
+    def _checked(self, conn: sql.Connection) -> sql.Connection:
+        """
+        Health check a connection, replacing it with a new one if it's broken
+        """
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return conn
+        except sql.Error:
+            logger.warning("replacing broken connection to %s", self.database)
+            try:
+                conn.close()
+            except sql.Error:
+                pass
+            with self.condition:
+                self.replaced += 1
+            return connect(self.database)
+
+    def _record_checkout(self, wait: Optional[float]):
+        # called with the condition held
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        if wait is not None:
+            self.waits += 1
+            self.total_wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+
+class DatabaseWriter:
+    """
+    Runs all database writes on a single thread. Writes queued while a commit is in flight are committed together in the next transaction, so concurrent games share commits rather than each paying for their own
+    """
+
+    def __init__(self, database: str, max_batch: int = 100):
+        self.database = database
+        self.max_batch = max_batch
+        self.jobs: Queue = Queue()
+        self.thread: Optional[threading.Thread] = None
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def submit(self, write: Callable[[sql.Connection], T]) -> "Future[T]":
+        """
+        Queue `write` to run in a transaction on the writer's connection. The returned future resolves once the transaction is committed. Raises RuntimeError once the writer is closed
+        """
+        future: Future[T] = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError(f"The writer for {self.database} is closed")
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self._run, name="texty-db-writer", daemon=True
+                )
+                self.thread.start()
+            self.jobs.put((write, future))
+        return future
+
+    def flush(self):
+        """
+        Wait for every write queued so far to be committed
+        """
+        self.submit(lambda conn: None).result()
+
+    def close(self):
+        """
+        Commit any queued writes and stop the writer thread. No more writes are taken after this
+        """
+        with self.lock:
+            self.closed = True
+            thread, self.thread = self.thread, None
+            if thread is None:
+                return
+            self.jobs.put(None)
+        thread.join()
+
+    def _run(self):
+        try:
+            conn = connect(self.database)
+        except Exception as e:
+            logger.exception("could not open %s for writing", self.database)
+            # fail what's queued, and let the next submit try again with a new thread
+            with self.lock:
+                self.thread = None
+                while not self.jobs.empty():
+                    job = self.jobs.get_nowait()
+                    if job is not None and job[1].set_running_or_notify_cancel():
+                        job[1].set_exception(e)
+            return
+        # autocommit mode, so that transactions are only the ones we start
+        conn.isolation_level = None
+        try:
+            running = True
+            while running:
+                batch = [self.jobs.get()]
+                while len(batch) < self.max_batch and not self.jobs.empty():
+                    batch.append(self.jobs.get_nowait())
+                if None in batch:
+                    running = False
+                    batch = [job for job in batch if job is not None]
+                if batch:
+                    self._commit_or_fail(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit_or_fail(
+        self, conn: sql.Connection, batch: List[tuple[Callable, Future]]
+    ):
+        """
+        Commit a batch, failing every write of it that isn't settled yet if the transaction itself fails, so that the writer carries on with the next
+        """
+        try:
+            self._commit(conn, batch)
+        except Exception as e:
+            logger.exception(
+                "failed to commit %d writes to %s", len(batch), self.database
+            )
+            if conn.in_transaction:
+                try:
+                    conn.execute("ROLLBACK")
+                except sql.Error:
+                    logger.exception("could not roll back writes to %s", self.database)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _commit(self, conn: sql.Connection, batch: List[tuple[Callable, Future]]):
+        results = []
+        conn.execute("BEGIN")
+        for write, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            # a savepoint per write, so that one failing write doesn't take the rest of the batch with it
+            conn.execute("SAVEPOINT write")
+            try:
+                results.append((future, write(conn), None))
+                conn.execute("RELEASE write")
+            except Exception as e:
+                # callers that don't wait on the future (e.g. a turn saved while the next is played) would never see it
+                logger.exception("write to %s failed", self.database)
+                conn.execute("ROLLBACK TO write")
+                conn.execute("RELEASE write")
+                results.append((future, None, e))
+        conn.execute("COMMIT")
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+##############
+## sharding ##
+##############
+# Unsharded, everything lives in one database file. Sharded, each game's nodes live in a shard file chosen by
+# its scenario id, so games in different shards commit in parallel (across processes too, as each file has its
+# own write lock). Shards sit in a directory next to catalog.db, which lists the games for list_games
+
+
+class Shard:
+    """
+    One database file, with its read pools and its writer
+    """
+
+    def __init__(self, database: str):
+        self.database = database
+        self.pool = SQLiteConnectionPool(
+            database,
+            max_connections=settings.db_pool_size,
+            timeout=settings.db_pool_timeout,
+        )
+        self.async_pool = SQLiteConnectionPool(database, per_thread=True)
+        self.writer = DatabaseWriter(database)
+        # the callers currently using the shard, which keep it from being closed
+        self.users = 0
+
+    def close(self):
+        self.writer.close()
+        self.pool.close()
+        self.async_pool.close()
+
+
+def shard_file(scenario_id: str) -> str:
+    """
+    The name of the shard file a scenario's nodes live in, for the current sharding mode
+    """
+    if sharding == "scenario":
+        if re.fullmatch(r"[A-Za-z0-9_-]{1,64}", scenario_id):
+            return f"scenario-{scenario_id}.db"
+        return f"scenario-{hashlib.sha1(scenario_id.encode()).hexdigest()}.db"
+    # a stable hash, unlike hash(), so every process agrees on where a game lives
+    digest = hashlib.sha1(scenario_id.encode()).digest()
+    return f"shard-{int.from_bytes(digest[:8], 'big') % shard_count:03d}.db"
+
+
+@contextmanager
+def scenario_shard(scenario_id: str) -> Iterator[Shard]:
+    """
+    The shard holding a scenario's nodes, kept open until the block exits. Shards are opened, and brought up to date, on first use
+    """
+    if sharding == "none":
+        yield main_shard
+        return
+    shard = _open_shard(os.path.join(shard_dir, shard_file(scenario_id)))
+    try:
+        yield shard
+    finally:
+        _release_shard(shard)
+
+
+def all_shards() -> Iterator[Shard]:
+    """
+    Every shard holding nodes, including ones not opened yet by this process. Shards that aren't already open are
+    opened one at a time and closed once the caller moves on, so a pass over every game doesn't push the games being
+    played out of the open shards
+    """
+    if sharding == "none":
+        yield main_shard
+        return
+    prefix = "scenario-" if sharding == "scenario" else "shard-"
+    for name in sorted(os.listdir(shard_dir)):
+        if not (name.startswith(prefix) and name.endswith(".db")):
+            continue
+        path = os.path.join(shard_dir, name)
+        with shards_lock:
+            shard = shards.get(path)
+            if shard is not None:
+                shard.users += 1
+        if shard is not None:
+            try:
+                yield shard
+            finally:
+                _release_shard(shard)
+            continue
+        shard = _migrated(Shard(path))
+        try:
+            yield shard
+        finally:
+            shard.close()
+
+
+def _node_shard(scenario_id: Optional[str]) -> ContextManager[Shard]:
+    if scenario_id is None:
+        if sharding != "none":
+            raise ValueError(
+                "a scenario_id is needed to find a node in a sharded database"
+            )
+        return nullcontext(main_shard)
+    return scenario_shard(scenario_id)
+
+
+def _open_shard(path: str) -> Shard:
+    """
+    The open shard for a file, opening it if needed, with one more user. Callers release it with _release_shard.
+    At most settings.db_open_shards stay open, each with a writer thread and its connections, and the least recently
+    used that nobody is using are closed to make room
+    """
+    while True:
+        with shards_lock:
+            closing = closing_shards.get(path)
+            if closing is None:
+                shard = shards.get(path)
+                if shard is None:
+                    shard = _migrated(Shard(path))
+                    shards[path] = shard
+                shards.move_to_end(path)
+                shard.users += 1
+                evicted = _evict_idle()
+                break
+        # a second writer for the file mustn't start before the closing one has committed its queue
+        closing.wait()
+    _close_evicted(evicted)
+    return shard
+
+
+def _release_shard(shard: Shard):
+    with shards_lock:
+        shard.users -= 1
+        evicted = _evict_idle()
+    _close_evicted(evicted)
+
+
+def _evict_idle() -> List[Shard]:
+    """
+    Take the least recently used shards nobody is using out of the open shards, until there are at most
+    settings.db_open_shards, or only ones in use are left. Called with shards_lock held
+    """
+    evicted = []
+    excess = len(shards) - max(settings.db_open_shards, 1)
+    for path, shard in list(shards.items()):
+        if excess <= 0:
+            break
+        if shard.users == 0:
+            del shards[path]
+            closing_shards[path] = threading.Event()
+            evicted.append(shard)
+            excess -= 1
+    return evicted
+
+
+def _close_evicted(evicted: List[Shard]):
+    # closing commits the evicted shards' queued writes, which needn't hold up other games
+    for shard in evicted:
+        shard.close()
+        with shards_lock:
+            closing_shards.pop(shard.database).set()
+
+
+def _migrated(shard: Shard) -> Shard:
+    """
+    Bring a shard's schema up to date, once per file per process
+    """
+    with migrated_lock:
+        if shard.database not in migrated:
+            with shard.pool.connection() as conn:
+                run_migrations(conn)
+            migrated.add(shard.database)
+    return shard
+
+
+def _then_catalog(
+    future: "Future[T]", write: Callable[[T, sql.Connection], Any]
+) -> "Future[None]":
+    """
+    Follow a shard write with `write(result, conn)` on the catalog, once the shard write commits. Without sharding there's no separate catalog, and the shard write's future is returned as is
+    """
+    if sharding == "none":
+        return future
+    done: Future = Future()
+
+    def update_catalog(shard_write: Future):
+        if shard_write.exception() is not None:
+            done.set_exception(shard_write.exception())
+            return
+        result = shard_write.result()
+        catalog_write = db_writer.submit(lambda conn: write(result, conn))
+        catalog_write.add_done_callback(
+            lambda f: (
+                done.set_exception(f.exception())
+                if f.exception() is not None
+                else done.set_result(None)
+            )
+        )
+
+    future.add_done_callback(update_catalog)
+    return done
+
+
+def _update_catalog(conn: sql.Connection, listing: tuple):
+    conn.execute(
+        "INSERT OR REPLACE INTO active_node (scenario_id, node_id, timestep, summary, last_updated) VALUES (?, ?, ?, ?, ?)",
+        listing,
+    )
+
+
+def open_database(
+    database: str,
+    sharding_mode: Optional[str] = None,
+    shards: Optional[int] = None,
+):
+    """
+    Point texty at a database file, replacing the connection pools and writer. Writes queued against the previous database are committed first.
+    When sharded (`sharding_mode` "hash" or "scenario", by default settings.db_sharding), `database` is the directory holding the shards and their catalog
+    """
+    global db_pool, db_writer, async_pool, main_shard, sharding, shard_count, shard_dir
+    close_database()
+    node_cache.clear()
+    with migrated_lock:
+        migrated.clear()
+    sharding = settings.db_sharding if sharding_mode is None else sharding_mode
+    shard_count = settings.db_shard_count if shards is None else shards
+    if sharding == "none":
+        main_shard = Shard(database)
+    else:
+        shard_dir = database
+        os.makedirs(shard_dir, exist_ok=True)
+        main_shard = Shard(os.path.join(shard_dir, "catalog.db"))
+    db_pool, db_writer, async_pool = (
+        main_shard.pool,
+        main_shard.writer,
+        main_shard.async_pool,
+    )
+
+
+def close_database():
+    """
+    Commit queued writes, and close every database file
+    """
+    with shards_lock:
+        opened = list(shards.values())
+        shards.clear()
+    for shard in opened + [main_shard]:
+        shard.close()
+
 
-# Create a global instance of the connection pool
-db_pool = SQLiteConnectionPool("texty.db")
+# Create global instances of the connection pool and writer. With sharding, these are the catalog's
+sharding = settings.db_sharding
+shard_count = settings.db_shard_count
+shard_dir = settings.db_shard_dir
+shards: OrderedDict[str, Shard] = OrderedDict()
+shards_lock = threading.Lock()
+# shards evicted from `shards` whose queued writes are still being committed, which reopening waits for
+closing_shards: Dict[str, threading.Event] = {}
+# shard files whose migrations have run in this process
+migrated: Set[str] = set()
+migrated_lock = threading.Lock()
+main_shard = Shard(
+    "texty.db" if sharding == "none" else os.path.join(shard_dir, "catalog.db")
+)
+if sharding != "none":
+    os.makedirs(shard_dir, exist_ok=True)
+db_pool = main_shard.pool
+db_writer = main_shard.writer
+async_pool = main_shard.async_pool
+node_cache = NodeCache(max_bytes=settings.node_cache_bytes)
+async_executor = ThreadPoolExecutor(
+    max_workers=settings.db_async_workers, thread_name_prefix="texty-db-async"
+)
+atexit.register(close_database)
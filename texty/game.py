@@ -1,6 +1,9 @@
-from typing import Iterator, List, Literal, Optional, Set, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import concurrent.futures
+import threading
+from typing import Dict, Generator, Iterator, List, Literal, Optional, Set, Tuple
 import uuid
-from pydantic import BaseModel, Field, TypeAdapter
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
 
 from texty import prompts
 from texty.prompts import (
@@ -11,12 +14,18 @@ from texty.prompts import (
 from texty.gametypes import (
     Eventuality,
     GameElementUpdate,
+    HistorySummary,
     LogItem,
     ProgressLog,
     TimeNode,
 )
-from texty import database, seeds
-from texty.models.model import get_client
+from texty import seeds
+from texty.database import NodeListing
+from texty.intent import classify_intent
+from texty.storage import StorageBackend, get_storage
+from texty.models.model import get_stage_client
+from texty.parsing import Partial, TrailerSplitter, extract_json_object
+from texty.settings import settings
 
 import logging
 
@@ -28,18 +37,31 @@ class MissingException(Exception):
 
 
 class Game:
-    node: Optional[TimeNode] = None
+    _node: Optional[TimeNode] = None
     last_node: Optional[TimeNode] = None
     scenario_id: str
+    storage: StorageBackend
 
-    def __init__(self, scenario_id: str):
+    def __init__(self, scenario_id: str, storage: Optional[StorageBackend] = None):
         self.scenario_id = scenario_id
+        self.storage = storage or get_storage()
+
+    @property
+    def node(self) -> Optional[TimeNode]:
+        """The current node, once the last turn played has been committed"""
+        wait_for_commit(self.scenario_id)
+        return self._node
+
+    @node.setter
+    def node(self, node: Optional[TimeNode]):
+        self._node = node
 
     def start_if_not_started(
         self, seed: TimeNode = seeds.zantar
     ) -> Iterator["AdvanceTimeProgress"]:
         """returns true if the game was started, false if it was already running"""
-        self.node = database.get_active_node(scenario_id=self.scenario_id)
+        wait_for_commit(self.scenario_id)
+        self.node = self.storage.get_active_node(scenario_id=self.scenario_id)
         if not self.node:
             node = seed.model_copy(update={"id": self.scenario_id})
             for event in advance_time(
@@ -52,43 +74,125 @@ class Game:
                 yield event
             self.last_node = self.node
             self.node = node
-            database.insert_time_node(self.node)
+            self.storage.insert_time_node(self.node).result()
 
     def step(
         self,
         player_action: str,
     ) -> Iterator["AdvanceTimeProgress"]:
-        assert self.node is not None
         previous = self.node
+        assert previous is not None
         updated = None
-        for event in advance_time(player_action, self.node):
+        write: Optional[Future] = None
+        turn = advance_time(player_action, previous)
+        for event in turn:
+            if (
+                type(event) == StatusUpdate
+                and event.commit is not None
+                and settings.background_commit
+            ):
+                self.commit_in_background(event.commit, previous)
+                turn.close()
+                yield event
+                return
             if type(event) == StatusUpdate and event.updated_time_node:
                 updated = event.updated_time_node
                 self.last_node = previous
                 self.node = updated
-                database.insert_time_node(updated)
+                write = self.storage.insert_time_node(updated, parent=previous)
             yield event
         if updated is None:
             logger.warn("something's wrong, no node updated")
+        # once the turn is shown, and before the caller moves on, so that reads see it
+        if write is not None:
+            write.result()
+
+    def commit_in_background(self, commit: "Future[TimeNode]", previous: TimeNode):
+        """
+        Once `commit` has applied the turn's update, make its node current and save it. Until then, reading self.node waits
+        """
+        saved: Future[TimeNode] = Future()
+
+        def save(applied: "Future[TimeNode]"):
+            try:
+                updated = applied.result()
+                write = self.storage.insert_time_node(updated, parent=previous)
+            except Exception as e:
+                saved.set_exception(e)
+                return
+            self._node = updated
+            self.last_node = previous
+            write.add_done_callback(
+                lambda f: (
+                    saved.set_exception(f.exception())
+                    if f.exception() is not None
+                    else saved.set_result(updated)
+                )
+            )
+
+        track_commit(self.scenario_id, saved)
+        commit.add_done_callback(save)
 
     def undo(self) -> bool:
         """Returns true if the undo was successful, false if it was not possible"""
+        # a turn still being committed would make its node current after the undo
+        wait_for_commit(self.scenario_id)
         node_ids = self.node.previous[-2:]
-        previous = database.get_node(id=node_ids[-1]) if len(node_ids) > 1 else None
-        preprevious = database.get_node(id=node_ids[-2]) if len(node_ids) > 2 else None
+        previous = (
+            self.storage.get_node(id=node_ids[-1], scenario_id=self.scenario_id)
+            if len(node_ids) > 1
+            else None
+        )
+        preprevious = (
+            self.storage.get_node(id=node_ids[-2], scenario_id=self.scenario_id)
+            if len(node_ids) > 2
+            else None
+        )
         if not previous:
             return False
         else:
             self.node = previous
             self.last_node = preprevious
-            database.set_active_node(scenario_id=self.scenario_id, node_id=self.node.id)
+            self.storage.set_active_node(
+                scenario_id=self.scenario_id, node_id=previous.id
+            )
             return True
 
+    def children(self) -> List[NodeListing]:
+        """The branches that continue on from the current node, most recently played first"""
+        assert self.node is not None
+        return self.storage.list_children(self.node.id, self.scenario_id)
+
+    def jump(self, node_id: str) -> bool:
+        """Makes any node of this game the current one, e.g. an ancestor or a descendant. Returns false if there is no such node in this game"""
+        wait_for_commit(self.scenario_id)
+        node = self.storage.get_node(id=node_id, scenario_id=self.scenario_id)
+        if not node or node.scenario_id() != self.scenario_id:
+            return False
+        self.node = node
+        self.last_node = (
+            self.storage.get_node(id=node.previous[-1], scenario_id=self.scenario_id)
+            if len(node.previous) > 1
+            else None
+        )
+        self.storage.set_active_node(scenario_id=self.scenario_id, node_id=node.id)
+        return True
+
+    def redo(self) -> bool:
+        """Returns true if the redo was successful, moving to the most recently played branch off of the current node"""
+        wait_for_commit(self.scenario_id)
+        children = self.children()
+        return len(children) > 0 and self.jump(children[0].node_id)
+
 
 class StatusUpdate(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     status: str
     updated_time_node: Optional[TimeNode] = None
     debug: Optional[str] = None
+    # on the "committing" update: resolves to the updated node, once the turn's update has been applied to it
+    commit: Optional[Future] = Field(default=None, exclude=True)
 
 
 class TextResponse(BaseModel):
@@ -105,13 +209,20 @@ def advance_time(
     """
     An iteration of the game loop
     """
-    original = time_node
-    time_node = time_node.model_copy(deep=True)
-    time_node.id = str(uuid.uuid4())
-    time_node.previous = original.previous + [original.id]
+    time_node = next_time_node(time_node)
 
     detected_intent: Optional[IntentDetection] = None
+    speculation: Optional[Tuple[Intent, "Future[GameElementUpdate]"]] = None
     if not is_initialization:
+        if settings.speculative_planning and not settings.single_pass_turns:
+            # plan with the likeliest intent while the intent is detected, rather than after
+            guess = guess_intent(time_node)
+            speculation = (
+                guess,
+                stage_executor.submit(
+                    plan_update, plan_prompt(player_action, guess, time_node)
+                ),
+            )
         yield StatusUpdate(status="loading-intent")
         detected_intent = detect_intent(player_action, time_node)
         yield StatusUpdate(
@@ -120,75 +231,187 @@ def advance_time(
         )
 
     intent: Intent = detected_intent.intent if detected_intent else "act"
-    if intent == "act":
-        time_node.timestep = time_node.timestep + 1
-    timestep = time_node.timestep
-
-    events = [
-        LogItem(type=intent, role="player", text=player_action, timestep=timestep)
-    ]
+    if speculation is not None and speculation[0] != intent:
+        # a wrong guess. If the call has already started, its result is just dropped
+        speculation[1].cancel()
+    events = begin_turn(player_action, intent, time_node, detected_intent)
+    # whether the update's events were applied to time_node as they streamed in
+    events_applied = False
+    update: Optional[GameElementUpdate] = None
     if intent == "ambiguous":
-        response = (
-            detected_intent.early_response if detected_intent is not None else None
-        )
-        response = (
-            response
-            or "I'm unsure what your intent is. Can you clarify with either an inspect or an act command?"
-        )
+        response = clarification(detected_intent)
         yield TextResponse(full_text=response, delta=response)
-        events.append(
-            LogItem(
-                role="game",
-                type="game-response",
-                text=response,
-                timestep=timestep,
-            )
+    elif settings.single_pass_turns:
+        update, response = yield from plan_and_narrate(player_action, intent, time_node)
+    elif settings.stream_planning and (speculation is None or speculation[0] != intent):
+        update, response = yield from narrate_while_planning(
+            player_action, intent, time_node
         )
+        events_applied = True
     else:
-        plan_prompt = prompts.prompt_plan(
-            player_action=player_action,
-            intent=intent,
-            premise=time_node.premise,
-            events_json=prompts.dump_events(time_node),
-            retired_game_events_json=prompts.dump_retired_game_elements(
-                time_node.retired_game_elements
-            ),
-            active_game_events_json=prompts.dump_game_elements(time_node.game_elements),
-        )
         yield StatusUpdate(status="running-simulation")
-        update = get_client("large").json(plan_prompt, GameElementUpdate)
+        if speculation is not None and speculation[0] == intent:
+            update = speculation[1].result()
+        else:
+            update = plan_update(plan_prompt(player_action, intent, time_node))
         yield StatusUpdate(status="ran-simulation")
         yield StatusUpdate(status="generate-response")
-        prompt = prompts.prompt_respond_to_action(
-            player_action=player_action,
-            intent=intent,
-            premise=time_node.premise,
-            game_updates_json=update.model_dump_json(indent=2),
-            game_elements_prev_json=prompts.dump_game_elements(time_node.game_elements),
-            events_json=prompts.dump_events(time_node),
-        )
+        prompt = respond_prompt(player_action, intent, time_node, update)
         response = ""
-        for chunk in get_client("large").stream(prompt):
+        for chunk in get_stage_client("respond").stream(prompt):
             response += chunk
             yield TextResponse(full_text=response, delta=chunk)
         yield StatusUpdate(status="generated-response")
-        events.append(
-            LogItem(role="game", type="game-response", text=response, timestep=timestep)
+    commit = commit_executor.submit(
+        commit_turn,
+        time_node,
+        events,
+        update,
+        response,
+        is_initialization,
+        events_applied,
+    )
+    yield StatusUpdate(status="committing", commit=commit)
+    yield StatusUpdate(status="done", updated_time_node=commit.result())
+    return time_node
+
+
+def next_time_node(time_node: TimeNode) -> TimeNode:
+    """
+    A copy of time_node, to play the next turn on
+    """
+    return time_node.child(str(uuid.uuid4()))
+
+
+def begin_turn(
+    player_action: str,
+    intent: Intent,
+    time_node: TimeNode,
+    detected_intent: Optional[IntentDetection] = None,
+) -> List[LogItem]:
+    """
+    Move time_node on a timestep if the player acted, returning the turn's events so far. The player's input is logged
+    with what detected its intent, so the local classifier is only trained on the LLM's labels
+    """
+    if intent == "act":
+        time_node.timestep = time_node.timestep + 1
+    return [
+        LogItem(
+            type=intent,
+            role="player",
+            text=player_action,
+            timestep=time_node.timestep,
+            source=detected_intent.source if detected_intent else None,
+        )
+    ]
+
+
+def clarification(detected_intent: Optional[IntentDetection]) -> str:
+    """
+    The response to an ambiguous player input
+    """
+    response = detected_intent.early_response if detected_intent is not None else None
+    return (
+        response
+        or "I'm unsure what your intent is. Can you clarify with either an inspect or an act command?"
+    )
+
+
+def finish_turn(
+    time_node: TimeNode,
+    events: List[LogItem],
+    update: Optional[GameElementUpdate],
+    response: str,
+    is_initialization: bool,
+    events_applied: bool = False,
+) -> TimeNode:
+    """
+    Record a turn's response, and its update if it has one, on time_node
+    """
+    events.append(
+        LogItem(
+            role="game",
+            type="game-response",
+            text=response,
+            timestep=time_node.timestep,
         )
+    )
+    if update is not None:
         time_node.last_update = update
         time_node.summary = update.summary
-        time_node.apply_update(update)
-        # some sort of issue with nulls or something that this fixes
-        time_node = TimeNode.model_validate(time_node.model_dump())
+        if not events_applied:
+            time_node.apply_update(update)
 
     # ignore the seed event, just useful for communicating context for the first iteration
     time_node.event_log = time_node.event_log + (
         events[1:] if is_initialization else events
     )
-    yield StatusUpdate(status="done", updated_time_node=time_node)
     return time_node
 
 
+def commit_turn(
+    time_node: TimeNode,
+    events: List[LogItem],
+    update: Optional[GameElementUpdate],
+    response: str,
+    is_initialization: bool,
+    events_applied: bool = False,
+) -> TimeNode:
+    """
+    The work left once a turn's narration has streamed: recording the turn on time_node, and folding its history if due.
+    Only background commits fold, as a fold's summarizing call would otherwise hold up the turn
+    """
+    finish_turn(time_node, events, update, response, is_initialization, events_applied)
+    if not settings.background_commit:
+        return time_node
+    try:
+        fold_history(time_node)
+    except Exception as e:
+        # the turns stay verbatim, and the fold is retried on the next turn
+        logger.warning(f"could not summarize the history of {time_node.id}: {e}")
+    return time_node
+
+
+# the turns being committed in the background, by scenario id
+pending_commits: Dict[str, "Future[TimeNode]"] = {}
+pending_commits_lock = threading.Lock()
+
+
+def track_commit(scenario_id: str, commit: "Future[TimeNode]"):
+    """
+    Make `commit` the one to wait for before reading or playing on scenario_id
+    """
+
+    def done(f: "Future[TimeNode]"):
+        if f.exception() is not None:
+            logger.error(f"could not commit a turn of {scenario_id}: {f.exception()}")
+        with pending_commits_lock:
+            if pending_commits.get(scenario_id) is f:
+                del pending_commits[scenario_id]
+
+    with pending_commits_lock:
+        pending_commits[scenario_id] = commit
+    commit.add_done_callback(done)
+
+
+def commit_pending(scenario_id: str) -> bool:
+    """
+    Whether a turn of scenario_id is still being committed in the background
+    """
+    with pending_commits_lock:
+        return scenario_id in pending_commits
+
+
+def wait_for_commit(scenario_id: str):
+    """
+    Wait for the turn last played on scenario_id to be committed. A failed commit is logged, and play continues from the node before it
+    """
+    with pending_commits_lock:
+        commit = pending_commits.get(scenario_id)
+    if commit is not None:
+        concurrent.futures.wait([commit])
+
+
 ##################################################
 ### LLM powered state transformation functions ###
 ##################################################
@@ -201,16 +424,332 @@ def detect_intent(player_action: str, time_node: TimeNode) -> "IntentDetection":
     """
     # TODO: consider allowing introspection as part of inspect (or its own intent?). Consider whether dialog should be its own intent.
 
-    return get_client("large").json(
-        prompts.prompt_detect_intent(
-            player_action,
-            time_node.premise,
-            prompts.dump_game_elements(time_node.game_elements),
+    local = local_intent(player_action)
+    if local is not None:
+        return local
+    return get_stage_client("intent").json(
+        intent_prompt(player_action, time_node), IntentDetection
+    )
+
+
+def local_intent(player_action: str) -> Optional[IntentDetection]:
+    local = classify_intent(player_action)
+    if local is None:
+        return None
+    return IntentDetection(
+        thought=f"classified locally ({local.confidence:.2f} confidence)",
+        intent=local.intent,
+        source="classifier",
+    )
+
+
+def intent_prompt(player_action: str, time_node: TimeNode) -> str:
+    return prompts.prompt_detect_intent(
+        player_action,
+        time_node.premise,
+        prompts.dump_game_elements(time_node.game_elements),
+    )
+
+
+def fold_history(time_node: TimeNode):
+    """
+    Fold the event log's older turns into the node's rolling summary, once enough have built up before the verbatim ones. Children inherit the summary, so each turn is only summarized once
+    """
+    if not settings.summarize_history:
+        return
+    through = time_node.history_fold_point(
+        settings.history_verbatim_turns, settings.history_fold_turns
+    )
+    if through is None:
+        return
+    previous = time_node.history_summary
+    folded = previous.through if previous else 0
+    text = get_stage_client("summarize").text(
+        prompts.prompt_summarize_history(
+            premise=time_node.premise,
+            summary=previous.text if previous else "",
+            events_json="\n".join(
+                item.model_dump_json() for item in time_node.event_log[folded:through]
+            ),
+        )
+    )
+    time_node.history_summary = HistorySummary(text=text.strip(), through=through)
+
+
+def guess_intent(time_node: TimeNode, recent: int = 10) -> Intent:
+    """
+    The intent the player most likely has next: their most common intent over their recent actions, or "act" for a new game
+    """
+    intents = [
+        item.type
+        for item in time_node.event_log[-recent * 2 :]
+        if item.role == "player" and item.type in ("act", "inspect")
+    ]
+    if not intents:
+        return "act"
+    return max(reversed(intents), key=intents.count)
+
+
+def plan_prompt(player_action: str, intent: Intent, time_node: TimeNode) -> str:
+    return prompts.prompt_plan(
+        player_action=player_action,
+        intent=intent,
+        premise=time_node.premise,
+        events_json=prompts.dump_events(time_node),
+        retired_game_events_json=prompts.dump_retired_game_elements(
+            time_node.retired_game_elements
+        ),
+        active_game_events_json=prompts.dump_game_elements(time_node.game_elements),
+    )
+
+
+def respond_prompt(
+    player_action: str,
+    intent: Intent,
+    time_node: TimeNode,
+    update: GameElementUpdate,
+    **dump_kwargs,
+) -> str:
+    return prompts.prompt_respond_to_action(
+        player_action=player_action,
+        intent=intent,
+        premise=time_node.premise,
+        game_updates_json=update.model_dump_json(indent=2, **dump_kwargs),
+        game_elements_prev_json=prompts.dump_game_elements(time_node.game_elements),
+        events_json=prompts.dump_events(time_node),
+    )
+
+
+def plan_and_narrate_prompt(
+    player_action: str, intent: Intent, time_node: TimeNode
+) -> str:
+    return prompts.prompt_plan_and_narrate(
+        player_action=player_action,
+        intent=intent,
+        premise=time_node.premise,
+        events_json=prompts.dump_events(time_node),
+        retired_game_events_json=prompts.dump_retired_game_elements(
+            time_node.retired_game_elements
         ),
-        IntentDetection,
+        active_game_events_json=prompts.dump_game_elements(time_node.game_elements),
     )
 
 
+def read_game_update(trailer: Optional[str]) -> GameElementUpdate:
+    """
+    The game update trailing a single pass response. Raises a ValueError if it's missing or malformed
+    """
+    if trailer is None:
+        raise ValueError("no game update after the narration")
+    return GameElementUpdate.model_validate_json(extract_json_object(trailer))
+
+
+def plan_update(plan_prompt: str) -> GameElementUpdate:
+    """
+    Simulate how the game world changes in response to the player's action
+    """
+    return get_stage_client("plan").json(plan_prompt, GameElementUpdate)
+
+
+def plan_and_narrate(
+    player_action: str, intent: Intent, time_node: TimeNode
+) -> Generator[AdvanceTimeProgress, None, Tuple[GameElementUpdate, str]]:
+    """
+    Narrate and plan a turn in one call, streaming the narration, and returning it with the game update that trails it. Falls back to a separate planning call if the update is missing or malformed
+    """
+    prompt = plan_and_narrate_prompt(player_action, intent, time_node)
+    yield StatusUpdate(status="generate-response")
+    narration = SinglePassNarration()
+    for chunk in get_stage_client("respond").stream(prompt):
+        text = narration.feed(chunk)
+        if text:
+            yield text
+    text = narration.close()
+    if text:
+        yield text
+    yield StatusUpdate(status="generated-response")
+    yield StatusUpdate(status="running-simulation")
+    update = narration.update()
+    if update is None:
+        update = plan_update(plan_prompt(player_action, intent, time_node))
+    yield StatusUpdate(status="ran-simulation")
+    return update, narration.response.strip()
+
+
+class SinglePassNarration:
+    """
+    Reads a single pass response as it streams: the narration, to show as it arrives, then the game update that trails it. Shared by the threaded and asyncio game loops, which only differ in how they get the chunks
+    """
+
+    def __init__(self):
+        self.splitter = TrailerSplitter(prompts.GAME_UPDATE_MARKER)
+        self.response = ""
+
+    def feed(self, chunk: str) -> Optional[TextResponse]:
+        """The narration added by a chunk of the response, if any"""
+        return self._narrate(self.splitter.feed(chunk))
+
+    def close(self) -> Optional[TextResponse]:
+        """The end of the narration, once the response is done"""
+        # without an update, text held back as a possible start of the marker is narration after all
+        return self._narrate(self.splitter.close())
+
+    def update(self) -> Optional[GameElementUpdate]:
+        """The game update trailing the narration, or None if it's missing or malformed, and the turn needs planning separately"""
+        try:
+            return read_game_update(self.splitter.trailer)
+        except ValueError as e:
+            logger.warning(
+                f"could not read the single pass game update, replanning: {e}"
+            )
+            return None
+
+    def _narrate(self, delta: str) -> Optional[TextResponse]:
+        if not delta:
+            return None
+        self.response += delta
+        return TextResponse(full_text=self.response, delta=delta)
+
+
+def narrate_while_planning(
+    player_action: str, intent: Intent, time_node: TimeNode
+) -> Generator[AdvanceTimeProgress, None, Tuple[GameElementUpdate, str]]:
+    """
+    Stream the plan, starting the narration as soon as the plan's response_plan is whole, rather than when the whole plan is. The plan's events are applied to time_node as they arrive, while the narration streams
+    """
+    yield StatusUpdate(status="running-simulation")
+    partials = iter(
+        get_stage_client("plan").json_stream(
+            plan_prompt(player_action, intent, time_node), GameElementUpdate
+        )
+    )
+    planned = first_whole_plan(partials)
+    if planned is None:
+        logger.warning("the streamed plan has no whole response_plan, replanning")
+        planned = plan_update(plan_prompt(player_action, intent, time_node))
+    yield StatusUpdate(status="planned-response")
+    prompt = respond_prompt(
+        player_action,
+        intent,
+        time_node,
+        planned,
+        include={"response_plan", "events"},
+    )
+    # time_node is only changed from here on, once the narration prompt has been written
+    applying = stage_executor.submit(
+        apply_streamed_events, partials, planned, time_node
+    )
+    yield StatusUpdate(status="generate-response")
+    response = ""
+    for chunk in get_stage_client("respond").stream(prompt):
+        response += chunk
+        yield TextResponse(full_text=response, delta=chunk)
+    yield StatusUpdate(status="generated-response")
+    update = applying.result()
+    yield StatusUpdate(status="ran-simulation")
+    return update, response
+
+
+def first_whole_plan(
+    partials: Iterator[Partial[GameElementUpdate]],
+) -> Optional[GameElementUpdate]:
+    """
+    The first plan of a stream whose response_plan is whole. If the stream ends without one (cut short, or the model left the field out), the last plan received, if that's a valid plan. None otherwise
+    """
+    last = None
+    try:
+        for partial in partials:
+            if "response_plan" in partial.complete:
+                return partial.value
+            last = partial.value
+    except ValueError as e:
+        logger.warning(f"could not read the streamed plan: {e}")
+        return None
+    return valid_plan(last)
+
+
+def valid_plan(
+    partial: Optional[GameElementUpdate],
+) -> Optional[GameElementUpdate]:
+    """A partial plan as a whole one, if it's a valid plan"""
+    if partial is None:
+        return None
+    try:
+        return GameElementUpdate.model_validate(partial.__dict__)
+    except ValueError:
+        return None
+
+
+def apply_streamed_events(
+    partials: Iterator[Partial[GameElementUpdate]],
+    planned: GameElementUpdate,
+    time_node: TimeNode,
+) -> GameElementUpdate:
+    """
+    Apply each event of a streaming plan to time_node once it's whole, returning the whole plan. If the rest of the
+    stream can't be read (cut short, or not a valid plan), the plan so far, with the events already applied
+    """
+    events = StreamedEvents(planned, time_node)
+    try:
+        for partial in partials:
+            events.add(partial)
+    except ValueError as e:
+        return events.cut_short(e)
+    return events.update()
+
+
+class StreamedEvents:
+    """
+    Applies the events of a streaming plan to time_node as each one is whole. Shared by the threaded and asyncio game loops, which only differ in how they get the partial plans
+    """
+
+    def __init__(self, planned: GameElementUpdate, time_node: TimeNode):
+        self.planned = planned
+        self.time_node = time_node
+        self.applied = 0
+        self.last = Partial(value=planned)
+        self.add(self.last)
+
+    def add(self, partial: Partial[GameElementUpdate]):
+        for event in partial.value.events[self.applied :]:
+            self.time_node.apply_update(
+                GameElementUpdate(response_plan="", events=[event], summary="")
+            )
+        self.applied = len(partial.value.events)
+        self.last = partial
+
+    def update(self) -> GameElementUpdate:
+        """The whole plan, once the stream is done"""
+        return self.last.value
+
+    def cut_short(self, error: ValueError) -> GameElementUpdate:
+        """The plan so far, when the rest of the stream can't be read"""
+        # the narration has streamed by now, so the turn is kept rather than replanned. A summary cut short is
+        # left out, keeping the last turn's
+        logger.warning(f"could not read the rest of the streamed plan: {error}")
+        last = self.last
+        return GameElementUpdate(
+            response_plan=self.planned.response_plan,
+            events=last.value.events[: self.applied],
+            summary=(
+                last.value.summary
+                if "summary" in last.complete
+                else self.time_node.summary
+            ),
+        )
+
+
+# runs model calls alongside another stage of the turn: speculative planning, and the rest of a streamed plan
+stage_executor = ThreadPoolExecutor(
+    max_workers=settings.stage_workers, thread_name_prefix="texty-speculation"
+)
+
+# applies and saves turns once their narration has streamed
+commit_executor = ThreadPoolExecutor(
+    max_workers=settings.commit_workers, thread_name_prefix="texty-commit"
+)
+
+
 EventualityList = user_list_adapter = TypeAdapter(Optional[List[Eventuality]])
 
 
@@ -1,6 +1,10 @@
 from typing import List, Literal, Optional, Union
 from pydantic import BaseModel, Field
 
+import logging
+
+logger = logging.getLogger(__name__)
+
 
 class TimeNode(BaseModel):
     """
@@ -43,21 +47,54 @@ class TimeNode(BaseModel):
     retired_game_elements: List["RetiredGameElement"] = Field(
         default_factory=list,
     )
+    history_summary: Optional["HistorySummary"] = Field(
+        default=None,
+        description="A rolling summary of the start of the event log, sent to the model in place of those events",
+    )
 
     def scenario_id(self) -> str:
         return self.previous[0] if len(self.previous) else self.id
 
+    def history_fold_point(self, verbatim_turns: int, fold_turns: int) -> Optional[int]:
+        """
+        The event log index to fold the history up to, keeping the last verbatim_turns turns as they are. None until fold_turns more turns than those are unfolded, so that folds are batched rather than made every turn
+        """
+        folded = self.history_summary.through if self.history_summary else 0
+        starts = [
+            i
+            for i, item in enumerate(self.event_log)
+            if i >= folded and item.role == "player"
+        ]
+        if len(starts) < verbatim_turns + fold_turns:
+            return None
+        cut = len(starts) - verbatim_turns
+        return starts[cut] if cut < len(starts) else len(self.event_log)
+
+    def child(self, id: str) -> "TimeNode":
+        """
+        A copy of this node to play the next turn on. Game elements and log items are shared with this node rather than copied: they're never changed in place, apply_update replaces the elements it changes with changed copies
+        """
+        return self.model_copy(
+            update={
+                "id": id,
+                "previous": self.previous + [self.id],
+                "event_log": list(self.event_log),
+                "game_elements": list(self.game_elements),
+                "retired_game_elements": list(self.retired_game_elements),
+            }
+        )
+
     def apply_update(self, update: "GameElementUpdate") -> "TimeNode":
         self.last_update = update
         for evt in update.events:
             match evt:
                 case AddGameElement():
-                    print("process add game element", evt)
+                    logger.debug("process add game element %s", evt)
                     evt: AddGameElement = evt
                     new_element = GameElement(**evt.model_dump())
                     self.game_elements.append(new_element)
                 case RetireGameElement():
-                    print("process retire game element", evt)
+                    logger.debug("process retire game element %s", evt)
                     evt: RetireGameElement = evt
                     existing = next(
                         (
@@ -82,25 +119,26 @@ class TimeNode(BaseModel):
                     evt: UpdateGameElement = evt
                     existing = next(
                         (
-                            x
-                            for x in self.game_elements
+                            i
+                            for i, x in enumerate(self.game_elements)
                             if x.element_id == evt.element_id
                         ),
                         None,
                     )
                     if existing is not None:
-                        if evt.replace.past:
-                            existing.past = evt.replace.past
-                        if evt.replace.present:
-                            existing.present = evt.replace.present
-                        if evt.replace.future:
-                            existing.future = evt.replace.future
-                        if evt.add.past:
-                            existing.past.extend(evt.add.past)
-                        if evt.add.present:
-                            existing.present.extend(evt.add.present)
-                        if evt.add.future:
-                            existing.future.extend(evt.add.future)
+                        # the element may be shared with other nodes, so it's replaced rather than changed
+                        element = self.game_elements[existing]
+                        changes = {}
+                        for field in ("past", "present", "future"):
+                            replace = getattr(evt.replace, field)
+                            add = getattr(evt.add, field)
+                            if replace or add:
+                                changes[field] = list(
+                                    replace or getattr(element, field)
+                                ) + list(add or [])
+                        self.game_elements[existing] = element.model_copy(
+                            update=changes
+                        )
                 case EndGame():
                     pass
                 case other:
@@ -177,6 +215,16 @@ class EndGame(BaseModel):
     description: str
 
 
+class HistorySummary(BaseModel):
+    text: str
+    through: int = Field(
+        description="The number of event log items summarized, from the start of the log"
+    )
+
+
+type IntentSource = Literal["llm", "classifier"]
+
+
 class LogItem(BaseModel):
     role: Literal["player", "game", "internal"]
     type: Literal["act", "inspect", "other", "ambiguous", "game-response"]
@@ -184,6 +232,8 @@ class LogItem(BaseModel):
     timestep: int = Field(
         description="The incrementing timestep of the game when this event occurred"
     )
+    # for player inputs, what detected the intent in `type`. Left out of dumps, as the event log is dumped into prompts
+    source: Optional[IntentSource] = Field(default=None, exclude=True)
 
 
 class Eventuality(BaseModel):
@@ -0,0 +1,247 @@
+"""
+A local classifier of the player's intent, so that obvious inputs like "look around" or "open the door" don't cost a
+model call. Keywords set the starting weights of a linear model over the words of the input, which is trained on
+the intents the LLM detected for logged player inputs (`python -m texty train-intent`)
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+import json
+import math
+import os
+import random
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from texty.settings import settings
+
+INTENTS = ("act", "inspect", "ambiguous", "other")
+
+# ambiguous inputs need the LLM's clarifying early_response, so they're never settled locally
+LOCAL_INTENTS = ("act", "inspect", "other")
+
+# first words that nearly always mean the same intent
+KEYWORDS = {
+    "inspect": {
+        "look",
+        "l",
+        "examine",
+        "x",
+        "inspect",
+        "read",
+        "check",
+        "search",
+        "study",
+        "observe",
+        "listen",
+        "smell",
+        "what",
+        "who",
+        "where",
+        "why",
+        "how",
+        "describe",
+        "peek",
+        "watch",
+    },
+    "act": {
+        "open",
+        "close",
+        "take",
+        "grab",
+        "pick",
+        "drop",
+        "go",
+        "walk",
+        "run",
+        "climb",
+        "enter",
+        "leave",
+        "push",
+        "pull",
+        "give",
+        "use",
+        "say",
+        "tell",
+        "call",
+        "yell",
+        "shout",
+        "attack",
+        "hit",
+        "throw",
+        "unlock",
+        "follow",
+        "hide",
+        "wait",
+    },
+    "other": {"help", "hint", "undo", "rules"},
+}
+# where training starts from. Untrained, a keyword alone gives its intent a probability of about 0.71, short of the
+# default intent_classifier_threshold, so inputs are only settled locally once the weights have been trained:
+# a keyword first word doesn't make "look at the door then open it" obvious
+KEYWORD_WEIGHT = 2.0
+
+
+@dataclass
+class IntentPrediction:
+    intent: str
+    # the model's probability of the intent, from 0 to 1
+    confidence: float
+
+
+def features(text: str) -> List[str]:
+    """
+    The sparse features of a player input: its words and word pairs, its first word, whether it's a question, and the keyword class of its first word
+    """
+    words = re.findall(r"[a-z0-9']+|\?", text.lower())
+    if not words:
+        return ["empty"]
+    found = [f"w:{word}" for word in words]
+    found += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    found.append(f"first:{words[0]}")
+    if words[-1] == "?":
+        found.append("question")
+    for intent, keywords in KEYWORDS.items():
+        if words[0] in keywords:
+            found.append(f"kw:{intent}")
+    return found
+
+
+class IntentClassifier:
+    """
+    A multinomial logistic regression over sparse features. Untrained, only the keyword features carry weight, and not enough to be confident
+    """
+
+    def __init__(self, weights: Optional[Dict[str, Dict[str, float]]] = None):
+        self.weights: Dict[str, Dict[str, float]] = weights or {
+            intent: ({f"kw:{intent}": KEYWORD_WEIGHT} if intent in KEYWORDS else {})
+            for intent in INTENTS
+        }
+
+    def probabilities(self, text: str) -> Dict[str, float]:
+        return self._probabilities(features(text))
+
+    def _probabilities(self, found: List[str]) -> Dict[str, float]:
+        scores = {
+            intent: sum(weights.get(feature, 0.0) for feature in found)
+            for intent, weights in self.weights.items()
+        }
+        top = max(scores.values())
+        exp = {intent: math.exp(score - top) for intent, score in scores.items()}
+        total = sum(exp.values())
+        return {intent: value / total for intent, value in exp.items()}
+
+    def predict(self, text: str) -> IntentPrediction:
+        probabilities = self.probabilities(text)
+        intent = max(probabilities, key=probabilities.__getitem__)
+        return IntentPrediction(intent=intent, confidence=probabilities[intent])
+
+    def train(
+        self,
+        examples: List[Tuple[str, str]],
+        epochs: int = 20,
+        learning_rate: float = 0.2,
+        l2: float = 1e-4,
+        seed: int = 0,
+    ):
+        """
+        Fit the weights to (text, intent) examples with stochastic gradient descent, starting from the current weights
+        """
+        rng = random.Random(seed)
+        examples = [(features(text), intent) for text, intent in examples]
+        for epoch in range(epochs):
+            rng.shuffle(examples)
+            rate = learning_rate / (1 + epoch)
+            for found, label in examples:
+                probabilities = self._probabilities(found)
+                for intent, weights in self.weights.items():
+                    gradient = probabilities[intent] - (1.0 if intent == label else 0.0)
+                    for feature in found:
+                        weight = weights.get(feature, 0.0)
+                        weights[feature] = weight - rate * (gradient + l2 * weight)
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"version": 1, "weights": self.weights}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        with open(path) as f:
+            return cls(json.load(f)["weights"])
+
+
+@lru_cache(maxsize=None)
+def get_classifier(path: str) -> IntentClassifier:
+    """
+    The classifier trained to `path`, or the keyword only classifier if nothing has been trained yet
+    """
+    if os.path.exists(path):
+        return IntentClassifier.load(path)
+    return IntentClassifier()
+
+
+def classify_intent(player_action: str) -> Optional[IntentPrediction]:
+    """
+    The intent of a player input, if the local classifier is confident enough to skip asking the LLM
+    """
+    if not settings.intent_classifier:
+        return None
+    prediction = get_classifier(settings.intent_model_path).predict(player_action)
+    if (
+        prediction.intent in LOCAL_INTENTS
+        and prediction.confidence >= settings.intent_classifier_threshold
+    ):
+        return prediction
+    return None
+
+
+@dataclass
+class Evaluation:
+    examples: int
+    # agreement with the LLM's labels, over every example
+    accuracy: float
+    # the share of examples confident enough to skip the LLM, and the agreement on those
+    coverage: float
+    confident_accuracy: float
+    mean_microseconds: float
+
+
+def evaluate(
+    classifier: IntentClassifier,
+    examples: Iterable[Tuple[str, str]],
+    threshold: float,
+) -> Evaluation:
+    """
+    Compare the classifier's predictions against the intents the LLM detected
+    """
+    total = correct = confident = confident_correct = 0
+    elapsed = 0.0
+    for text, label in examples:
+        start = time.perf_counter()
+        prediction = classifier.predict(text)
+        elapsed += time.perf_counter() - start
+        total += 1
+        correct += prediction.intent == label
+        if prediction.intent in LOCAL_INTENTS and prediction.confidence >= threshold:
+            confident += 1
+            confident_correct += prediction.intent == label
+    return Evaluation(
+        examples=total,
+        accuracy=correct / total if total else 0.0,
+        coverage=confident / total if total else 0.0,
+        confident_accuracy=confident_correct / confident if confident else 0.0,
+        mean_microseconds=1e6 * elapsed / total if total else 0.0,
+    )
+
+
+def split(
+    examples: List[Tuple[str, str]], holdout: float, seed: int = 0
+) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """
+    Shuffle examples into (train, test) sets, holding out a fraction for testing
+    """
+    examples = list(examples)
+    random.Random(seed).shuffle(examples)
+    cut = int(len(examples) * (1 - holdout))
+    return examples[:cut], examples[cut:]
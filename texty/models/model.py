@@ -2,19 +2,23 @@ from dataclasses import dataclass
 from functools import lru_cache
 from pydantic import BaseModel
 from typing import (
+    AsyncIterator,
     Iterator,
     Literal,
     Protocol,
+    Tuple,
     Type,
     TypeVar,
 )
-from openai import AsyncOpenAI, OpenAI, Stream
+from openai import AsyncOpenAI, AsyncStream, OpenAI, Stream
 from openai.types.chat import ChatCompletion, ChatCompletionChunk
 import httpx
 import anthropic
 from anthropic.types import Message as AnthropicMessage
 
-from texty.settings import settings
+from texty.models.routing import AsyncBudgetedModel, BudgetedModel
+from texty.parsing import Partial, partial_models, partial_models_async
+from texty.settings import StageRoute, settings
 
 
 OPENAI_TEMPERATURE = 0.7
@@ -24,10 +28,40 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def get_client(model: Literal["small", "large"]) -> "LLMModel":
-    resolved = (
-        settings.llm_model_small if model == "small" else settings.llm_model_large
-    )
+def get_client(
+    model: str,
+    temperature: float = OPENAI_TEMPERATURE,
+    max_tokens: int = 4096,
+) -> "LLMModel":
+    """
+    A client for a model: "small" or "large" for the models in settings, or a provider qualified model name
+    """
+    provider, config = model_config(model, temperature, max_tokens)
+    if provider == "anthropic":
+        return AnthropicModel(config)
+    else:
+        return OpenAIModel(config)
+
+
+def get_async_client(
+    model: str,
+    temperature: float = OPENAI_TEMPERATURE,
+    max_tokens: int = 4096,
+) -> "AsyncLLMModel":
+    """
+    An asyncio client for a model, named as for get_client
+    """
+    provider, config = model_config(model, temperature, max_tokens)
+    if provider == "anthropic":
+        return AsyncAnthropicModel(config)
+    else:
+        return AsyncOpenAIModel(config)
+
+
+def model_config(
+    model: str, temperature: float, max_tokens: int
+) -> Tuple[str, "ModelConfig"]:
+    resolved = resolve_model(model)
 
     split = resolved.split("/", 1)
 
@@ -36,10 +70,47 @@ def get_client(model: Literal["small", "large"]) -> "LLMModel":
             f"Invalid model '{resolved}': Model must be qualified with a supported provider, for example anthropic/claude-sonnet-3.5"
         )
 
-    if split[0] == "anthropic":
-        return AnthropicModel(ModelConfig(model=split[1]))
-    else:
-        return OpenAIModel(ModelConfig(model=split[1]))
+    return split[0], ModelConfig(
+        model=split[1], temperature=temperature, max_tokens=max_tokens
+    )
+
+
+def resolve_model(model: str) -> str:
+    if model == "small":
+        return settings.llm_model_small
+    elif model == "large":
+        return settings.llm_model_large
+    return model
+
+
+def get_stage_client(
+    stage: Literal["intent", "plan", "respond", "summarize"]
+) -> "LLMModel":
+    """
+    The client for a stage of a turn, as routed in settings.llm_routes. Stages with a latency budget fall back to the small model when over it
+    """
+    route = settings.llm_routes.get(stage) or StageRoute()
+    client = get_client(route.model, route.temperature, route.max_tokens)
+    already_small = resolve_model(route.model) == settings.llm_model_small
+    if route.latency_budget is None or already_small:
+        return client
+    fallback = get_client("small", route.temperature, route.max_tokens)
+    return BudgetedModel(client, fallback, route.latency_budget)
+
+
+def get_async_stage_client(
+    stage: Literal["intent", "plan", "respond", "summarize"]
+) -> "AsyncLLMModel":
+    """
+    The asyncio client for a stage of a turn, routed as for get_stage_client
+    """
+    route = settings.llm_routes.get(stage) or StageRoute()
+    client = get_async_client(route.model, route.temperature, route.max_tokens)
+    already_small = resolve_model(route.model) == settings.llm_model_small
+    if route.latency_budget is None or already_small:
+        return client
+    fallback = get_async_client("small", route.temperature, route.max_tokens)
+    return AsyncBudgetedModel(client, fallback, route.latency_budget)
 
 
 T = TypeVar("T", bound=BaseModel)
@@ -49,12 +120,23 @@ class LLMModel(Protocol):
     def text(self, prompt: str) -> str: ...
     def stream(self, prompt: str) -> Iterator[str]: ...
     def json(self, prompt: str, schema: Type[T]) -> T: ...
+    def json_stream(self, prompt: str, schema: Type[T]) -> Iterator[Partial[T]]: ...
+
+
+class AsyncLLMModel(Protocol):
+    async def text(self, prompt: str) -> str: ...
+    def stream(self, prompt: str) -> AsyncIterator[str]: ...
+    async def json(self, prompt: str, schema: Type[T]) -> T: ...
+    def json_stream(
+        self, prompt: str, schema: Type[T]
+    ) -> AsyncIterator[Partial[T]]: ...
 
 
 @dataclass
 class ModelConfig:
     model: str
     temperature: float = 0.7
+    max_tokens: int = 4096
 
 
 class OpenAIModel(LLMModel):
@@ -67,6 +149,7 @@ class OpenAIModel(LLMModel):
             messages=[{"role": "user", "content": prompt}],
             model=self.config.model,
             temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
         )
         return response.choices[0].message.content
 
@@ -76,6 +159,7 @@ class OpenAIModel(LLMModel):
             stream=True,
             model=self.config.model,
             temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
         )
         for chunk in response:
             if chunk.choices[0].finish_reason is not None:
@@ -84,40 +168,82 @@ class OpenAIModel(LLMModel):
                 yield chunk.choices[0].delta.content
 
     def json(self, prompt: str, schema: Type[T]) -> T:
-        kwargs = {}
-        if settings.llama_cpp_json_schema:
-            kwargs["extra_body"] = {"json_schema": schema.model_json_schema()}
-        elif settings.openai_tool_mode:
-            kwargs["tools"] = [
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "respond",
-                        "parameters": schema.model_json_schema(),
-                    },
-                }
-            ]
-            kwargs["tool_choice"] = "required"
-        else:
-            kwargs["response_format"] = {"type": "json_object"}
-
         response: ChatCompletion = self.client.chat.completions.create(
             messages=[{"role": "user", "content": prompt}],
             model=self.config.model,
             temperature=self.config.temperature,
-            **kwargs,
+            max_tokens=self.config.max_tokens,
+            **openai_json_kwargs(schema),
         )
+        return openai_json_response(response, schema)
 
-        if settings.openai_tool_mode:
-            txt = response.choices[0].message.tool_calls[0].function.arguments
-        else:
-            txt = response.choices[0].message.content
+    def json_stream(self, prompt: str, schema: Type[T]) -> Iterator[Partial[T]]:
+        response: Stream[ChatCompletionChunk] = self.client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+            model=self.config.model,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
+            **openai_json_kwargs(schema),
+        )
+
+        def chunks() -> Iterator[str]:
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if settings.openai_tool_mode:
+                    if delta.tool_calls:
+                        yield delta.tool_calls[0].function.arguments or ""
+                elif delta.content:
+                    yield delta.content
+
+        yield from partial_models(chunks(), schema)
+
+
+def openai_json_kwargs(schema: Type[T]) -> dict:
+    kwargs = {}
+    if settings.llama_cpp_json_schema:
+        kwargs["extra_body"] = {"json_schema": schema.model_json_schema()}
+    elif settings.openai_tool_mode:
+        kwargs["tools"] = [
+            {
+                "type": "function",
+                "function": {
+                    "name": "respond",
+                    "parameters": schema.model_json_schema(),
+                },
+            }
+        ]
+        kwargs["tool_choice"] = "required"
+    else:
+        kwargs["response_format"] = {"type": "json_object"}
+    return kwargs
+
+
+def openai_json_response(response: ChatCompletion, schema: Type[T]) -> T:
+    if settings.openai_tool_mode:
+        txt = response.choices[0].message.tool_calls[0].function.arguments
+    else:
+        txt = response.choices[0].message.content
 
-        try:
-            return schema.model_validate_json(txt)
-        except Exception as e:
-            print("could not parse", txt)
-            raise
+    try:
+        return schema.model_validate_json(txt)
+    except Exception as e:
+        print("could not parse", txt)
+        raise
+
+
+def anthropic_json_tools(schema: Type[T]) -> dict:
+    return {
+        "tools": [
+            {
+                "input_schema": schema.model_json_schema(),
+                "name": "respond",
+            }
+        ],
+        "tool_choice": {"name": "respond", "type": "tool"},
+    }
 
 
 class AnthropicModel(LLMModel):
@@ -130,7 +256,7 @@ class AnthropicModel(LLMModel):
             messages=[{"content": prompt, "role": "user"}],
             model=self.config.model,
             temperature=self.config.temperature,
-            max_tokens=4096,
+            max_tokens=self.config.max_tokens,
         )
         return response.content[0].text
 
@@ -139,7 +265,7 @@ class AnthropicModel(LLMModel):
             messages=[{"content": prompt, "role": "user"}],
             model=self.config.model,
             temperature=self.config.temperature,
-            max_tokens=4096,
+            max_tokens=self.config.max_tokens,
         ) as stream:
             stream: anthropic.MessageStream = stream
             for text in stream.text_stream:
@@ -148,20 +274,161 @@ class AnthropicModel(LLMModel):
     def json(self, prompt: str, schema: Type[T]) -> T:
         response: AnthropicMessage = self.client.messages.create(
             messages=[{"content": prompt, "role": "user"}],
-            tools=[
-                {
-                    "input_schema": schema.model_json_schema(),
-                    "name": "respond",
-                }
-            ],
-            tool_choice={"name": "respond", "type": "tool"},
+            **anthropic_json_tools(schema),
             model=self.config.model,
             temperature=self.config.temperature,
-            max_tokens=4096,
+            max_tokens=self.config.max_tokens,
         )
 
         return schema.model_validate(response.content[0].input)
 
+    def json_stream(self, prompt: str, schema: Type[T]) -> Iterator[Partial[T]]:
+        with self.client.messages.stream(
+            messages=[{"content": prompt, "role": "user"}],
+            **anthropic_json_tools(schema),
+            model=self.config.model,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
+        ) as stream:
+            stream: anthropic.MessageStream = stream
+            yield from partial_models(
+                (
+                    event.delta.partial_json
+                    for event in stream
+                    if event.type == "content_block_delta"
+                    and event.delta.type == "input_json_delta"
+                ),
+                schema,
+            )
+
+
+class AsyncOpenAIModel(AsyncLLMModel):
+    def __init__(self, config: ModelConfig):
+        self.client = get_async_openai()
+        self.config = config
+
+    async def text(self, prompt: str) -> str:
+        response: ChatCompletion = await self.client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.config.model,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
+        )
+        return response.choices[0].message.content
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        response: AsyncStream[ChatCompletionChunk] = (
+            await self.client.chat.completions.create(
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                model=self.config.model,
+                temperature=self.config.temperature,
+                max_tokens=self.config.max_tokens,
+            )
+        )
+        async for chunk in response:
+            if chunk.choices[0].finish_reason is not None:
+                break
+            else:
+                yield chunk.choices[0].delta.content
+
+    async def json(self, prompt: str, schema: Type[T]) -> T:
+        response: ChatCompletion = await self.client.chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=self.config.model,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
+            **openai_json_kwargs(schema),
+        )
+        return openai_json_response(response, schema)
+
+    async def json_stream(
+        self, prompt: str, schema: Type[T]
+    ) -> AsyncIterator[Partial[T]]:
+        response: AsyncStream[ChatCompletionChunk] = (
+            await self.client.chat.completions.create(
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                model=self.config.model,
+                temperature=self.config.temperature,
+                max_tokens=self.config.max_tokens,
+                **openai_json_kwargs(schema),
+            )
+        )
+
+        async def chunks() -> AsyncIterator[str]:
+            async for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if settings.openai_tool_mode:
+                    if delta.tool_calls:
+                        yield delta.tool_calls[0].function.arguments or ""
+                elif delta.content:
+                    yield delta.content
+
+        async for partial in partial_models_async(chunks(), schema):
+            yield partial
+
+
+class AsyncAnthropicModel(AsyncLLMModel):
+    def __init__(self, config: ModelConfig):
+        self.client = get_async_anthropic()
+        self.config = config
+
+    async def text(self, prompt: str) -> str:
+        response: AnthropicMessage = await self.client.messages.create(
+            messages=[{"content": prompt, "role": "user"}],
+            model=self.config.model,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
+        )
+        return response.content[0].text
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        async with self.client.messages.stream(
+            messages=[{"content": prompt, "role": "user"}],
+            model=self.config.model,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
+        ) as stream:
+            stream: anthropic.AsyncMessageStream = stream
+            async for text in stream.text_stream:
+                yield text
+
+    async def json(self, prompt: str, schema: Type[T]) -> T:
+        response: AnthropicMessage = await self.client.messages.create(
+            messages=[{"content": prompt, "role": "user"}],
+            **anthropic_json_tools(schema),
+            model=self.config.model,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
+        )
+
+        return schema.model_validate(response.content[0].input)
+
+    async def json_stream(
+        self, prompt: str, schema: Type[T]
+    ) -> AsyncIterator[Partial[T]]:
+        async with self.client.messages.stream(
+            messages=[{"content": prompt, "role": "user"}],
+            **anthropic_json_tools(schema),
+            model=self.config.model,
+            temperature=self.config.temperature,
+            max_tokens=self.config.max_tokens,
+        ) as stream:
+            stream: anthropic.AsyncMessageStream = stream
+            async for partial in partial_models_async(
+                (
+                    event.delta.partial_json
+                    async for event in stream
+                    if event.type == "content_block_delta"
+                    and event.delta.type == "input_json_delta"
+                ),
+                schema,
+            ):
+                yield partial
+
 
 @lru_cache(maxsize=None)
 def get_openai() -> OpenAI:
@@ -176,3 +443,17 @@ def get_openai() -> OpenAI:
 @lru_cache(maxsize=None)
 def get_anthropic() -> anthropic.Client:
     return anthropic.Client(api_key=settings.anthropic_api_key)
+
+
+@lru_cache(maxsize=None)
+def get_async_openai() -> AsyncOpenAI:
+    return AsyncOpenAI(
+        api_key=settings.openai_api_key,
+        base_url=settings.openai_base_url,
+        http_client=httpx.AsyncClient(),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_async_anthropic() -> anthropic.AsyncAnthropic:
+    return anthropic.AsyncAnthropic(api_key=settings.anthropic_api_key)
@@ -0,0 +1,155 @@
+"""
+Latency budgets for the stages of a turn. A stage that runs over its budget is answered by the fallback model instead
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import logging
+import threading
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterator, Type, TypeVar
+
+from pydantic import BaseModel
+
+from texty.parsing import Partial
+from texty.settings import settings
+
+if TYPE_CHECKING:
+    from texty.models.model import AsyncLLMModel, LLMModel
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T", bound=BaseModel)
+R = TypeVar("R")
+
+# runs the calls being timed. A call over budget keeps its thread until it finishes, and its result is dropped
+budget_executor = ThreadPoolExecutor(
+    max_workers=settings.llm_budget_workers, thread_name_prefix="texty-llm"
+)
+
+_END = object()
+
+
+def within_budget(budget: float, call: Callable[..., R], *args) -> R:
+    """
+    `call(*args)` on the budget executor, raising TimeoutError if it runs for more than `budget` seconds. The budget
+    starts once the call does, so time spent queued behind other games' calls for a thread doesn't count against it
+    """
+    started = threading.Event()
+
+    def run() -> R:
+        started.set()
+        return call(*args)
+
+    future = budget_executor.submit(run)
+    started.wait()
+    return future.result(timeout=budget)
+
+
+class BudgetedModel:
+    """
+    Calls `model`, switching to `fallback` if it hasn't answered within `budget` seconds. Streams only need their first chunk, or partial model, within the budget
+    """
+
+    def __init__(self, model: "LLMModel", fallback: "LLMModel", budget: float):
+        self.model = model
+        self.fallback = fallback
+        self.budget = budget
+
+    def text(self, prompt: str) -> str:
+        try:
+            return within_budget(self.budget, self.model.text, prompt)
+        except TimeoutError:
+            logger.warning(f"text call over its {self.budget}s budget, falling back")
+            return self.fallback.text(prompt)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        chunks = iter(self.model.stream(prompt))
+        try:
+            chunk = within_budget(self.budget, next, chunks, _END)
+        except TimeoutError:
+            logger.warning(f"stream over its {self.budget}s budget, falling back")
+            yield from self.fallback.stream(prompt)
+            return
+        if chunk is _END:
+            return
+        yield chunk
+        yield from chunks
+
+    def json_stream(self, prompt: str, schema: Type[T]) -> Iterator[Partial[T]]:
+        partials = iter(self.model.json_stream(prompt, schema))
+        try:
+            partial = within_budget(self.budget, next, partials, _END)
+        except TimeoutError:
+            logger.warning(f"json stream over its {self.budget}s budget, falling back")
+            yield from self.fallback.json_stream(prompt, schema)
+            return
+        if partial is _END:
+            return
+        yield partial
+        yield from partials
+
+    def json(self, prompt: str, schema: Type[T]) -> T:
+        try:
+            return within_budget(self.budget, self.model.json, prompt, schema)
+        except TimeoutError:
+            logger.warning(f"json call over its {self.budget}s budget, falling back")
+            return self.fallback.json(prompt, schema)
+
+
+class AsyncBudgetedModel:
+    """
+    BudgetedModel for asyncio clients. A call over budget is cancelled, rather than left to finish
+    """
+
+    def __init__(
+        self, model: "AsyncLLMModel", fallback: "AsyncLLMModel", budget: float
+    ):
+        self.model = model
+        self.fallback = fallback
+        self.budget = budget
+
+    async def text(self, prompt: str) -> str:
+        try:
+            return await asyncio.wait_for(self.model.text(prompt), self.budget)
+        except asyncio.TimeoutError:
+            logger.warning(f"text call over its {self.budget}s budget, falling back")
+            return await self.fallback.text(prompt)
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        chunks = aiter(self.model.stream(prompt))
+        try:
+            chunk = await asyncio.wait_for(anext(chunks, _END), self.budget)
+        except asyncio.TimeoutError:
+            logger.warning(f"stream over its {self.budget}s budget, falling back")
+            async for chunk in self.fallback.stream(prompt):
+                yield chunk
+            return
+        if chunk is _END:
+            return
+        yield chunk
+        async for chunk in chunks:
+            yield chunk
+
+    async def json_stream(
+        self, prompt: str, schema: Type[T]
+    ) -> AsyncIterator[Partial[T]]:
+        partials = aiter(self.model.json_stream(prompt, schema))
+        try:
+            partial = await asyncio.wait_for(anext(partials, _END), self.budget)
+        except asyncio.TimeoutError:
+            logger.warning(f"json stream over its {self.budget}s budget, falling back")
+            async for partial in self.fallback.json_stream(prompt, schema):
+                yield partial
+            return
+        if partial is _END:
+            return
+        yield partial
+        async for partial in partials:
+            yield partial
+
+    async def json(self, prompt: str, schema: Type[T]) -> T:
+        try:
+            return await asyncio.wait_for(self.model.json(prompt, schema), self.budget)
+        except asyncio.TimeoutError:
+            logger.warning(f"json call over its {self.budget}s budget, falling back")
+            return await self.fallback.json(prompt, schema)
@@ -1,6 +1,294 @@
-from typing import List
+from dataclasses import dataclass, field
+import json
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    FrozenSet,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Type,
+    TypeVar,
+)
 import re
 
+from pydantic import BaseModel
+
+T = TypeVar("T", bound=BaseModel)
+
 
 def parse_bulleted_list(text: str) -> List[str]:
     return re.findall("(?:^|\n)- ([^\n]+)", text)
+
+
+class TrailerSplitter:
+    """
+    Splits a streamed response into the text before `marker`, passed through as it streams, and the trailer after it, collected whole.
+    Text that might be the start of the marker is held back until the next chunk shows whether it is
+    """
+
+    def __init__(self, marker: str):
+        self.marker = marker
+        self.pending = ""
+        self.trailer: Optional[str] = None
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a chunk of the response, returning the text before the marker that's now certain
+        """
+        if self.trailer is not None:
+            self.trailer += chunk
+            return ""
+        self.pending += chunk
+        found = self.pending.find(self.marker)
+        if found != -1:
+            text = self.pending[:found]
+            self.trailer = self.pending[found + len(self.marker) :]
+            self.pending = ""
+            return text
+        held = _partial_suffix(self.pending, self.marker)
+        text = self.pending[: len(self.pending) - held]
+        self.pending = self.pending[len(text) :]
+        return text
+
+    def close(self) -> str:
+        """
+        The text held back at the end of a response without a marker
+        """
+        text, self.pending = self.pending, ""
+        return text
+
+
+def _partial_suffix(text: str, marker: str) -> int:
+    # the length of the longest end of text that the marker starts with
+    for length in range(min(len(text), len(marker) - 1), 0, -1):
+        if marker.startswith(text[-length:]):
+            return length
+    return 0
+
+
+def extract_json_object(text: str) -> str:
+    """
+    The outermost {...} of text, dropping anything a model wrapped around its json, like code fences or closing tags
+    """
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError(f"no json object in {text!r}")
+    return text[start : end + 1]
+
+
+@dataclass
+class _Frame:
+    # "{" or "["
+    kind: str
+    # objects: the key being read, and where it started. Arrays: how many items have been read whole
+    key: Optional[str] = None
+    key_start: int = 0
+    expecting_key: bool = False
+    items: int = 0
+
+
+class PartialJsonParser:
+    """
+    Reads a json object as it streams in. Tracks which of the object's keys have been read whole, and how many items of a
+    list being read are whole, and can parse what has arrived so far by closing it off
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.stack: List[_Frame] = []
+        self.complete_keys: set[str] = set()
+        self.done = False
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.scalar_start: Optional[int] = None
+
+    def feed(self, chunk: str):
+        start = len(self.text)
+        self.text += chunk
+        for i in range(start, len(self.text)):
+            c = self.text[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif c == "\\":
+                    self.escaped = True
+                elif c == '"':
+                    self.in_string = False
+                    self._end_string(i)
+            elif c == '"':
+                self.in_string = True
+                self.string_start = i
+            elif c in "{[":
+                self.stack.append(_Frame(kind=c, expecting_key=c == "{"))
+            elif c in "}]":
+                self._end_scalar()
+                self.stack.pop()
+                if self.stack:
+                    self._child_done()
+                else:
+                    self.done = True
+            elif c == ":":
+                self.stack[-1].expecting_key = False
+            elif c == ",":
+                self._end_scalar()
+                if self.stack[-1].kind == "{":
+                    self.stack[-1].expecting_key = True
+            elif c.isspace():
+                self._end_scalar()
+            elif self.scalar_start is None:
+                self.scalar_start = i
+
+    def complete_items(self, key: str) -> Optional[int]:
+        """
+        How many items of the list at `key` have been read whole. None if the whole list has
+        """
+        if key in self.complete_keys:
+            return None
+        if (
+            len(self.stack) > 1
+            and self.stack[0].key == key
+            and self.stack[1].kind == "["
+        ):
+            return self.stack[1].items
+        return 0
+
+    def value(self) -> Any:
+        """
+        What has arrived so far, as json. Partly read strings are included, partly read keys and numbers are left out
+        """
+        if not self.stack and not self.done:
+            return None
+        text = self.text
+        top = self.stack[-1] if self.stack else None
+        if self.in_string:
+            if top is not None and top.kind == "{" and top.expecting_key:
+                text = text[: self.string_start]
+            else:
+                # drop a partial escape sequence, which can't be closed off
+                text = re.sub(r"\\(u[0-9a-fA-F]{0,3})?$", "", text) + '"'
+        elif self.scalar_start is not None:
+            text = text[: self.scalar_start]
+        text = text.rstrip()
+        if top is not None and top.kind == "{" and text.endswith(":"):
+            text = text[: top.key_start]
+        elif (
+            top is not None
+            and top.kind == "{"
+            and top.expecting_key
+            and text.endswith('"')
+        ):
+            text = text[: top.key_start]
+        text = text.rstrip().removesuffix(",")
+        closers = "".join(
+            "}" if frame.kind == "{" else "]" for frame in reversed(self.stack)
+        )
+        try:
+            return json.loads(text + closers)
+        except json.JSONDecodeError:
+            return None
+
+    def _end_string(self, end: int):
+        top = self.stack[-1] if self.stack else None
+        if top is not None and top.kind == "{" and top.expecting_key:
+            top.key = json.loads(self.text[self.string_start : end + 1])
+            top.key_start = self.string_start
+        elif top is not None:
+            self._child_done()
+
+    def _end_scalar(self):
+        if self.scalar_start is not None:
+            self.scalar_start = None
+            self._child_done()
+
+    def _child_done(self):
+        parent = self.stack[-1]
+        if parent.kind == "[":
+            parent.items += 1
+        elif len(self.stack) == 1 and parent.key is not None:
+            self.complete_keys.add(parent.key)
+
+
+@dataclass
+class Partial(Generic[T]):
+    """
+    A model read from a streaming response. `value` holds the fields received so far: partly received strings, the whole
+    items of a partly received list, and other fields once they're whole. Fields in `complete` won't change any more
+    """
+
+    value: T
+    complete: FrozenSet[str] = field(default_factory=frozenset)
+
+
+class PartialModelReader(Generic[T]):
+    """
+    Reads a streaming json response into partial models, as each chunk changes what's known. Shared by partial_models
+    and partial_models_async, which only differ in how they get the chunks
+    """
+
+    def __init__(self, schema: Type[T]):
+        self.schema = schema
+        self.parser = PartialJsonParser()
+        self.last_data: Any = None
+        self.last: Optional[Partial[T]] = None
+
+    def feed(self, chunk: str) -> Optional[Partial[T]]:
+        """The partial model after a chunk, if the chunk changed it"""
+        schema = self.schema
+        parser = self.parser
+        parser.feed(chunk)
+        data = parser.value()
+        if not isinstance(data, dict) or data == self.last_data:
+            return None
+        self.last_data = data
+        value = schema.model_construct()
+        for name, field_value in data.items():
+            if name not in schema.model_fields:
+                continue
+            if name not in parser.complete_keys:
+                if isinstance(field_value, list):
+                    field_value = field_value[: parser.complete_items(name)]
+                elif not isinstance(field_value, str):
+                    continue
+            schema.__pydantic_validator__.validate_assignment(value, name, field_value)
+        partial = Partial(value=value, complete=frozenset(parser.complete_keys))
+        if partial == self.last:
+            return None
+        self.last = partial
+        return partial
+
+    def close(self) -> Partial[T]:
+        """The whole model, validated, once the response is done"""
+        value = self.schema.model_validate_json(self.parser.text)
+        return Partial(value=value, complete=frozenset(self.schema.model_fields))
+
+
+def partial_models(chunks: Iterable[str], schema: Type[T]) -> Iterator[Partial[T]]:
+    """
+    Parse a streaming json response into partial models, as each chunk changes what's known. The last is the whole model, validated
+    """
+    reader = PartialModelReader(schema)
+    for chunk in chunks:
+        partial = reader.feed(chunk)
+        if partial is not None:
+            yield partial
+    yield reader.close()
+
+
+async def partial_models_async(
+    chunks: AsyncIterable[str], schema: Type[T]
+) -> AsyncIterator[Partial[T]]:
+    """
+    partial_models, for a response streamed by an asyncio client
+    """
+    reader = PartialModelReader(schema)
+    async for chunk in chunks:
+        partial = reader.feed(chunk)
+        if partial is not None:
+            yield partial
+    yield reader.close()
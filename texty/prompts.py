@@ -2,10 +2,12 @@ import json
 from typing import List, Literal, Optional
 import outlines
 from pydantic import BaseModel, Field, TypeAdapter
+from pydantic.json_schema import SkipJsonSchema
 
 from texty.gametypes import (
     Eventuality,
     GameElement,
+    IntentSource,
     LogItem,
     ProgressLog,
     RetiredGameElement,
@@ -194,6 +196,8 @@ class IntentDetection(BaseModel):
     thought: str
     intent: Intent
     early_response: Optional[str] = None
+    # not asked of the LLM
+    source: SkipJsonSchema[IntentSource] = "llm"
 
 
 @outlines.prompt
@@ -405,6 +409,189 @@ def prompt_respond_to_action(
     """
 
 
+# separates the narration of a single pass turn from its game update
+GAME_UPDATE_MARKER = "<game_update>"
+
+
+@outlines.prompt
+def prompt_plan_and_narrate(
+    player_action: str,
+    intent: str,
+    premise: str,
+    events_json: str,
+    retired_game_events_json: str,
+    active_game_events_json: str,
+    marker: str = GAME_UPDATE_MARKER,
+    preamble: str = game_system_prompt(),
+    desc_inspect: str = desc_intent_inspect(),
+    desc_act: str = desc_intent_act(),
+    desc_other: str = desc_intent_other(),
+    game_element_def: str = desc_game_element_python(),
+):
+    """
+    {{ preamble }}
+
+    ## Instructions
+
+    Given the players actions, play out what has occurred to the world and its actors, in two parts.
+
+    First, write the scene for the player. This is the real writing for the game, your response is the player's only interaction with the world. None of the game's internal state is revealed to the player, you are the voice of the story communicating it into an immersive narrative adventure.
+
+    Guidelines
+    - Through storytelling, guide the player towards interactions that evolve towards the game's potential future states
+    - This is a text adventure game. End your responses with leading indicators, such as cliff-hangers, or prompts for action, or curious questions about things to look at closer
+    - If the player is asking about the game in general, prefix your response with "Out of Character: ", and give a reasonable response
+    - Pay close attention to the previous "Game" answers: build responses based on previous concepts, and avoid being repetitive
+
+    Then, on a new line, write {{ marker }} followed by the update to the `GameElements` of the story that the scene played out, so the game stays consistent over player actions. A game element has the following shape:
+
+    ```
+    {{ game_element_def }}
+    ```
+
+    The update is a json object with the following format:
+
+    ```
+    {
+    // a short note of what the scene played out
+    "response_plan": str,
+    // a list of updates to the game, can include any number of events of each of the following types
+    "events": [
+    // a new game element may be added by specifying a game element with all required fields
+    {
+      "type": "add_game_element",
+      "element_id": str,
+      "name": str,
+      "element_type": str,
+      "past": List[str],
+      "present": List[str],
+      "future": List[str]
+    },
+    // removes a game element with a reason
+    {
+      "type": "retire_game_element",
+      "element_id": str,
+      "retired_reason": str
+    },
+    // updates and existing game element, targetted by ID. For small changes, strings can be added to the fields, or for larger rewrites, the entire list can be replaced
+    {
+      "type": "update_game_element",
+      "element_id": str,
+      "add": {
+        "past": Optional[List[str]],
+        "present": Optional[List[str]],
+        "future": Optional[List[str]]
+      },
+      "replace": {
+        "past": Optional[List[str]],
+        "present": Optional[List[str]],
+        "future": Optional[List[str]]
+      }
+    },
+    // if the game has reached a conclusion, describe why (is_success is whether the player "won" or "lost"). Game is over after this event is fired
+    {
+      "type": "end_game",
+      "is_success": bool,
+      "description": str
+    }
+    ],
+    // finally, a summary of the above set of changes, to be used as a title for this step of the game
+    "summary": str
+    }
+    ```
+
+    Tips:
+    - There are only 4 legal types of events: "add_game_element", "retire_game_element", "update_game_element", and "end_game".
+    - Remember to make the game engaging. Don't give things away for free, but lead the player in.
+    - Give NPCs inner life. They have their own perspectives and motivations. Make their stories consistent and interesting.
+    - Mix in dialogue where appropriate.
+    - The game ONLY controls external elements. The game NEVER controls the movement, speech, or actions of the player character THIS IS COMPLETELY OFF LIMITS.
+    - The game should proceed with small logical steps. If the players actions on the outside world disagree with the GameElements logical consistency, the game should respond with a non-action.
+    - Minimal game changes should occur when the player inspects. Use this opportunity to instead plan future motivations.
+    - Do not add any events if they are not needed. Absolutely avoid superfluous events.
+
+    ## Context
+
+    The premise of the current game is:
+    '''
+    {{premise}}
+    '''
+
+    The following is a list of the current active GameElements:
+    ```
+    {{active_game_events_json}}
+    ```
+
+    {% if retired_game_events_json %}
+    The following is list of retired GameElements:
+    ```
+    {{retired_game_events_json}}
+    ```
+
+    {% endif %}
+    {% if events_json %}
+    The following is a list of player/game interactions. This is the only data that the player can see:
+    ```
+    {{events_json}}
+    ```
+
+    {% endif %}
+    The player has just executed the game with this input:
+    ```
+    {{player_action}}
+    ```
+
+    The player's input has been classified as having an intent of "{{intent}}". The following is instructions for how you should respond to this type of input
+
+    {% if intent == "inspect" %}
+    {{desc_inspect}}
+    {% elif intent == "act" %}
+    {{desc_act}}
+    {% elif intent == "other" %}
+    {{desc_other}}
+    {% endif %}
+
+    Now, write the scene for the player, then {{ marker }} and the json update
+    """
+
+
+@outlines.prompt
+def prompt_summarize_history(
+    premise: str,
+    summary: str,
+    events_json: str,
+    preamble: str = game_system_prompt(),
+):
+    """
+    {{preamble}}
+
+    ## Context
+
+    The premise of the game is:
+    '''
+    {{premise}}
+    '''
+
+    {% if summary %}
+    This is the summary of the story so far:
+    '''
+    {{summary}}
+    '''
+
+    {% endif %}
+    The following player/game interactions happened next:
+    ```
+    {{events_json}}
+    ```
+
+    ## Instructions
+
+    You are now writing the story so far, which will be read in place of these interactions from now on. Rewrite the summary to take in the interactions, in at most 300 words of plain prose. Keep what's needed to continue the story consistently: what the player did and found out, the people and places they met and how they left them, promises, threats and open questions. Leave out descriptions that no longer matter, and keep the most recent interactions in the most detail.
+
+    Now, respond with only the summary:
+    """
+
+
 def dump_time_node(
     time_node: TimeNode,
     id: bool = False,
@@ -425,9 +612,14 @@ LogItemList = TypeAdapter(List[LogItem])
 
 
 def dump_events(time_node: TimeNode, recent_events: List[LogItem] = []) -> str:
-    response = "\n".join(
-        [event.model_dump_json(indent=2) for event in time_node.event_log]
-    )
+    summary = time_node.history_summary
+    events = time_node.event_log[summary.through :] if summary else time_node.event_log
+    response = "\n".join([event.model_dump_json(indent=2) for event in events])
+    if summary:
+        response = (
+            f"// --- THE STORY SO FAR ---\n{summary.text}\n// --- SINCE THEN ---\n"
+            + response
+        )
     if len(recent_events):
         response += "\n// --- RECENT ---\n"
         response += "\n".join(
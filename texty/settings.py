@@ -1,10 +1,34 @@
-from typing import Optional
+from typing import Dict, Literal, Optional
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 
+class StageRoute(BaseModel):
+    # "small", "large" (llm_model_small / llm_model_large), or a provider qualified model like anthropic/claude-3-haiku
+    model: str = "large"
+    temperature: float = 0.7
+    max_tokens: int = 4096
+    # seconds the stage may take (until the first chunk, when streaming) before it is retried on llm_model_small.
+    # None waits as long as it takes
+    latency_budget: Optional[float] = None
+
+
 class Settings(BaseSettings):
+    # where games are stored: "sqlite" in texty.db, or "memory" in process, lost on exit (for load tests and evals)
+    storage_backend: Literal["sqlite", "memory"] = "sqlite"
     llm_model_large: str = "openai/gpt-4o"
     llm_model_small: str = "openai/gpt-3.5-turbo"
+    # the model of each stage of a turn: detecting the intent, planning the game update, narrating the response,
+    # and summarizing the event log's older turns
+    llm_routes: Dict[Literal["intent", "plan", "respond", "summarize"], StageRoute] = {
+        "intent": StageRoute(model="small", temperature=0.2, max_tokens=512),
+        "plan": StageRoute(model="large", latency_budget=20.0),
+        "respond": StageRoute(model="large", latency_budget=8.0),
+        "summarize": StageRoute(model="small", temperature=0.2, max_tokens=1024),
+    }
+    # threads running the calls of stages with a latency_budget, shared by every game. A call's budget starts once
+    # it has a thread, so past this many calls at once, calls wait their turn rather than falling back
+    llm_budget_workers: int = 32
     anthropic_api_key: Optional[str] = None
     openai_api_key: Optional[str] = None
     openai_base_url: Optional[str] = None
@@ -13,13 +37,68 @@ class Settings(BaseSettings):
     # if true, use json mode instead of a tool call
     openai_json_mode: Optional[bool] = None
     openai_tool_mode: Optional[bool] = None
-
+    # if true, start planning a turn with a guessed intent while the intent is detected. A wrong guess costs
+    # a discarded planning call
+    speculative_planning: bool = False
+    # if true, narrate and plan a turn in one call: the narration streams first, followed by the game update
+    single_pass_turns: bool = False
+    # if true, stream the planning call, starting the narration as soon as the plan's response_plan is complete
+    stream_planning: bool = False
+    # threads running model calls alongside another stage of a turn (speculative plans, the rest of a streamed plan),
+    # shared by every game. Past this many at once, they wait for a thread
+    stage_workers: int = 4
+    # if true, a turn's update is applied and saved in the background once its narration has streamed, so the next
+    # command can be typed sooner. The next step on the game waits for it
+    background_commit: bool = True
+    # threads applying and saving turns, shared by every game
+    commit_workers: int = 4
+    # send the model the last history_verbatim_turns turns of the event log as they are, and a rolling summary of
+    # the turns before them. The summary is brought up to date once history_fold_turns turns have built up past
+    # the verbatim ones. Needs background_commit, so that summarizing doesn't hold up turns: without it, every turn
+    # is sent verbatim
+    summarize_history: bool = True
+    history_verbatim_turns: int = 12
+    history_fold_turns: int = 8
+    # classify obvious player inputs locally, only asking the LLM when the classifier's confidence is below
+    # intent_classifier_threshold. Trained weights are read from intent_model_path. Without them, keywords alone are
+    # never confident enough, and every input goes to the LLM
+    intent_classifier: bool = True
+    intent_classifier_threshold: float = 0.8
+    intent_model_path: str = "intent_model.json"
+    # "delta" stores each time node as a diff against its parent, with a full
+    # checkpoint every node_checkpoint_interval nodes. "full" stores every node whole
+    node_storage: Literal["full", "delta"] = "delta"
+    node_checkpoint_interval: int = 20
+    # compression of stored node json. "zlib-dict" primes zlib with a dictionary built from the shipped seeds
+    node_compression: Literal["none", "zlib", "zlib-dict"] = "zlib"
+    # memory budget of the in-process time node cache
+    node_cache_bytes: int = 64 * 1024 * 1024
+    # read connections to texty.db, and how many seconds to wait for a free one
+    db_pool_size: int = 5
+    db_pool_timeout: float = 10.0
+    # threads serving the async database api, each with its own connection
+    db_async_workers: int = 4
+    # "hash" spreads games over db_shard_count database files, "scenario" gives every game a file of its own,
+    # so that different games don't wait on each other's writes. Shards, and a catalog.db listing the games,
+    # live in db_shard_dir. "none" keeps everything in texty.db
+    db_sharding: Literal["none", "hash", "scenario"] = "none"
+    db_shard_count: int = 16
+    db_shard_dir: str = "texty-shards"
+    # shard files kept open at once, each with a writer thread and its connections. The least recently used
+    # are closed past this, which matters with "scenario" sharding, where every game has a file
+    db_open_shards: int = 64
+    # background compaction of branches no active game can reach. Off by default: it deletes the abandoned
+    # branches that /jump and /redo go back to, beyond the db_keep_branches most recent of each game, for
+    # good. Runs every db_compaction_interval seconds (0 disables it), spending at most
+    # db_compaction_time_budget seconds per run
+    db_compaction_interval: float = 0
+    db_compaction_time_budget: float = 1.0
+    db_keep_branches: int = 3
 
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
         extra = "ignore"
-        
 
 
 settings = Settings()
@@ -0,0 +1,369 @@
+"""
+Where games are stored. Game, the cli and the web ui go through a StorageBackend, chosen by settings.storage_backend:
+"sqlite" persists games in texty.db (see texty.database), "memory" keeps them in process, for load tests and evals
+that shouldn't touch the disk
+"""
+
+from concurrent.futures import Future
+import datetime
+from functools import lru_cache
+import re
+import threading
+from typing import Dict, List, Optional, Protocol
+
+from texty import database
+from texty.database import GameListing, NodeListing, SearchResult
+from texty.gametypes import LogItem, TimeNode
+from texty.settings import settings
+
+
+def get_storage() -> "StorageBackend":
+    """
+    The storage backend chosen in settings. Every caller shares the same instance
+    """
+    return _storage(settings.storage_backend)
+
+
+@lru_cache(maxsize=None)
+def _storage(backend: str) -> "StorageBackend":
+    if backend == "memory":
+        return MemoryBackend()
+    elif backend == "sqlite":
+        return SQLiteBackend()
+    raise ValueError(f"Invalid storage backend '{backend}': must be sqlite or memory")
+
+
+class StorageBackend(Protocol):
+    """
+    Stores the time nodes of games, and which node each game is at. Writes return a future, that resolves once the write is durable. Nodes returned may be shared between callers, and must not be mutated.
+    The _async methods are for asyncio game loops, and don't block the event loop
+    """
+
+    def init(self) -> None: ...
+    def start_background_compaction(self) -> None: ...
+    def get_active_node(self, scenario_id: str) -> Optional[TimeNode]: ...
+    def set_active_node(
+        self, scenario_id: str, node_id: str, now: Optional[datetime.datetime] = None
+    ) -> "Future[None]": ...
+    def get_node(
+        self, id: str, scenario_id: Optional[str] = None
+    ) -> Optional[TimeNode]: ...
+    def insert_time_node(
+        self,
+        time_node: TimeNode,
+        now: Optional[datetime.datetime] = None,
+        parent: Optional[TimeNode] = None,
+    ) -> "Future[None]": ...
+    def list_games(
+        self, limit: int = 50, after: Optional[GameListing] = None
+    ) -> List[GameListing]: ...
+    def delete_game(self, scenario_id: str) -> "Future[None]": ...
+    def list_children(
+        self, node_id: str, scenario_id: Optional[str] = None
+    ) -> List[NodeListing]: ...
+    def get_event_log(
+        self, node_id: str, scenario_id: Optional[str] = None
+    ) -> List[LogItem]: ...
+    def list_all_time_nodes(self, scenario_id: str) -> List[TimeNode]: ...
+    def search(
+        self, scenario_id: str, query: str, limit: int = 20
+    ) -> List[SearchResult]: ...
+    async def get_active_node_async(self, scenario_id: str) -> Optional[TimeNode]: ...
+    async def set_active_node_async(
+        self, scenario_id: str, node_id: str, now: Optional[datetime.datetime] = None
+    ) -> None: ...
+    async def get_node_async(
+        self, id: str, scenario_id: Optional[str] = None
+    ) -> Optional[TimeNode]: ...
+    async def list_children_async(
+        self, node_id: str, scenario_id: Optional[str] = None
+    ) -> List[NodeListing]: ...
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Games stored in sqlite, through the texty.database module (and whichever database it has open)
+    """
+
+    def init(self) -> None:
+        database.init_db()
+
+    def start_background_compaction(self) -> None:
+        database.start_background_compaction()
+
+    def get_active_node(self, scenario_id: str) -> Optional[TimeNode]:
+        return database.get_active_node(scenario_id)
+
+    def set_active_node(
+        self, scenario_id: str, node_id: str, now: Optional[datetime.datetime] = None
+    ) -> "Future[None]":
+        return database.set_active_node(scenario_id, node_id, now=now)
+
+    def get_node(
+        self, id: str, scenario_id: Optional[str] = None
+    ) -> Optional[TimeNode]:
+        return database.get_node(id, scenario_id)
+
+    def insert_time_node(
+        self,
+        time_node: TimeNode,
+        now: Optional[datetime.datetime] = None,
+        parent: Optional[TimeNode] = None,
+    ) -> "Future[None]":
+        return database.insert_time_node(time_node, now=now, parent=parent)
+
+    def list_games(
+        self, limit: int = 50, after: Optional[GameListing] = None
+    ) -> List[GameListing]:
+        return database.list_games(limit, after)
+
+    def delete_game(self, scenario_id: str) -> "Future[None]":
+        return database.delete_game(scenario_id)
+
+    def list_children(
+        self, node_id: str, scenario_id: Optional[str] = None
+    ) -> List[NodeListing]:
+        return database.list_children(node_id, scenario_id)
+
+    def get_event_log(
+        self, node_id: str, scenario_id: Optional[str] = None
+    ) -> List[LogItem]:
+        return database.get_event_log(node_id, scenario_id)
+
+    def list_all_time_nodes(self, scenario_id: str) -> List[TimeNode]:
+        return database.list_all_time_nodes(scenario_id)
+
+    def search(
+        self, scenario_id: str, query: str, limit: int = 20
+    ) -> List[SearchResult]:
+        return database.search(scenario_id, query, limit)
+
+    async def get_active_node_async(self, scenario_id: str) -> Optional[TimeNode]:
+        return await database.get_active_node_async(scenario_id)
+
+    async def set_active_node_async(
+        self, scenario_id: str, node_id: str, now: Optional[datetime.datetime] = None
+    ) -> None:
+        await database.set_active_node_async(scenario_id, node_id, now=now)
+
+    async def get_node_async(
+        self, id: str, scenario_id: Optional[str] = None
+    ) -> Optional[TimeNode]:
+        return await database.get_node_async(id, scenario_id)
+
+    async def list_children_async(
+        self, node_id: str, scenario_id: Optional[str] = None
+    ) -> List[NodeListing]:
+        return await database.list_children_async(node_id, scenario_id)
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Games kept in dicts, and lost when the process exits. Writes complete immediately
+    """
+
+    def __init__(self):
+        self.nodes: Dict[str, TimeNode] = {}
+        self.updated_at: Dict[str, datetime.datetime] = {}
+        self.children: Dict[str, List[str]] = {}
+        self.active: Dict[str, GameListing] = {}
+        # (node_id, source, label, timestep, text) of each game, in the order nodes were inserted
+        self.search_entries: Dict[str, List[tuple[str, str, str, int, str]]] = {}
+        self.lock = threading.Lock()
+
+    def init(self) -> None:
+        pass
+
+    def start_background_compaction(self) -> None:
+        pass
+
+    def get_active_node(self, scenario_id: str) -> Optional[TimeNode]:
+        listing = self.active.get(scenario_id)
+        return self.nodes.get(listing.node_id) if listing else None
+
+    def set_active_node(
+        self, scenario_id: str, node_id: str, now: Optional[datetime.datetime] = None
+    ) -> "Future[None]":
+        with self.lock:
+            node = self.nodes.get(node_id)
+            if node is not None:
+                self._set_active(scenario_id, node, now)
+        return _done()
+
+    def get_node(
+        self, id: str, scenario_id: Optional[str] = None
+    ) -> Optional[TimeNode]:
+        return self.nodes.get(id)
+
+    def insert_time_node(
+        self,
+        time_node: TimeNode,
+        now: Optional[datetime.datetime] = None,
+        parent: Optional[TimeNode] = None,
+    ) -> "Future[None]":
+        parent_id = time_node.previous[-1] if time_node.previous else None
+        with self.lock:
+            parent = self.nodes.get(parent_id) if parent_id is not None else None
+            entries = database.new_search_text(
+                time_node, parent, database.new_log_items(time_node, parent)
+            )
+            scenario_id = time_node.scenario_id()
+            self.search_entries.setdefault(scenario_id, []).extend(
+                (time_node.id, *entry) for entry in entries
+            )
+            if time_node.id not in self.nodes and parent_id is not None:
+                self.children.setdefault(parent_id, []).append(time_node.id)
+            self.nodes[time_node.id] = time_node
+            self.updated_at[time_node.id] = _now(now)
+            self._set_active(scenario_id, time_node, now)
+        return _done()
+
+    def list_games(
+        self, limit: int = 50, after: Optional[GameListing] = None
+    ) -> List[GameListing]:
+        games = sorted(
+            self.active.values(),
+            key=lambda game: (game.last_updated, game.scenario_id),
+            reverse=True,
+        )
+        if after is not None:
+            games = [
+                game
+                for game in games
+                if (game.last_updated, game.scenario_id)
+                < (after.last_updated, after.scenario_id)
+            ]
+        return games[:limit]
+
+    def delete_game(self, scenario_id: str) -> "Future[None]":
+        with self.lock:
+            self.active.pop(scenario_id, None)
+            self.search_entries.pop(scenario_id, None)
+            for id in [
+                id
+                for id, node in self.nodes.items()
+                if node.scenario_id() == scenario_id
+            ]:
+                del self.nodes[id]
+                del self.updated_at[id]
+                self.children.pop(id, None)
+            self.children.pop(scenario_id, None)
+        return _done()
+
+    def list_children(
+        self, node_id: str, scenario_id: Optional[str] = None
+    ) -> List[NodeListing]:
+        # most recently written first, the latest insert winning ties
+        children = sorted(
+            reversed(self.children.get(node_id, [])),
+            key=lambda id: self.updated_at[id],
+            reverse=True,
+        )
+        return [
+            NodeListing(
+                node_id=id,
+                parent_id=node_id,
+                timestep=self.nodes[id].timestep,
+                summary=self.nodes[id].summary,
+                updated_at=self.updated_at[id],
+            )
+            for id in children
+        ]
+
+    def get_event_log(
+        self, node_id: str, scenario_id: Optional[str] = None
+    ) -> List[LogItem]:
+        node = self.nodes.get(node_id)
+        return list(node.event_log) if node else []
+
+    def list_all_time_nodes(self, scenario_id: str) -> List[TimeNode]:
+        return [
+            node for node in self.nodes.values() if node.scenario_id() == scenario_id
+        ]
+
+    def search(
+        self, scenario_id: str, query: str, limit: int = 20
+    ) -> List[SearchResult]:
+        """
+        A linear scan, with the same query syntax as the sqlite search. Results are ranked by how often the query's words match, rather than by bm25
+        """
+        patterns = [
+            re.compile(r"\b" + r"\W+".join(words) + r"\b", re.I)
+            for words in map(_words, database.search_terms(query))
+            if words
+        ]
+        if not patterns:
+            return []
+        results = []
+        for node_id, source, label, timestep, text in self.search_entries.get(
+            scenario_id, []
+        ):
+            counts = [len(pattern.findall(text)) for pattern in patterns]
+            if all(counts):
+                snippet = text
+                for pattern in patterns:
+                    snippet = pattern.sub(lambda m: f"[{m.group(0)}]", snippet)
+                results.append(
+                    (
+                        sum(counts),
+                        SearchResult(
+                            node_id=node_id,
+                            timestep=timestep,
+                            source=source,
+                            label=label,
+                            text=text,
+                            snippet=snippet,
+                        ),
+                    )
+                )
+        results.sort(key=lambda result: result[0], reverse=True)
+        return [result for _, result in results[:limit]]
+
+    # nothing here waits on i/o, so the async reads and writes are the blocking ones
+
+    async def get_active_node_async(self, scenario_id: str) -> Optional[TimeNode]:
+        return self.get_active_node(scenario_id)
+
+    async def set_active_node_async(
+        self, scenario_id: str, node_id: str, now: Optional[datetime.datetime] = None
+    ) -> None:
+        self.set_active_node(scenario_id, node_id, now=now)
+
+    async def get_node_async(
+        self, id: str, scenario_id: Optional[str] = None
+    ) -> Optional[TimeNode]:
+        return self.get_node(id, scenario_id)
+
+    async def list_children_async(
+        self, node_id: str, scenario_id: Optional[str] = None
+    ) -> List[NodeListing]:
+        return self.list_children(node_id, scenario_id)
+
+    def _set_active(
+        self,
+        scenario_id: str,
+        node: TimeNode,
+        now: Optional[datetime.datetime],
+    ):
+        self.active[scenario_id] = GameListing(
+            scenario_id=scenario_id,
+            node_id=node.id,
+            timestep=node.timestep,
+            summary=node.summary,
+            last_updated=_now(now),
+        )
+
+
+def _words(term: str) -> List[str]:
+    # split like fts5's default tokenizer, which ignores punctuation
+    return re.findall(r"\w+", term)
+
+
+def _now(now: Optional[datetime.datetime] = None) -> datetime.datetime:
+    return now or datetime.datetime.now(datetime.timezone.utc)
+
+
+def _done() -> "Future[None]":
+    future: Future = Future()
+    future.set_result(None)
+    return future
@@ -0,0 +1,205 @@
+import asyncio
+from typing import AsyncIterator, List, Type
+
+import pytest
+from pydantic import BaseModel
+
+from texty import async_game
+from texty.async_game import AsyncGame, advance_time_async
+from texty.gametypes import AddGameElement, GameElementUpdate, TimeNode
+from texty.parsing import Partial, partial_models_async
+from texty.prompts import GAME_UPDATE_MARKER, IntentDetection
+from texty.settings import settings
+from texty.storage import StorageBackend
+from texty.test_database import seed_node
+from texty.test_storage import storage  # noqa: F401
+
+
+class FakeAsyncModel:
+    """
+    Detects every input as an "act", plans an update with no events, and narrates "It rains.", or `narration` if given
+    """
+
+    def __init__(self, narration: List[str] = ["It ", "rains."]):
+        self.narration = narration
+        self.prompts: List[str] = []
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        self.prompts.append(prompt)
+        for chunk in self.narration:
+            yield chunk
+
+    async def json(self, prompt: str, schema: Type[BaseModel]) -> BaseModel:
+        self.prompts.append(prompt)
+        if schema is IntentDetection:
+            return IntentDetection(thought="", intent="act")
+        return GameElementUpdate(response_plan="rain", events=[], summary="It rains")
+
+
+@pytest.fixture
+def turns(monkeypatch):
+    monkeypatch.setattr(settings, "intent_classifier", False)
+    monkeypatch.setattr(settings, "speculative_planning", False)
+    monkeypatch.setattr(settings, "single_pass_turns", False)
+
+
+def use_model(monkeypatch, model) -> None:
+    monkeypatch.setattr(async_game, "get_async_stage_client", lambda stage: model)
+
+
+async def turn(player_action: str, node: TimeNode) -> tuple[list, TimeNode]:
+    events = [event async for event in advance_time_async(player_action, node)]
+    return events, events[-1].updated_time_node
+
+
+@pytest.mark.parametrize("background_commit", [True, False])
+def test_async_game_steps_and_navigates(
+    turns, monkeypatch, storage: StorageBackend, background_commit
+):
+    monkeypatch.setattr(settings, "background_commit", background_commit)
+    use_model(monkeypatch, FakeAsyncModel())
+    g = AsyncGame("scenario", storage)
+
+    async def run():
+        [event async for event in g.start_if_not_started(seed=seed_node())]
+        start = await g.current_node()
+        [event async for event in g.step("open the door")]
+        opened = await g.current_node()
+        assert opened.previous[-1] == start.id
+        assert opened.event_log[-1].text == "It rains."
+
+        assert await g.undo()
+        assert (await g.current_node()).id == start.id
+        [event async for event in g.step("close the door")]
+        closed = await g.current_node()
+        # jumping right after a turn waits for the turn's commit
+        assert await g.jump(start.id)
+        assert [child.node_id for child in await g.children()] == [
+            closed.id,
+            opened.id,
+        ]
+        assert await g.redo()
+        assert (await g.current_node()).id == closed.id
+        assert not await g.jump("missing")
+        return closed
+
+    closed = asyncio.run(run())
+    assert storage.get_active_node("scenario").id == closed.id
+
+
+def test_single_pass_turn(turns, monkeypatch):
+    monkeypatch.setattr(settings, "single_pass_turns", True)
+    update = GameElementUpdate(response_plan="fog", events=[], summary="Fog")
+    model = FakeAsyncModel(
+        ["Fog rolls ", "in.<game_", f"update>{update.model_dump_json()}"]
+    )
+    use_model(monkeypatch, model)
+
+    events, node = asyncio.run(turn("wait", seed_node()))
+    assert "".join(e.delta for e in events if hasattr(e, "delta")) == "Fog rolls in."
+    assert node.summary == "Fog"
+    assert node.event_log[-1].text == "Fog rolls in."
+    # narrated and planned in one call, after detecting the intent
+    assert len(model.prompts) == 2
+    assert GAME_UPDATE_MARKER in model.prompts[-1]
+
+
+def test_single_pass_turn_replans_without_an_update(turns, monkeypatch):
+    monkeypatch.setattr(settings, "single_pass_turns", True)
+    model = FakeAsyncModel(["Fog rolls in."])
+    use_model(monkeypatch, model)
+
+    events, node = asyncio.run(turn("wait", seed_node()))
+    assert node.summary == "It rains"
+    assert node.event_log[-1].text == "Fog rolls in."
+    assert len(model.prompts) == 3
+
+
+class FailingIntentModel(FakeAsyncModel):
+    """
+    Fails to detect the intent, while a speculative plan never finishes
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.plan_cancelled = False
+
+    async def json(self, prompt: str, schema: Type[BaseModel]) -> BaseModel:
+        if schema is IntentDetection:
+            # the speculative plan has started by the time this fails
+            await asyncio.sleep(0.01)
+            raise RuntimeError("intent detection failed")
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.plan_cancelled = True
+            raise
+        raise AssertionError("the speculative plan should have been cancelled")
+
+
+def test_speculation_is_cancelled_when_the_turn_fails(turns, monkeypatch):
+    monkeypatch.setattr(settings, "speculative_planning", True)
+    model = FailingIntentModel()
+    use_model(monkeypatch, model)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await turn("open the door", seed_node())
+        # let the cancellation reach the plan, before asyncio.run cancels whatever's left
+        await asyncio.sleep(0)
+        assert model.plan_cancelled
+
+    asyncio.run(run())
+
+
+class PlanStreamingAsyncModel(FakeAsyncModel):
+    """
+    Streams a plan that adds a clue, `cut` characters short of its end
+    """
+
+    def __init__(self, cut: int = 0):
+        super().__init__()
+        self.cut = cut
+        self.plans_streamed = 0
+
+    def json_stream(
+        self, prompt: str, schema: Type[BaseModel]
+    ) -> AsyncIterator[Partial[BaseModel]]:
+        self.prompts.append(prompt)
+        self.plans_streamed += 1
+        doc = GameElementUpdate(
+            response_plan="a clue turns up",
+            events=[
+                AddGameElement(
+                    type="add_game_element",
+                    element_id="clue",
+                    name="Clue",
+                    element_type="object",
+                )
+            ],
+            summary="A clue",
+        ).model_dump_json()
+        doc = doc[: len(doc) - self.cut]
+
+        async def chunks() -> AsyncIterator[str]:
+            for i in range(0, len(doc), 8):
+                yield doc[i : i + 8]
+
+        return partial_models_async(chunks(), schema)
+
+
+@pytest.mark.parametrize("cut, summary", [(0, "A clue"), (4, seed_node().summary)])
+def test_streamed_plan_turn(turns, monkeypatch, cut, summary):
+    monkeypatch.setattr(settings, "stream_planning", True)
+    model = PlanStreamingAsyncModel(cut)
+    use_model(monkeypatch, model)
+
+    events, node = asyncio.run(turn("search the room", seed_node()))
+    assert "planned-response" in [getattr(e, "status", None) for e in events]
+    assert node.event_log[-1].text == "It rains."
+    # planned by the stream alone, and narrated from its response_plan
+    assert model.plans_streamed == 1 and len(model.prompts) == 3
+    assert "a clue turns up" in model.prompts[-1]
+    # cut short in its summary, the turn keeps the event that was whole, and the last turn's summary
+    assert [e.element_id for e in node.game_elements].count("clue") == 1
+    assert node.summary == summary
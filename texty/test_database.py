@@ -0,0 +1,778 @@
+import asyncio
+import datetime
+import io
+import json
+import sqlite3
+import threading
+import uuid
+from typing import List, Optional
+
+import pytest
+
+from texty import database
+from texty.gametypes import (
+    AddGameElement,
+    GameElement,
+    GameElementUpdate,
+    HistorySummary,
+    LogItem,
+    PastPresentFuture,
+    TimeNode,
+    UpdateGameElement,
+)
+from texty.settings import settings
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "texty.db")
+    database.open_database(path)
+    database.init_db()
+    yield path
+    database.close_database()
+
+
+def seed_node(scenario_id: str = "scenario") -> TimeNode:
+    return TimeNode(
+        id=scenario_id,
+        premise="A detective story",
+        game_elements=[
+            GameElement(
+                element_id="zantar",
+                name="Zantar",
+                element_type="character",
+                present=["Zantar is a junior detective"],
+            )
+        ],
+    )
+
+
+def step(parent: TimeNode, update: Optional[GameElementUpdate], text: str) -> TimeNode:
+    """mimics what game.advance_time does to a node"""
+    node = parent.child(str(uuid.uuid4()))
+    node.timestep += 1
+    if update is not None:
+        node.summary = update.summary
+        node.apply_update(update)
+        node = TimeNode.model_validate(node.model_dump())
+    node.event_log = node.event_log + [
+        LogItem(
+            role="player",
+            type="act",
+            text=text,
+            timestep=node.timestep,
+            source="llm",
+        ),
+        LogItem(
+            role="game", type="game-response", text=text + "!", timestep=node.timestep
+        ),
+    ]
+    return node
+
+
+def update_for(i: int) -> GameElementUpdate:
+    return GameElementUpdate(
+        response_plan=f"plan {i}",
+        summary=f"summary {i}",
+        events=[
+            UpdateGameElement(
+                type="update_game_element",
+                element_id="zantar",
+                add=PastPresentFuture(present=[f"did thing {i}"]),
+                replace=(
+                    PastPresentFuture(future=[f"goal {i}"])
+                    if i % 3 == 0
+                    else PastPresentFuture()
+                ),
+            ),
+            AddGameElement(
+                type="add_game_element",
+                element_id=f"clue-{i}",
+                name=f"Clue {i}",
+                element_type="object",
+                present=[f"clue number {i}"],
+            ),
+        ],
+    )
+
+
+def play(turns: int, scenario_id: str = "scenario") -> List[TimeNode]:
+    node = seed_node(scenario_id)
+    nodes = []
+    for i in range(turns):
+        parent = node
+        # every 4th turn has no update, like an ambiguous intent
+        node = step(parent, update_for(i) if i % 4 != 3 else None, f"action {i}")
+        database.insert_time_node(node, parent=parent).result()
+        nodes.append(node)
+    # so that reads come from the database rather than the node cache
+    database.node_cache.clear()
+    return nodes
+
+
+def count_log_items(db: str) -> int:
+    with sqlite3.connect(db) as conn:
+        return conn.execute("SELECT count(*) FROM log_items").fetchone()[0]
+
+
+def stored_kinds(db: str) -> List[str]:
+    with sqlite3.connect(db) as conn:
+        return [
+            row[0] for row in conn.execute("SELECT kind FROM time_nodes ORDER BY rowid")
+        ]
+
+
+def test_delta_nodes_round_trip(db, monkeypatch):
+    monkeypatch.setattr(settings, "node_checkpoint_interval", 5)
+    nodes = play(12)
+
+    for node in nodes:
+        assert database.get_node(node.id) == node
+    assert count_log_items(db) == 12 * 2
+    assert database.get_active_node("scenario") == nodes[-1]
+
+    kinds = stored_kinds(db)
+    assert kinds[0] == database.CHECKPOINT
+    assert kinds[4] == database.CHECKPOINT
+    assert kinds.count(database.DELTA) == 9
+
+
+def test_delta_stores_history_summary(db):
+    nodes = play(3)
+    node = step(nodes[-1], update_for(3), "action 3")
+    node.history_summary = HistorySummary(text="things happened", through=4)
+    child = step(node, update_for(4), "action 4")
+    database.insert_time_node(node, parent=nodes[-1]).result()
+    database.insert_time_node(child, parent=node).result()
+    database.node_cache.clear()
+
+    assert database.get_node(node.id) == node
+    assert database.get_node(child.id).history_summary == node.history_summary
+    assert stored_kinds(db)[-2:] == [database.DELTA, database.DELTA]
+
+
+def test_delta_branches_share_parent(db):
+    nodes = play(3)
+    branch = step(nodes[1], update_for(10), "another way")
+    database.insert_time_node(branch).result()
+    database.node_cache.clear()
+
+    assert database.get_node(branch.id) == branch
+    assert database.get_node(nodes[2].id) == nodes[2]
+    assert stored_kinds(db)[-1] == database.DELTA
+    # the branch only stores its own two log items, the rest are shared with its sibling
+    assert count_log_items(db) == 3 * 2 + 2
+    assert database.get_event_log(branch.id) == branch.event_log
+
+
+def test_full_storage_mode(db, monkeypatch):
+    monkeypatch.setattr(settings, "node_storage", "full")
+    nodes = play(3)
+    assert stored_kinds(db) == [database.CHECKPOINT] * 3
+    assert database.get_node(nodes[-1].id) == nodes[-1]
+
+
+def test_migrate_full_json_rows(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    monkeypatch.setattr(settings, "node_checkpoint_interval", 4)
+    node = seed_node()
+    nodes = []
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE time_nodes (id TEXT PRIMARY KEY, scenario_id TEXT, summary TEXT, data TEXT)"
+        )
+        for i in range(6):
+            node = step(node, update_for(i), f"action {i}")
+            nodes.append(node)
+            conn.execute(
+                "INSERT INTO time_nodes (id, summary, data) VALUES (?, ?, ?)",
+                (node.id, node.summary, node.model_dump_json()),
+            )
+
+    database.open_database(path)
+    database.init_db()
+
+    assert stored_kinds(path) == [
+        database.CHECKPOINT,
+        database.DELTA,
+        database.DELTA,
+        database.CHECKPOINT,
+        database.DELTA,
+        database.DELTA,
+    ]
+    for node in nodes:
+        assert database.get_node(node.id) == node
+    assert count_log_items(path) == 6 * 2
+    # scenario ids are backfilled from the nodes' history
+    assert database.list_all_time_nodes("scenario") == nodes
+
+
+def test_migrate_deltas_with_inline_events(tmp_path):
+    path = str(tmp_path / "old.db")
+    root = step(seed_node(), update_for(0), "action 0")
+    child = step(root, update_for(1), "action 1")
+    delta = json.loads(database.diff_node(child, root).model_dump_json())
+    delta["events"] = json.loads(
+        database.LogItemList.dump_json(child.event_log[2:]).decode()
+    )
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE time_nodes (id TEXT PRIMARY KEY, scenario_id TEXT, summary TEXT, data TEXT, parent_id TEXT, kind TEXT)"
+        )
+        conn.execute(
+            "INSERT INTO time_nodes (id, summary, data, parent_id, kind) VALUES (?, ?, ?, ?, ?)",
+            (child.id, child.summary, json.dumps(delta), root.id, database.DELTA),
+        )
+        conn.execute(
+            "INSERT INTO time_nodes (id, summary, data, parent_id, kind) VALUES (?, ?, ?, ?, ?)",
+            (root.id, root.summary, root.model_dump_json(), None, database.CHECKPOINT),
+        )
+
+    database.open_database(path)
+    database.init_db()
+
+    assert database.get_node(root.id) == root
+    assert database.get_node(child.id) == child
+    assert count_log_items(path) == 4
+
+
+def test_schema_is_versioned(db):
+    database.init_db()
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("SELECT version FROM schema_version").fetchall() == [
+            (len(database.MIGRATIONS),)
+        ]
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM time_nodes WHERE scenario_id = ?",
+            ("scenario",),
+        ).fetchall()
+        assert "USING INDEX time_nodes_scenario_id" in plan[0][3]
+
+
+def test_delete_game(db):
+    nodes = play(3)
+    other = step(seed_node("other"), update_for(0), "elsewhere")
+    database.insert_time_node(other).result()
+    database.node_cache.clear()
+
+    assert [node.id for node in database.list_all_time_nodes("scenario")] == [
+        node.id for node in nodes
+    ]
+    database.delete_game("scenario").result()
+
+    assert database.list_all_time_nodes("scenario") == []
+    assert database.get_active_node("scenario") is None
+    assert database.get_node(other.id) == other
+    assert count_log_items(db) == 2
+
+
+def test_list_games_pages(db):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(5):
+        node = step(seed_node(f"scenario-{i}"), update_for(i), "action")
+        database.insert_time_node(
+            node, now=start + datetime.timedelta(minutes=i)
+        ).result()
+
+    first = database.list_games(limit=2)
+    assert [game.scenario_id for game in first] == ["scenario-4", "scenario-3"]
+    assert first[0].summary == "summary 4"
+    assert first[0].timestep == 1
+    rest = database.list_games(limit=10, after=first[-1])
+    assert [game.scenario_id for game in rest] == [
+        "scenario-2",
+        "scenario-1",
+        "scenario-0",
+    ]
+
+
+def test_set_active_node_updates_listing(db):
+    nodes = play(3)
+    database.set_active_node("scenario", nodes[0].id).result()
+    (game,) = database.list_games()
+    assert (game.node_id, game.timestep, game.summary) == (
+        nodes[0].id,
+        1,
+        "summary 0",
+    )
+
+
+def test_writer_batches_and_isolates_failures(db, caplog):
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+    def fail(conn):
+        raise RuntimeError("boom")
+
+    # hold the writer up so the following writes queue into a single batch
+    release = threading.Event()
+    blocked = database.db_writer.submit(lambda conn: release.wait())
+    first = database.insert_time_node(step(seed_node("first"), None, "one"))
+    failed = database.db_writer.submit(fail)
+    second = database.insert_time_node(step(seed_node("second"), None, "two"))
+    release.set()
+
+    blocked.result()
+    first.result()
+    second.result()
+    with pytest.raises(RuntimeError):
+        failed.result()
+    assert {game.scenario_id for game in database.list_games()} == {"first", "second"}
+    # logged, for writes nobody waits on
+    assert [r.exc_info[1] for r in caplog.records] == [failed.exception()]
+
+
+def test_writer_survives_a_failed_transaction(db):
+    def end_transaction(conn):
+        # leaves the writer without its savepoint and transaction, to roll back to or commit
+        conn.execute("ROLLBACK")
+        raise RuntimeError("boom")
+
+    failed = database.db_writer.submit(end_transaction)
+    # the transaction fails as a whole, rather than leaving its futures unresolved
+    with pytest.raises(sqlite3.Error):
+        failed.result(timeout=5)
+    # and the writer carries on
+    database.insert_time_node(step(seed_node("next"), None, "one")).result(timeout=5)
+    assert [game.scenario_id for game in database.list_games()] == ["next"]
+
+
+def test_pool_times_out_and_counts_waits(tmp_path):
+    pool = database.SQLiteConnectionPool(
+        str(tmp_path / "pool.db"), max_connections=1, timeout=0.05
+    )
+    with pool.connection():
+        with pytest.raises(database.PoolTimeout):
+            pool.get_connection()
+        stats = pool.stats()
+        assert (stats.in_use, stats.timeouts, stats.waits) == (1, 1, 0)
+
+    # a waiter gets the connection as soon as it's returned
+    conn = pool.get_connection()
+    threading.Timer(0.02, pool.return_connection, args=(conn,)).start()
+    with pool.connection():
+        pass
+    stats = pool.stats()
+    assert stats.waits == 1
+    assert stats.max_wait_seconds > 0
+    assert (stats.open, stats.in_use, stats.idle) == (1, 0, 1)
+    pool.close()
+
+
+def test_pool_replaces_broken_connections(tmp_path):
+    pool = database.SQLiteConnectionPool(str(tmp_path / "pool.db"), max_connections=1)
+    with pool.connection() as conn:
+        pass
+    # broken while idle in the pool, caught by the checkout health check
+    conn.close()
+    with pool.connection() as replacement:
+        assert replacement.execute("SELECT 1").fetchone() == (1,)
+    # broken while checked out, dropped when returned
+    with pool.connection() as conn:
+        conn.close()
+    with pool.connection() as replacement:
+        assert replacement.execute("SELECT 1").fetchone() == (1,)
+    assert pool.stats().replaced == 2
+    assert pool.stats().open == 1
+    pool.close()
+
+
+def test_pool_per_thread_connections(tmp_path):
+    pool = database.SQLiteConnectionPool(str(tmp_path / "pool.db"), per_thread=True)
+    with pool.connection() as first, pool.connection() as second:
+        assert first is second
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.get_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not first
+    assert pool.stats().open == 2
+    pool.close()
+
+
+def test_async_api(db):
+    async def run():
+        nodes = []
+        for i in range(3):
+            node = step(seed_node(f"scenario-{i}"), update_for(i), "action")
+            await database.insert_time_node_async(node)
+            nodes.append(node)
+        child = step(nodes[0], None, "again")
+        await database.insert_time_node_async(child, parent=nodes[0])
+        await database.set_active_node_async("scenario-0", nodes[0].id)
+        database.node_cache.clear()
+
+        loaded = await asyncio.gather(
+            *[database.get_active_node_async(f"scenario-{i}") for i in range(3)],
+            database.get_node_async(child.id),
+            database.list_games_async(limit=2),
+        )
+        assert loaded[:4] == nodes + [child]
+        assert len(loaded[4]) == 2
+
+    asyncio.run(run())
+
+
+def test_compressed_node_data(db, monkeypatch):
+    modes = ["none", "zlib", "zlib-dict"]
+    nodes = []
+    for mode in modes:
+        monkeypatch.setattr(settings, "node_compression", mode)
+        nodes.append(step(seed_node(mode), update_for(0), "action"))
+        database.insert_time_node(nodes[-1]).result()
+
+    with sqlite3.connect(db) as conn:
+        types = conn.execute(
+            "SELECT scenario_id, typeof(data) FROM time_nodes"
+        ).fetchall()
+    assert dict(types) == {"none": "text", "zlib": "blob", "zlib-dict": "blob"}
+
+    # every format stays readable, whatever the current setting
+    database._dictionaries.clear()
+    database.node_cache.clear()
+    for node in nodes:
+        assert database.get_node(node.id) == node
+
+
+def test_node_cache(db, monkeypatch):
+    nodes = play(3)
+    monkeypatch.setattr(
+        database, "node_cache", database.NodeCache(max_bytes=1024 * 1024)
+    )
+    for node in nodes:
+        database.get_node(node.id)
+    stats = database.node_cache.stats()
+    assert (stats.entries, stats.hits, stats.misses) == (3, 0, 3)
+
+    # inserted nodes and repeated loads are memory lookups
+    child = step(nodes[-1], update_for(3), "more")
+    database.insert_time_node(child, parent=nodes[-1])
+    assert database.get_node(child.id) is child
+    assert database.get_node(nodes[0].id) is database.get_node(nodes[0].id)
+    assert database.node_cache.stats().hits == 3
+
+    database.delete_game("scenario").result()
+    assert database.node_cache.stats().entries == 0
+    assert database.get_node(child.id) is None
+
+
+def test_node_cache_forgets_deleted_games_once_deleted(db):
+    nodes = play(2)
+    release = threading.Event()
+    blocked = database.db_writer.submit(lambda conn: release.wait())
+    deleted = database.delete_game("scenario")
+    # read, and cached, while the delete waits to be committed
+    assert database.get_node(nodes[-1].id) == nodes[-1]
+    release.set()
+    blocked.result()
+    deleted.result()
+    assert database.get_node(nodes[-1].id) is None
+
+
+def test_node_cache_evicts_least_recently_used():
+    nodes = [
+        step(seed_node(f"scenario-{i}"), update_for(i), "action") for i in range(3)
+    ]
+    cache = database.NodeCache(
+        max_bytes=2 * max(database.approximate_size(node) for node in nodes)
+    )
+    cache.put(nodes[0])
+    cache.put(nodes[1])
+    cache.get(nodes[0].id)
+    cache.put(nodes[2])
+    assert cache.get(nodes[1].id) is None
+    assert cache.get(nodes[0].id) is nodes[0]
+    assert cache.stats().evictions == 1
+
+    # a new version too big to cache replaces the cached one, rather than leaving it
+    bigger = nodes[0].model_copy(update={"premise": "x" * cache.max_bytes})
+    cache.put(bigger)
+    assert cache.get(nodes[0].id) is None
+
+
+def test_node_cache_counts_shared_parts_once():
+    parent = step(seed_node(), update_for(0), "action")
+    child = parent.child("child")
+    child.apply_update(update_for(1))
+    cache = database.NodeCache(max_bytes=1024 * 1024)
+    cache.put(parent)
+    cache.put(child)
+    unshared = database.approximate_size(parent) + database.approximate_size(child)
+    assert cache.stats().size_bytes < unshared
+
+    cache.invalidate(parent.id)
+    assert cache.stats().size_bytes == database.approximate_size(child)
+    cache.invalidate(child.id)
+    assert cache.stats().size_bytes == 0
+
+
+def branch_from(parent: TimeNode, turns: int, now: datetime.datetime) -> List[TimeNode]:
+    nodes = []
+    for i in range(turns):
+        node = step(parent, update_for(100 + i), f"branch action {i}")
+        database.insert_time_node(node, parent=parent, now=now).result()
+        nodes.append(node)
+        parent = node
+    return nodes
+
+
+def test_compact_deletes_unreachable_branches(db):
+    main = play(10)
+    old = datetime.datetime(2024, 1, 1)
+    first = branch_from(main[3], 3, old)
+    second = branch_from(main[5], 2, old + datetime.timedelta(hours=1))
+    database.set_active_node("scenario", main[-1].id).result()
+    other = play(3, scenario_id="other")
+    log_items = count_log_items(db)
+
+    result = database.compact(keep_branches=1, batch_size=2)
+    assert (result.nodes_deleted, result.log_items_deleted) == (3, 6)
+    assert result.complete
+    assert database.get_node(first[-1].id) is None
+    assert database.get_node(second[-1].id) == second[-1]
+    assert count_log_items(db) == log_items - 6
+
+    result = database.compact()
+    assert (result.nodes_deleted, result.log_items_deleted) == (2, 4)
+    assert database.get_node(second[0].id) is None
+    for node in main + other:
+        assert database.get_node(node.id) == node
+    with sqlite3.connect(db) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone() == (2,)
+        assert conn.execute("PRAGMA freelist_count").fetchone() == (0,)
+
+
+def test_compact_stops_at_time_budget(db):
+    main = play(4)
+    branch_from(main[1], 3, datetime.datetime(2024, 1, 1))
+    database.set_active_node("scenario", main[-1].id).result()
+    result = database.compact(batch_size=1, time_budget=0)
+    assert not result.complete
+    assert result.nodes_deleted == 0
+    assert database.compact(batch_size=1).nodes_deleted == 3
+
+
+def test_list_children(db):
+    main = play(4)
+    old = datetime.datetime(2024, 1, 1)
+    branch = branch_from(main[1], 2, old)
+
+    assert [child.node_id for child in database.list_children(main[1].id)] == [
+        main[2].id,
+        branch[0].id,
+    ]
+    assert database.list_children(branch[0].id)[0] == database.NodeListing(
+        node_id=branch[1].id,
+        parent_id=branch[0].id,
+        timestep=branch[1].timestep,
+        summary=branch[1].summary,
+        updated_at=old,
+    )
+    assert [child.node_id for child in database.list_children("scenario")] == [
+        main[0].id
+    ]
+    assert database.list_children(main[-1].id) == []
+
+
+def test_search(db):
+    main = play(4)
+    branch = branch_from(main[1], 1, datetime.datetime(2024, 1, 1))
+    database.set_active_node("scenario", main[-1].id).result()
+    play(2, scenario_id="other")
+
+    results = database.search("scenario", "action 2")
+    assert [(r.node_id, r.source, r.label) for r in results[:1]] == [
+        (main[2].id, "log", "player")
+    ]
+    assert "[action]" in results[0].snippet
+
+    # element descriptions are indexed at the node that introduced them
+    [clue] = database.search("scenario", "clue number 2")
+    assert (clue.node_id, clue.source, clue.label) == (main[2].id, "element", "Clue 2")
+    [seeded] = database.search("scenario", '"junior detective"')
+    assert seeded.node_id == main[0].id
+    assert len(database.search("other", "junior detective")) == 1
+    # fts5 syntax is quoted rather than interpreted
+    assert database.search("scenario", 'action" OR -') == []
+
+    database.compact()
+    assert database.search("scenario", "branch") == []
+    database.delete_game("other").result()
+    assert database.search("other", "junior") == []
+
+
+def test_search_index_backfill(db):
+    play(3)
+    expected = database.search("scenario", "action")
+    with sqlite3.connect(db) as conn:
+        conn.execute("DROP TABLE search_index")
+        conn.execute("DROP TABLE search_entries")
+        conn.execute(
+            "UPDATE schema_version SET version = ?",
+            (database.MIGRATIONS.index(database.add_search_index),),
+        )
+    database.init_db()
+    assert database.search("scenario", "action") == expected
+
+
+def test_export_import_scenario(db, tmp_path):
+    main = play(25)
+    branch = branch_from(main[10], 3, datetime.datetime(2024, 1, 1))
+    database.set_active_node("scenario", main[-1].id).result()
+    play(2, scenario_id="other")
+
+    out = io.StringIO()
+    stats = database.export_scenario("scenario", out)
+    assert (stats.nodes, stats.log_items) == (28, 56)
+    lines = out.getvalue().splitlines()
+    assert json.loads(lines[0])["active_node_id"] == main[-1].id
+    seen = {"scenario"}
+    for line in lines[1:]:
+        entry = json.loads(line)
+        assert entry["parent_id"] in seen
+        seen.add(entry["id"])
+
+    with pytest.raises(ValueError):
+        database.import_scenario(lines)
+    database.open_database(str(tmp_path / "imported.db"))
+    database.init_db()
+    stats = database.import_scenario(io.StringIO(out.getvalue()), batch_size=4)
+    assert (stats.nodes, stats.log_items) == (28, 56)
+
+    assert database.get_active_node("scenario") == main[-1]
+    for node in main + branch:
+        assert database.get_node(node.id) == node
+    assert {r.node_id for r in database.search("scenario", "branch action 2")} == {
+        branch[2].id
+    }
+    assert database.list_games()[0].last_updated == datetime.datetime.fromisoformat(
+        json.loads(lines[0])["last_updated"]
+    )
+
+    database.import_scenario(lines, overwrite=True)
+    assert database.get_node(branch[-1].id) == branch[-1]
+    assert count_log_items(str(tmp_path / "imported.db")) == 56
+
+    # parents still come before their children, but depth first
+    branch_ids = {node.id for node in branch}
+    depth_first = [lines[0]] + sorted(
+        lines[1:], key=lambda line: json.loads(line)["id"] in branch_ids
+    )
+    with pytest.raises(ValueError, match="breadth first"):
+        database.import_scenario(depth_first, overwrite=True)
+
+
+@pytest.mark.parametrize("mode", ["hash", "scenario"])
+def test_sharded_database(tmp_path, mode):
+    shard_dir = tmp_path / "shards"
+    database.open_database(str(shard_dir), sharding_mode=mode, shards=2)
+    database.init_db()
+    try:
+        games = {scenario_id: play(3, scenario_id) for scenario_id in ["a", "b", "c"]}
+        database.set_active_node("b", games["b"][0].id).result()
+
+        assert sorted(game.scenario_id for game in database.list_games()) == [
+            "a",
+            "b",
+            "c",
+        ]
+        assert database.get_active_node("b") == games["b"][0]
+        for scenario_id, nodes in games.items():
+            assert database.get_node(nodes[-1].id, scenario_id) == nodes[-1]
+            assert database.list_all_time_nodes(scenario_id) == nodes
+        with pytest.raises(ValueError):
+            database.get_node(games["a"][0].id)
+
+        shard_files = sorted(p.name for p in shard_dir.iterdir() if p.suffix == ".db")
+        if mode == "scenario":
+            assert shard_files == [
+                "catalog.db",
+                "scenario-a.db",
+                "scenario-b.db",
+                "scenario-c.db",
+            ]
+        else:
+            assert len(shard_files) == 3
+        with sqlite3.connect(shard_dir / "catalog.db") as conn:
+            assert conn.execute("SELECT count(*) FROM active_node").fetchone()[0] == 3
+
+        database.delete_game("a").result()
+        assert sorted(game.scenario_id for game in database.list_games()) == ["b", "c"]
+        assert database.list_all_time_nodes("a") == []
+        assert database.compact(keep_branches=1).nodes_deleted == 0
+    finally:
+        database.close_database()
+
+
+def writer_threads() -> int:
+    return sum(t.name == "texty-db-writer" for t in threading.enumerate())
+
+
+def test_least_recently_used_shards_are_closed(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "db_open_shards", 2)
+    database.open_database(str(tmp_path / "shards"), sharding_mode="scenario")
+    database.init_db()
+    try:
+        games = {scenario_id: play(2, scenario_id) for scenario_id in "abcde"}
+        assert list(database.shards) == [
+            str(tmp_path / "shards" / "scenario-d.db"),
+            str(tmp_path / "shards" / "scenario-e.db"),
+        ]
+        # the closed shards' writer threads have stopped, leaving the catalog's and the open shards'
+        assert writer_threads() <= 3
+        for scenario_id, nodes in games.items():
+            assert database.get_node(nodes[-1].id, scenario_id) == nodes[-1]
+        assert len(database.shards) == 2
+
+        # a pass over every game doesn't keep their shards open
+        assert database.compact().nodes_deleted == 0
+        assert len(list(database.list_player_actions())) == 2
+        assert len(database.shards) == 2
+        assert writer_threads() <= 3
+    finally:
+        database.close_database()
+
+
+def test_shards_in_use_stay_open(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "db_open_shards", 1)
+    database.open_database(str(tmp_path / "shards"), sharding_mode="scenario")
+    database.init_db()
+    try:
+        nodes = play(2, "a")
+        with database.scenario_shard("a") as shard:
+            play(2, "b")
+            play(2, "c")
+            # over the limit, until the game using it lets go
+            assert str(tmp_path / "shards" / "scenario-a.db") in database.shards
+            with shard.pool.connection() as conn:
+                assert database._load_node(conn, nodes[-1].id) == nodes[-1]
+            shard.writer.submit(lambda conn: None).result(timeout=5)
+        assert list(database.shards) == [str(tmp_path / "shards" / "scenario-a.db")]
+        assert not shard.writer.closed
+        # closed once it's idle and another shard needs the room
+        play(2, "d")
+        assert list(database.shards) == [str(tmp_path / "shards" / "scenario-d.db")]
+        assert shard.writer.closed and shard.pool.closed
+        assert database.get_node(nodes[-1].id, "a") == nodes[-1]
+    finally:
+        database.close_database()
+
+
+def test_closed_writers_and_pools_refuse_work(tmp_path):
+    shard = database.Shard(str(tmp_path / "closed.db"))
+    shard.writer.submit(lambda conn: None).result(timeout=5)
+    checked_out = shard.pool.get_connection()
+    shard.close()
+    with pytest.raises(RuntimeError):
+        shard.writer.submit(lambda conn: None)
+    with pytest.raises(database.PoolClosed):
+        shard.pool.get_connection()
+    with pytest.raises(database.PoolClosed):
+        shard.async_pool.get_connection()
+    # returned after the close, it's closed rather than kept idle
+    shard.pool.return_connection(checked_out)
+    assert shard.pool.stats().open == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        checked_out.execute("SELECT 1")
+    assert shard.writer.thread is None
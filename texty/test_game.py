@@ -0,0 +1,248 @@
+import time
+from typing import Iterator, List, Optional, Type
+
+import pytest
+from pydantic import BaseModel
+
+from texty import game
+from texty.game import Game, StatusUpdate
+from texty.gametypes import (
+    AddGameElement,
+    GameElementUpdate,
+    HistorySummary,
+    LogItem,
+    TimeNode,
+)
+from texty.parsing import Partial, partial_models
+from texty.prompts import IntentDetection
+from texty.settings import settings
+from texty.storage import MemoryBackend
+from texty.test_database import seed_node
+
+
+class FakeModel:
+    """
+    Detects every input as an "act", plans an update with no events, narrates "It rains.", and summarizes the
+    history as "The story so far."
+    """
+
+    def __init__(self):
+        self.prompts: List[str] = []
+
+    def text(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        return "The story so far."
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        self.prompts.append(prompt)
+        yield from ["It ", "rains."]
+
+    def json(self, prompt: str, schema: Type[BaseModel]) -> BaseModel:
+        self.prompts.append(prompt)
+        if schema is IntentDetection:
+            return IntentDetection(thought="", intent="act")
+        return GameElementUpdate(response_plan="rain", events=[], summary="It rains")
+
+
+@pytest.fixture
+def model(monkeypatch) -> FakeModel:
+    fake = FakeModel()
+    monkeypatch.setattr(game, "get_stage_client", lambda stage: fake)
+    monkeypatch.setattr(settings, "intent_classifier", False)
+    return fake
+
+
+class PlanStreamingModel(FakeModel):
+    """
+    Streams a plan as `streamed`, unmarked as whole, as when the stream is cut short or the model leaves a field out
+    """
+
+    def __init__(self, streamed: Optional[GameElementUpdate]):
+        super().__init__()
+        self.streamed = streamed
+
+    def json_stream(
+        self, prompt: str, schema: Type[BaseModel]
+    ) -> Iterator[Partial[BaseModel]]:
+        self.prompts.append(prompt)
+        if self.streamed is not None:
+            yield Partial(value=self.streamed)
+
+
+def slow_commits(monkeypatch, delay: float = 0.2):
+    commit_turn = game.commit_turn
+
+    def slow(*args, **kwargs) -> TimeNode:
+        time.sleep(delay)
+        return commit_turn(*args, **kwargs)
+
+    monkeypatch.setattr(game, "commit_turn", slow)
+
+
+def started_game(storage: MemoryBackend) -> Game:
+    g = Game("scenario", storage)
+    list(g.start_if_not_started(seed=seed_node()))
+    return g
+
+
+def test_step_returns_before_the_background_commit(model, monkeypatch):
+    monkeypatch.setattr(settings, "background_commit", True)
+    storage = MemoryBackend()
+    g = started_game(storage)
+    start = g.node
+    slow_commits(monkeypatch)
+
+    begun = time.perf_counter()
+    events = list(g.step("open the door"))
+    assert time.perf_counter() - begun < 0.2
+    assert events[-1].status == "committing"
+    # reading the node waits for the commit
+    assert g.node.previous[-1] == start.id
+    assert storage.get_active_node("scenario").id == g.node.id
+
+
+def test_jump_waits_for_background_commit(model, monkeypatch):
+    monkeypatch.setattr(settings, "background_commit", True)
+    storage = MemoryBackend()
+    g = started_game(storage)
+    start = g.node
+    slow_commits(monkeypatch)
+
+    list(g.step("open the door"))
+    assert g.jump(start.id)
+    assert g.node.id == start.id
+    assert storage.get_active_node("scenario").id == start.id
+
+    list(g.step("close the door"))
+    assert g.undo()
+    assert g.node.id == start.id
+    assert g.redo()
+    assert g.node.event_log[-2].text == "close the door"
+
+
+def history(turns: int) -> TimeNode:
+    node = seed_node()
+    for turn in range(turns):
+        node.event_log += [
+            LogItem(role="player", type="act", text=f"action {turn}", timestep=turn),
+            LogItem(role="game", type="game-response", text="ok", timestep=turn),
+        ]
+    return node
+
+
+def test_fold_history(model, monkeypatch):
+    monkeypatch.setattr(settings, "history_verbatim_turns", 2)
+    monkeypatch.setattr(settings, "history_fold_turns", 2)
+    node = history(3)
+    game.fold_history(node)
+    assert node.history_summary is None
+    assert model.prompts == []
+
+    node = history(4)
+    game.fold_history(node)
+    # the first two turns are folded, the last two kept verbatim
+    assert node.history_summary == HistorySummary(text="The story so far.", through=4)
+    assert "action 1" in model.prompts[-1] and "action 2" not in model.prompts[-1]
+
+    node.event_log += history(6).event_log[8:]
+    game.fold_history(node)
+    assert node.history_summary.through == 8
+    # the next fold builds on the summary so far, with only the turns after it
+    assert "The story so far." in model.prompts[-1]
+    assert "action 1" not in model.prompts[-1] and "action 3" in model.prompts[-1]
+
+
+@pytest.mark.parametrize("background_commit", [True, False])
+def test_turns_fold_history_in_the_background(model, monkeypatch, background_commit):
+    monkeypatch.setattr(settings, "background_commit", background_commit)
+    monkeypatch.setattr(settings, "history_verbatim_turns", 2)
+    monkeypatch.setattr(settings, "history_fold_turns", 1)
+    g = started_game(MemoryBackend())
+    for turn in range(3):
+        list(g.step(f"action {turn}"))
+
+    summary = g.node.history_summary
+    summarized = [prompt for prompt in model.prompts if "happened next" in prompt]
+    if background_commit:
+        assert summary is not None and len(summarized) == 1
+        # the summary is in the turn's prompts
+        list(g.step("look"))
+        assert "The story so far." in model.prompts[-1]
+    else:
+        assert summary is None and summarized == []
+
+
+@pytest.mark.parametrize(
+    "streamed, summary",
+    [
+        # the last plan of the stream is used as it is
+        (GameElementUpdate(response_plan="fog", events=[], summary="Fog"), "Fog"),
+        # without a response_plan, the turn is replanned without streaming
+        (GameElementUpdate.model_construct(events=[], summary="Fog"), "It rains"),
+        (None, "It rains"),
+    ],
+)
+def test_streamed_plan_without_a_whole_response_plan(monkeypatch, streamed, summary):
+    model = PlanStreamingModel(streamed)
+    monkeypatch.setattr(game, "get_stage_client", lambda stage: model)
+    monkeypatch.setattr(settings, "intent_classifier", False)
+    monkeypatch.setattr(settings, "stream_planning", True)
+    monkeypatch.setattr(settings, "background_commit", False)
+    g = started_game(MemoryBackend())
+
+    events = list(g.step("open the door"))
+    assert events[-1].status == "done"
+    assert g.node.summary == summary
+    assert g.node.event_log[-1].text == "It rains."
+
+
+class TruncatedPlanModel(FakeModel):
+    """
+    Streams a plan that's cut off partway through its second event
+    """
+
+    def json_stream(
+        self, prompt: str, schema: Type[BaseModel]
+    ) -> Iterator[Partial[BaseModel]]:
+        self.prompts.append(prompt)
+        doc = GameElementUpdate(
+            response_plan="a clue turns up",
+            events=[
+                AddGameElement(
+                    type="add_game_element",
+                    element_id="clue",
+                    name="Clue",
+                    element_type="object",
+                ),
+                AddGameElement(
+                    type="add_game_element",
+                    element_id="witness",
+                    name="Witness",
+                    element_type="character",
+                ),
+            ],
+            summary="A clue",
+        ).model_dump_json()
+        cut = doc[: doc.index("witness")]
+        yield from partial_models(
+            [cut[i : i + 8] for i in range(0, len(cut), 8)], schema
+        )
+
+
+def test_streamed_plan_cut_off_after_the_response_plan(monkeypatch):
+    model = TruncatedPlanModel()
+    monkeypatch.setattr(game, "get_stage_client", lambda stage: model)
+    monkeypatch.setattr(settings, "intent_classifier", False)
+    monkeypatch.setattr(settings, "stream_planning", True)
+    monkeypatch.setattr(settings, "background_commit", False)
+    g = started_game(MemoryBackend())
+    summary = g.node.summary
+
+    events = list(g.step("search the room"))
+    assert events[-1].status == "done"
+    # the turn keeps its narration and the events that arrived whole
+    assert g.node.event_log[-1].text == "It rains."
+    assert [e.element_id for e in g.node.last_update.events] == ["clue"]
+    assert "clue" in {e.element_id for e in g.node.game_elements}
+    assert "witness" not in {e.element_id for e in g.node.game_elements}
+    assert g.node.summary == summary
@@ -1,4 +1,12 @@
-from texty.gametypes import GameElementUpdate, TimeNode
+from texty.gametypes import (
+    GameElement,
+    GameElementUpdate,
+    HistorySummary,
+    LogItem,
+    PastPresentFuture,
+    TimeNode,
+    UpdateGameElement,
+)
 
 
 def test_parse_game_element():
@@ -50,3 +58,54 @@ def test_parse_time_node():
 """
     result = TimeNode.model_validate_json(input)
     assert len(result.game_elements) == 5
+
+
+def test_child_shares_unchanged_elements():
+    parent = TimeNode(
+        id="parent",
+        premise="A detective story",
+        game_elements=[
+            GameElement(
+                element_id=id, name=id, element_type="character", present=["here"]
+            )
+            for id in ["zantar", "jimbo"]
+        ],
+    )
+    child = parent.child("child")
+    child.apply_update(
+        GameElementUpdate(
+            response_plan="",
+            summary="",
+            events=[
+                UpdateGameElement(
+                    type="update_game_element",
+                    element_id="zantar",
+                    add=PastPresentFuture(present=["leaves"]),
+                    replace=PastPresentFuture(past=["was a cop"]),
+                )
+            ],
+        )
+    )
+    assert child.previous == ["parent"]
+    assert child.game_elements[1] is parent.game_elements[1]
+    assert child.game_elements[0].present == ["here", "leaves"]
+    assert child.game_elements[0].past == ["was a cop"]
+    assert parent.game_elements[0].present == ["here"]
+    assert parent.game_elements[0].past == []
+
+
+def test_history_fold_point():
+    node = TimeNode(id="node", premise="A detective story")
+    for turn in range(6):
+        node.event_log += [
+            LogItem(role="player", type="act", text=f"do {turn}", timestep=turn),
+            LogItem(role="game", type="game-response", text="done", timestep=turn),
+        ]
+    assert node.history_fold_point(verbatim_turns=2, fold_turns=5) is None
+    # folds up to the start of the second to last turn
+    assert node.history_fold_point(verbatim_turns=2, fold_turns=4) == 8
+    assert node.history_fold_point(verbatim_turns=0, fold_turns=6) == 12
+
+    node.history_summary = HistorySummary(text="four turns", through=8)
+    assert node.history_fold_point(verbatim_turns=2, fold_turns=1) is None
+    assert node.history_fold_point(verbatim_turns=1, fold_turns=1) == 10
@@ -0,0 +1,75 @@
+from texty import database, intent
+from texty.gametypes import LogItem
+from texty.settings import settings
+from texty.test_database import db, seed_node
+
+
+def test_keywords_alone_leave_inputs_to_the_llm(monkeypatch):
+    monkeypatch.setattr(settings, "intent_model_path", "/nonexistent/intent.json")
+    classifier = intent.IntentClassifier()
+    assert classifier.predict("look around").intent == "inspect"
+    assert classifier.predict("Open the door").intent == "act"
+    # a keyword first word isn't enough to skip the LLM, e.g. for compound inputs
+    assert classifier.predict("look at the door then open it").confidence < 0.8
+    assert intent.classify_intent("look around") is None
+    assert intent.classify_intent("the thing with the stuff") is None
+
+
+def test_trained_classifier_settles_obvious_inputs(tmp_path, monkeypatch):
+    path = str(tmp_path / "intent.json")
+    classifier = intent.IntentClassifier()
+    classifier.train(
+        [(f"look at the {thing}", "inspect") for thing in ["lamp", "desk", "coat"]]
+        + [(f"open the {thing}", "act") for thing in ["door", "window", "box"]]
+    )
+    classifier.save(path)
+    monkeypatch.setattr(settings, "intent_model_path", path)
+    assert intent.classify_intent("look around").intent == "inspect"
+    assert intent.classify_intent("open the safe").intent == "act"
+
+    monkeypatch.setattr(settings, "intent_classifier", False)
+    assert intent.classify_intent("look around") is None
+
+
+def test_train_and_evaluate(tmp_path):
+    examples = [
+        (f"{verb} the {thing}", label)
+        for verb, label in [
+            ("ponder", "inspect"),
+            ("sniff", "inspect"),
+            ("kick", "act"),
+            ("light", "act"),
+        ]
+        for thing in ["lamp", "desk", "window", "coat", "ledger"]
+    ]
+    classifier = intent.IntentClassifier()
+    assert intent.evaluate(classifier, examples, 0.8).coverage == 0
+    classifier.train(examples)
+    evaluation = intent.evaluate(classifier, [("sniff the hat", "inspect")], 0.8)
+    assert (evaluation.accuracy, evaluation.coverage) == (1.0, 1.0)
+
+    path = str(tmp_path / "intent.json")
+    classifier.save(path)
+    loaded = intent.IntentClassifier.load(path)
+    assert loaded.probabilities("kick it") == classifier.probabilities("kick it")
+
+
+def test_list_player_actions(db):
+    node = seed_node()
+    node.event_log = [
+        LogItem(role="player", type="inspect", text="look", timestep=0, source="llm"),
+        LogItem(role="game", type="game-response", text="a room", timestep=0),
+        LogItem(role="player", type="act", text="leave", timestep=1, source="llm"),
+        # the classifier's own guesses, and inputs from before sources were recorded, aren't labels to learn from
+        LogItem(
+            role="player", type="act", text="look", timestep=1, source="classifier"
+        ),
+        LogItem(role="player", type="inspect", text="sit", timestep=1),
+    ]
+    database.insert_time_node(node).result()
+    database.node_cache.clear()
+    assert database.get_node(node.id).event_log == node.event_log
+    assert sorted(database.list_player_actions()) == [
+        ("leave", "act"),
+        ("look", "inspect"),
+    ]
@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+from texty.gametypes import (
+    EndGame,
+    GameElementUpdate,
+    PastPresentFuture,
+    UpdateGameElement,
+)
+from texty.parsing import (
+    PartialJsonParser,
+    TrailerSplitter,
+    extract_json_object,
+    partial_models,
+)
+
+
+def split(chunks):
+    splitter = TrailerSplitter("<game_update>")
+    text = [splitter.feed(chunk) for chunk in chunks]
+    return text, splitter.close(), splitter.trailer
+
+
+def test_trailer_splitter_holds_back_partial_markers():
+    text, rest, trailer = split(
+        ["The door ", "creaks <", "b>open</b>. <game", "_upd", 'ate>{"a": ', "1}"]
+    )
+    assert text == ["The door ", "creaks ", "<b>open</b>. ", "", "", ""]
+    assert rest == ""
+    assert trailer == '{"a": 1}'
+
+
+def test_trailer_splitter_without_marker():
+    text, rest, trailer = split(["It rains <game"])
+    assert "".join(text) + rest == "It rains <game"
+    assert trailer is None
+
+
+def test_extract_json_object():
+    assert extract_json_object('```json\n{"a": {"b": 1}}\n```</game_update>') == (
+        '{"a": {"b": 1}}'
+    )
+    with pytest.raises(ValueError):
+        extract_json_object("no json here")
+
+
+def test_partial_json_parser():
+    doc = '{"plan": "a \\"b\\" \\u00e9", "items": [{"n": 1}, {"n": 22}], "done": true}'
+    seen = []
+    parser = PartialJsonParser()
+    for c in doc:
+        parser.feed(c)
+        seen.append((parser.value(), set(parser.complete_keys)))
+    assert parser.done
+    assert seen[-1][0] == json.loads(doc)
+    # partial numbers, keys and escapes are left out rather than guessed at
+    assert {"n": 2} not in [
+        item for value, _ in seen for item in value.get("items", [])
+    ]
+    assert ({"plan": 'a "b'}, set()) in seen
+    assert ({"plan": 'a "b" é', "items": []}, {"plan"}) in seen
+    assert ({"plan": 'a "b" é', "items": [{"n": 1}]}, {"plan"}) in seen
+
+
+def test_partial_models():
+    update = GameElementUpdate(
+        response_plan="Zantar opens the door",
+        events=[
+            EndGame(type="end_game", is_success=True, description="found"),
+            UpdateGameElement(
+                type="update_game_element",
+                element_id="zantar",
+                add=PastPresentFuture(present=["opened the door"]),
+            ),
+        ],
+        summary="The door",
+    )
+    doc = update.model_dump_json()
+    partials = list(
+        partial_models(
+            [doc[i : i + 5] for i in range(0, len(doc), 5)], GameElementUpdate
+        )
+    )
+
+    assert partials[-1].value == update
+    assert partials[-1].complete == {"response_plan", "events", "summary"}
+    plan_done = next(p for p in partials if "response_plan" in p.complete)
+    assert plan_done.value.response_plan == update.response_plan
+    assert "summary" not in plan_done.complete
+    # events only appear once they're whole
+    assert 1 in [len(p.value.events) for p in partials if "events" not in p.complete]
+    assert all(
+        p.value.events in ([], update.events[:1], update.events) for p in partials
+    )
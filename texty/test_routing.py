@@ -0,0 +1,147 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import AsyncIterator, Iterator, List, Type
+
+import pytest
+from pydantic import BaseModel
+
+from texty.models import model, routing
+from texty.models.routing import AsyncBudgetedModel, BudgetedModel
+from texty.settings import StageRoute, settings
+
+
+class Answer(BaseModel):
+    answer: str
+
+
+class SlowModel:
+    def __init__(self, name: str, delay: float):
+        self.name = name
+        self.delay = delay
+
+    def text(self, prompt: str) -> str:
+        time.sleep(self.delay)
+        return self.name
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        time.sleep(self.delay)
+        yield self.name
+        yield "!"
+
+    def json(self, prompt: str, schema: Type[BaseModel]) -> BaseModel:
+        time.sleep(self.delay)
+        return schema(answer=self.name)
+
+
+class SlowAsyncModel(SlowModel):
+    async def text(self, prompt: str) -> str:
+        await asyncio.sleep(self.delay)
+        return self.name
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.delay)
+        yield self.name
+        yield "!"
+
+    async def json(self, prompt: str, schema: Type[BaseModel]) -> BaseModel:
+        await asyncio.sleep(self.delay)
+        return schema(answer=self.name)
+
+
+def test_within_budget_uses_the_routed_model():
+    model = BudgetedModel(SlowModel("large", 0), SlowModel("small", 0), budget=1.0)
+    assert model.text("hi") == "large"
+    assert list(model.stream("hi")) == ["large", "!"]
+    assert model.json("hi", Answer) == Answer(answer="large")
+
+
+def test_over_budget_falls_back():
+    model = BudgetedModel(SlowModel("large", 0.5), SlowModel("small", 0), budget=0.05)
+    start = time.perf_counter()
+    assert model.text("hi") == "small"
+    chunks: List[str] = list(model.stream("hi"))
+    assert chunks == ["small", "!"]
+    assert model.json("hi", Answer) == Answer(answer="small")
+    assert time.perf_counter() - start < 0.5
+
+
+def test_async_over_budget_falls_back():
+    async def answers(model: AsyncBudgetedModel):
+        return (
+            await model.text("hi"),
+            [chunk async for chunk in model.stream("hi")],
+            await model.json("hi", Answer),
+        )
+
+    fast = AsyncBudgetedModel(
+        SlowAsyncModel("large", 0), SlowAsyncModel("small", 0), budget=1.0
+    )
+    assert asyncio.run(answers(fast)) == (
+        "large",
+        ["large", "!"],
+        Answer(answer="large"),
+    )
+
+    slow = AsyncBudgetedModel(
+        SlowAsyncModel("large", 0.5), SlowAsyncModel("small", 0), budget=0.05
+    )
+    start = time.perf_counter()
+    assert asyncio.run(answers(slow)) == (
+        "small",
+        ["small", "!"],
+        Answer(answer="small"),
+    )
+    assert time.perf_counter() - start < 0.5
+
+
+def test_budget_starts_once_the_call_has_a_thread(monkeypatch):
+    monkeypatch.setattr(routing, "budget_executor", ThreadPoolExecutor(max_workers=1))
+    budgeted = BudgetedModel(
+        SlowModel("large", 0.1), SlowModel("small", 0), budget=0.15
+    )
+    # each waits its turn for the single thread, for longer than the budget, but runs within it
+    with ThreadPoolExecutor(max_workers=3) as players:
+        answers = list(players.map(lambda _: budgeted.text("hi"), range(3)))
+    assert answers == ["large"] * 3
+
+
+class Client:
+    def __init__(self, model: str, temperature: float, max_tokens: int):
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+
+
+@pytest.mark.parametrize(
+    "get_stage_client", ["get_stage_client", "get_async_stage_client"]
+)
+def test_stage_routes(monkeypatch, get_stage_client):
+    for get_client in ["get_client", "get_async_client"]:
+        monkeypatch.setattr(model, get_client, Client)
+    monkeypatch.setattr(settings, "llm_model_small", "openai/small")
+    monkeypatch.setattr(
+        settings,
+        "llm_routes",
+        {
+            "intent": StageRoute(model="small", latency_budget=1.0),
+            "plan": StageRoute(model="openai/small", latency_budget=1.0),
+            "respond": StageRoute(model="large", temperature=0.2, latency_budget=2.0),
+        },
+    )
+    stage_client = getattr(model, get_stage_client)
+    budgeted = (
+        BudgetedModel if get_stage_client == "get_stage_client" else AsyncBudgetedModel
+    )
+
+    respond = stage_client("respond")
+    assert type(respond) is budgeted
+    assert (respond.model.model, respond.model.temperature) == ("large", 0.2)
+    assert (respond.fallback.model, respond.fallback.temperature) == ("small", 0.2)
+    assert respond.budget == 2.0
+    # already on the small model, by name or by alias, there's nothing to fall back to
+    assert stage_client("intent").model == "small"
+    assert stage_client("plan").model == "openai/small"
+    # a stage without a route gets the default one
+    summarize = stage_client("summarize")
+    assert (summarize.model, summarize.max_tokens) == ("large", 4096)
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+from typing import List
+
+import pytest
+
+from texty import database
+from texty.gametypes import TimeNode
+from texty.storage import MemoryBackend, SQLiteBackend, StorageBackend
+from texty.test_database import seed_node, step, update_for
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def storage(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryBackend()
+        return
+    database.open_database(str(tmp_path / "texty.db"))
+    backend = SQLiteBackend()
+    backend.init()
+    yield backend
+    database.close_database()
+
+
+def play(
+    storage: StorageBackend, parent: TimeNode, turns: int, now: datetime.datetime
+) -> List[TimeNode]:
+    nodes = []
+    for i in range(turns):
+        node = step(parent, update_for(i), f"action {i}")
+        storage.insert_time_node(
+            node, now=now + datetime.timedelta(minutes=i), parent=parent
+        ).result()
+        nodes.append(node)
+        parent = node
+    return nodes
+
+
+def test_nodes_and_active_node(storage: StorageBackend):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    nodes = play(storage, seed_node(), 3, start)
+
+    assert storage.get_active_node("scenario") == nodes[-1]
+    assert storage.get_node(nodes[0].id, "scenario") == nodes[0]
+    assert storage.get_event_log(nodes[1].id, "scenario") == nodes[1].event_log
+    assert storage.list_all_time_nodes("scenario") == nodes
+
+    storage.set_active_node("scenario", nodes[0].id).result()
+    assert storage.get_active_node("scenario") == nodes[0]
+    storage.set_active_node("scenario", "missing").result()
+    assert storage.get_active_node("scenario") == nodes[0]
+
+
+def test_branches_and_listing(storage: StorageBackend):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    main = play(storage, seed_node(), 3, start)
+    branch = play(storage, main[0], 2, start + datetime.timedelta(hours=1))
+    play(storage, seed_node("other"), 1, start + datetime.timedelta(hours=2))
+
+    assert [child.node_id for child in storage.list_children(main[0].id)] == [
+        branch[0].id,
+        main[1].id,
+    ]
+    assert [game.scenario_id for game in storage.list_games()] == [
+        "other",
+        "scenario",
+    ]
+    (first,) = storage.list_games(limit=1)
+    assert [game.scenario_id for game in storage.list_games(after=first)] == [
+        "scenario"
+    ]
+
+    storage.delete_game("scenario").result()
+    assert storage.get_active_node("scenario") is None
+    assert storage.list_all_time_nodes("scenario") == []
+    assert [game.scenario_id for game in storage.list_games()] == ["other"]
+
+
+def test_search(storage: StorageBackend):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    nodes = play(storage, seed_node(), 3, start)
+
+    results = storage.search("scenario", "action 1!")
+    assert {(r.node_id, r.source, r.label) for r in results} == {
+        (nodes[1].id, "log", "player"),
+        (nodes[1].id, "log", "game"),
+    }
+    assert all("[1]" in r.snippet for r in results)
+    assert {r.node_id for r in storage.search("scenario", '"clue number 2"')} == {
+        nodes[2].id
+    }
+    assert storage.search("scenario", "zantar nowhere") == []
+    for empty in ["", '"', '""', "   "]:
+        assert storage.search("scenario", empty) == []
+
+
+def test_async_reads_and_writes(storage: StorageBackend):
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    main = play(storage, seed_node(), 2, start)
+    branch = play(storage, main[0], 1, start + datetime.timedelta(hours=1))
+
+    async def run():
+        await storage.set_active_node_async("scenario", main[-1].id)
+        return (
+            await storage.get_active_node_async("scenario"),
+            await storage.get_node_async(branch[0].id, "scenario"),
+            await storage.list_children_async(main[0].id, "scenario"),
+        )
+
+    active, node, children = asyncio.run(run())
+    assert active == main[-1]
+    assert node == branch[0]
+    assert [child.node_id for child in children] == [branch[0].id, main[1].id]
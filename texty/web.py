@@ -4,12 +4,15 @@ import random
 import uuid
 import gradio as gr
 from textwrap import dedent
-from typing import Callable, Dict, Iterator, List, Optional, TypedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, TypedDict
 
 from pydantic import TypeAdapter
-from texty import database, seeds
-from texty.game import AdvanceTimeProgress, Game, StatusUpdate, TextResponse
-from texty.gametypes import GameElement, TimeNode
+from texty import seeds
+from texty.database import GameListing
+from texty.storage import get_storage
+from texty.async_game import AsyncGame
+from texty.game import AdvanceTimeProgress, StatusUpdate, TextResponse, commit_pending
+from texty.gametypes import GameElement
 
 
 @dataclass
@@ -71,13 +74,15 @@ class GradioInterface:
         self.game = None
         self.game_output = GameOutput()
 
-    def initialize_game(self, scenario_id: str, seed_name: str) -> Iterator[GameOutput]:
-        database.init_db()
-        self.game = Game(scenario_id=scenario_id)
+    async def initialize_game(
+        self, scenario_id: str, seed_name: str
+    ) -> AsyncIterator[GameOutput]:
+        self.game = AsyncGame(scenario_id=scenario_id)
+        self.game.storage.init()
         self.game_output = GameOutput()
 
         seed = getattr(seeds, seed_name, seeds.zantar)
-        for event in self.game.start_if_not_started(seed=seed):
+        async for event in self.game.start_if_not_started(seed=seed):
             if isinstance(event, StatusUpdate):
                 self.game_output.append_event_log_delta(event.status, event.debug)
                 yield self.game_output
@@ -93,28 +98,27 @@ class GradioInterface:
                     yield self.game_output
         else:
             self.game_output.add_history(self.game_output.inprogress)
-        return self.game_output
 
     def delete_game(self):
         if self.game:
-            database.delete_game(self.game.scenario_id)
+            self.game.storage.delete_game(self.game.scenario_id)
         self.game = None
 
-    def process_command(self, command: str) -> Iterator[GameOutput]:
+    async def process_command(self, command: str) -> AsyncIterator[GameOutput]:
         if not self.game:
-            return "Error: Please initialize the game first."
+            return
         if not command:
             return
 
         if command.startswith("/"):
-            self.handle_special_command(command)
+            await self.handle_special_command(command)
             yield self.game_output
             return
 
         self.game_output.add_history(Message(role="player", content=command))
         self.game_output.append_response_delta("game", "")
         yield self.game_output
-        for event in self.game.step(command):
+        async for event in self.game.step(command):
             if isinstance(event, StatusUpdate):
                 self.game_output.append_event_log_delta(event.status, event.debug)
                 yield self.game_output
@@ -123,13 +127,13 @@ class GradioInterface:
                 yield self.game_output
 
         self.game_output.add_history(self.game_output.inprogress)
-        return self.game_output
 
-    def handle_special_command(self, command: str) -> str:
+    async def handle_special_command(self, command: str) -> str:
         if command == "/undo":
             message = "Can't go back. No parent node found"
-            if self.game.undo():
-                message = f"Loaded {self.game.node.id}: {self.game.node.summary}"
+            if await self.game.undo():
+                node = await self.game.current_node()
+                message = f"Loaded {node.id}: {node.summary}"
             self.game_output.add_history(Message(role="System", content=message))
         elif command == "/help":
             help_text = dedent(
@@ -157,6 +161,9 @@ class ScenarioState(TypedDict):
 
 list_adapter = TypeAdapter(List[GameElement])
 
+# number of games loaded into the game table at a time
+GAMES_PAGE_SIZE = 20
+
 SCROLL_BOTTOM = """
 function () {
     const maxTime = 2000;
@@ -175,7 +182,8 @@ function () {
 """
 
 with gr.Blocks(title="Texty") as demo:
-    database.init_db()
+    get_storage().init()
+    get_storage().start_background_compaction()
     gradio_game = GradioInterface()
 
     NONE = None
@@ -186,14 +194,18 @@ with gr.Blocks(title="Texty") as demo:
 
         show_debug_default = False
 
-        def advance_game(command):
+        async def advance_game(command):
             yield {command_input: ""}
-            for update in gradio_game.process_command(command):
-                yield {
+            async for update in gradio_game.process_command(command):
+                outputs = {
                     syslog: update.event_log,
                     chat: update.get_response_tuples(),
-                    json_view: (gradio_game.game.node.model_dump_json()),
                 }
+                # while a turn commits, the json view keeps the node before it rather than holding up the ui
+                if not commit_pending(gradio_game.game.scenario_id):
+                    node = await gradio_game.game.current_node()
+                    outputs[json_view] = node.model_dump_json()
+                yield outputs
 
         with gr.Column():
             with gr.Row():
@@ -226,10 +238,28 @@ with gr.Blocks(title="Texty") as demo:
                 # init_button = gr.Button("Initialize Game")
             with gr.Row():
                 json_view = gr.JSON(visible=show_debug_default)
+            with gr.Row():
+                search_input = gr.Textbox(
+                    label="Search History",
+                    placeholder="Find the turn where something happened",
+                )
+            search_results = gr.DataFrame(
+                [],
+                headers=["Timestep", "From", "Match", "Node ID"],
+                interactive=False,
+            )
+
+        def search_history(query: str):
+            if not query.strip() or not gradio_game.game:
+                return []
+            return [
+                [result.timestep, result.label, result.snippet, result.node_id]
+                for result in get_storage().search(gradio_game.game.scenario_id, query)
+            ]
 
-        def stream_updates_on_change(state: "ScenarioState"):
+        async def stream_updates_on_change(state: "ScenarioState"):
             if state != NONE:
-                for update in gradio_game.initialize_game(
+                async for update in gradio_game.initialize_game(
                     state["scenario_id"], state["seed"]
                 ):
                     yield {
@@ -276,14 +306,12 @@ with gr.Blocks(title="Texty") as demo:
                 new_game_button = gr.Button("New Game", variant="primary")
             games = gr.State(None)
 
-            def transform_rows(
-                rows: Optional[List[tuple[datetime.datetime, TimeNode]]]
-            ):
+            def transform_rows(rows: Optional[List[GameListing]]):
                 if not rows:
                     return []
                 else:
                     return [
-                        [row[0], row[1].timestep, row[1].summary, row[1].id]
+                        [row.last_updated, row.timestep, row.summary, row.node_id]
                         for row in rows
                     ]
 
@@ -293,24 +321,34 @@ with gr.Blocks(title="Texty") as demo:
                 interactive=False,
                 visible=True,
             )
+            load_more_button = gr.Button("Load More")
             games.change(transform_rows, inputs=games, outputs=game_table)
 
             def load_games(scenario_id: Optional[ScenarioState]):
                 if not scenario_id:
-                    return database.list_games()  # , gr.update(visible=True)
+                    return get_storage().list_games(limit=GAMES_PAGE_SIZE)
                 else:
                     return None
 
+            def load_more_games(games: Optional[List[GameListing]]):
+                if not games:
+                    return get_storage().list_games(limit=GAMES_PAGE_SIZE)
+                return games + get_storage().list_games(
+                    limit=GAMES_PAGE_SIZE, after=games[-1]
+                )
+
             demo.load(load_games, inputs=scenario_id_state, outputs=[games])
             scenario_id_state.change(
                 load_games, inputs=scenario_id_state, outputs=[games]
             )
+            load_more_button.click(load_more_games, inputs=games, outputs=[games])
 
             def select_game(games, evt: gr.SelectData, seed: str):
-                game = games[evt.index[0]]
-                scenario_id = game[1].scenario_id()
+                game: GameListing = games[evt.index[0]]
                 return {
-                    scenario_id_state: ScenarioState(scenario_id=scenario_id, seed=seed)
+                    scenario_id_state: ScenarioState(
+                        scenario_id=game.scenario_id, seed=seed
+                    )
                 }
 
             def new_game(seed):
@@ -357,6 +395,8 @@ with gr.Blocks(title="Texty") as demo:
 
     show_log.change(fn=toggle_log, inputs=show_log, outputs=[syslog, json_view])
 
+    search_input.submit(search_history, inputs=search_input, outputs=search_results)
+
     submit_button.click(
         fn=advance_game,
         inputs=command_input,